@@ -6,6 +6,7 @@ const API_BASE = 'http://192.168.56.1:8000';
 interface ApiResponse<T = any> {
   data?: T;
   error?: string;
+  status?: number; // HTTP status when the server answered with an error
 }
 
 class ApiService {
@@ -40,7 +41,7 @@ class ApiService {
 
       if (!response.ok) {
         const error = await response.json();
-        return { error: error.detail || 'Request failed' };
+        return { error: error.detail || 'Request failed', status: response.status };
       }
 
       const data = await response.json();
@@ -89,6 +90,52 @@ class ApiService {
     });
   }
 
+  // Streams /analyze_food/stream (SSE): onEvent fires for "name", "description",
+  // then "result" (same body as analyzeFood) or "error".
+  analyzeFoodStream(imageBlob: Blob, onEvent: (event: string, data: any) => void): Promise<void> {
+    const formData = new FormData();
+    formData.append('image', imageBlob, 'food.jpg');
+
+    return new Promise((resolve) => {
+      const xhr = new XMLHttpRequest();
+      let seen = 0;
+
+      const flush = () => {
+        const text = xhr.responseText;
+        let end = text.indexOf('\n\n', seen);
+        while (end !== -1) {
+          const block = text.slice(seen, end);
+          seen = end + 2;
+          const event = block.match(/^event: (.*)$/m)?.[1];
+          const data = block.match(/^data: (.*)$/m)?.[1];
+          if (event && data) {
+            onEvent(event, JSON.parse(data));
+          }
+          end = text.indexOf('\n\n', seen);
+        }
+      };
+
+      xhr.open('POST', `${this.baseUrl}/analyze_food/stream`);
+      if (this.currentUser) {
+        xhr.setRequestHeader('X-Username', this.currentUser);
+      }
+      xhr.onprogress = flush;
+      xhr.onload = () => {
+        if (xhr.status >= 400) {
+          onEvent('error', { error: 'Request failed' });
+        } else {
+          flush();
+        }
+        resolve();
+      };
+      xhr.onerror = () => {
+        onEvent('error', { error: 'Network error' });
+        resolve();
+      };
+      xhr.send(formData);
+    });
+  }
+
   async logFoodDirect(imageBlob: Blob) {
     const formData = new FormData();
     formData.append('image', imageBlob, 'food.jpg');
@@ -103,11 +150,49 @@ class ApiService {
     type: string;
     description: string;
     calories: number;
+    analysis_id?: string;
   }) {
+    // Prefer the server-side cached analysis; fall back to the full result only if the
+    // server doesn't know the id (404). Any other failure may have logged it already, and
+    // retrying with the same id is safe - resending the full result is not.
+    if (foodData.analysis_id) {
+      const cached = await this.request('/log_previous', {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ analysis_id: foodData.analysis_id }),
+      });
+      if (cached.status !== 404) {
+        return cached;
+      }
+    }
+
+    const { analysis_id, ...fullResult } = foodData;
     return this.request('/log_previous', {
       method: 'POST',
       headers: { 'Content-Type': 'application/json' },
-      body: JSON.stringify(foodData),
+      body: JSON.stringify(fullResult),
+    });
+  }
+
+  // Food history endpoints (no photo / AI call needed)
+  async searchFoodHistory(query: string = '', limit: number = 10) {
+    const params = new URLSearchParams({ q: query, limit: String(limit) });
+    return this.request(`/food_history/search?${params.toString()}`);
+  }
+
+  async relogFood(logId: number) {
+    return this.request('/food_history/relog', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ log_id: logId }),
+    });
+  }
+
+  async logUsual(meal?: 'breakfast' | 'lunch' | 'dinner' | 'snack') {
+    return this.request('/log_usual', {
+      method: 'POST',
+      headers: { 'Content-Type': 'application/json' },
+      body: JSON.stringify({ meal }),
     });
   }
 
@@ -122,6 +207,20 @@ class ApiService {
     });
   }
 
+  // Persistent voice channel: send audio chunks with socket.send(chunk), then
+  // socket.send(JSON.stringify({ type: 'end' })). Replies arrive in onmessage
+  // as {type: 'result' | 'error', ...}. "log it" / "stop my run" are resolved
+  // server-side from the last analyzed food and running workout.
+  openVoiceSocket(onMessage: (message: any) => void): WebSocket | null {
+    if (!this.currentUser) {
+      return null;
+    }
+    const wsBase = this.baseUrl.replace(/^http/, 'ws');
+    const socket = new WebSocket(`${wsBase}/ws/voice?username=${encodeURIComponent(this.currentUser)}`);
+    socket.onmessage = (event) => onMessage(JSON.parse(event.data));
+    return socket;
+  }
+
   // Stats endpoints
   async getDailySummary() {
     return this.request('/summary');
@@ -139,6 +238,17 @@ class ApiService {
     return this.request('/streak_data');
   }
 
+  // Daily / weekly / monthly progress over the last `days` days
+  async getTrends(days: number = 90) {
+    return this.request(`/trends?days=${days}`);
+  }
+
+  // Delta sync: rows changed since `cursor` (keep the returned cursor, repeat while has_more)
+  async sync(cursor: number = 0, limit: number = 500) {
+    const params = new URLSearchParams({ since: String(cursor), limit: String(limit) });
+    return this.request(`/sync?${params.toString()}`);
+  }
+
   // Exercise endpoints
   async startExercise(exerciseType: string = 'running') {
     return this.request('/exercise', {
@@ -0,0 +1,161 @@
+# admission.py - Per-user rate limiting + global concurrency cap for LLM endpoints
+#
+# Two layers, applied as a FastAPI dependency (Depends(admit("llm"))), or with
+# `async with admitted(key, "llm")` where there's no request (WebSocket voice):
+#   1. Token bucket per (user, endpoint class) - one user can't hog the model.
+#   2. Global cap on concurrent model-backed requests with a bounded wait
+#      queue - bursts queue briefly, and once the queue is full we answer
+#      429 + Retry-After immediately instead of piling up threads.
+#
+# Env (defaults in brackets):
+#   LLM_HEAVY_RATE_PER_MIN [2]   LLM_HEAVY_BURST [2]    /create_meal_plan
+#   LLM_RATE_PER_MIN [20]        LLM_BURST [10]         /analyze_food, /log_food_direct, /voice_command
+#   LLM_MAX_CONCURRENT [16]      LLM_MAX_QUEUE [32]     LLM_QUEUE_TIMEOUT_S [10]
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Optional
+
+from fastapi import Header, HTTPException, Request
+
+from metrics import counter, gauge
+
+admission_rejections = counter(
+    "admission_rejections_total", "Requests rejected by admission control", ("endpoint_class", "reason"))
+llm_slots_in_use = gauge("llm_requests_in_flight", "Model-backed requests currently running")
+llm_slots_waiting = gauge("llm_requests_queued", "Model-backed requests waiting for a slot")
+
+
+class TokenBucket:
+    """Classic token bucket: `rate` tokens/second, holds at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def try_acquire(self) -> float:
+        """Takes a token. Returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+class RateLimiter:
+    """Token buckets keyed by (user, endpoint class), LRU-bounded so idle users don't leak memory."""
+
+    def __init__(self, limits: dict, max_keys: int = 10000):
+        self.limits = limits  # endpoint class -> (rate_per_second, burst)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def check(self, key: str, endpoint_class: str) -> float:
+        rate, burst = self.limits[endpoint_class]
+        with self._lock:
+            bucket_key = (key, endpoint_class)
+            bucket = self._buckets.get(bucket_key)
+            if bucket is None:
+                bucket = self._buckets[bucket_key] = TokenBucket(rate, burst)
+                if len(self._buckets) > self.max_keys:
+                    self._buckets.popitem(last=False)
+            else:
+                self._buckets.move_to_end(bucket_key)
+            return bucket.try_acquire()
+
+
+class ConcurrencyLimiter:
+    """At most `max_concurrent` holders; at most `max_queue` waiters, each for up to `timeout` seconds."""
+
+    def __init__(self, max_concurrent: int, max_queue: int, timeout: float):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.in_use = 0
+        self.waiting = 0
+        self._semaphore = None  # created lazily inside the running event loop
+
+    async def acquire(self) -> bool:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            return False
+        self.waiting += 1
+        llm_slots_waiting.set(self.waiting)
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=self.timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            self.waiting -= 1
+            llm_slots_waiting.set(self.waiting)
+        self.in_use += 1
+        llm_slots_in_use.set(self.in_use)
+        return True
+
+    def release(self):
+        self.in_use -= 1
+        llm_slots_in_use.set(self.in_use)
+        self._semaphore.release()
+
+    def retry_after(self) -> int:
+        # Rough guess: the queue drains in about one timeout window
+        return max(1, int(self.timeout))
+
+
+def _per_second(env_name: str, default_per_min: float) -> float:
+    return float(os.getenv(env_name, default_per_min)) / 60.0
+
+
+rate_limiter = RateLimiter({
+    "llm_heavy": (_per_second("LLM_HEAVY_RATE_PER_MIN", 2), float(os.getenv("LLM_HEAVY_BURST", 2))),
+    "llm": (_per_second("LLM_RATE_PER_MIN", 20), float(os.getenv("LLM_BURST", 10))),
+})
+
+llm_concurrency = ConcurrencyLimiter(
+    max_concurrent=int(os.getenv("LLM_MAX_CONCURRENT", 16)),
+    max_queue=int(os.getenv("LLM_MAX_QUEUE", 32)),
+    timeout=float(os.getenv("LLM_QUEUE_TIMEOUT_S", 10)),
+)
+
+
+def _too_many(endpoint_class: str, reason: str, retry_after: float, detail: str):
+    admission_rejections.inc(endpoint_class=endpoint_class, reason=reason)
+    return HTTPException(status_code=429, detail=detail,
+                         headers={"Retry-After": str(max(1, math.ceil(retry_after)))})
+
+
+@asynccontextmanager
+async def admitted(key: str, endpoint_class: str):
+    """Rate limit `key`, then hold a global LLM slot for the block. Raises HTTPException(429)."""
+    wait = rate_limiter.check(key, endpoint_class)
+    if wait > 0:
+        raise _too_many(endpoint_class, "rate_limited", wait,
+                        "Too many requests - please wait a moment and try again.")
+    if not await llm_concurrency.acquire():
+        raise _too_many(endpoint_class, "queue_full", llm_concurrency.retry_after(),
+                        "The server is busy - please try again shortly.")
+    try:
+        yield
+    finally:
+        llm_concurrency.release()
+
+
+def admit(endpoint_class: str):
+    """FastAPI dependency factory: rate limit per user, then take a global LLM slot."""
+
+    async def dependency(request: Request, x_username: Optional[str] = Header(None)):
+        key = (x_username or "").lower().strip() or f"ip:{request.client.host if request.client else '-'}"
+        async with admitted(key, endpoint_class):
+            yield
+
+    return dependency
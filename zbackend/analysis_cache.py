@@ -0,0 +1,220 @@
+# analysis_cache.py - Recent /analyze_food results, so "log it" can log by id
+#
+# /analyze_food stores its result here and returns an analysis_id; the client
+# only sends that id back to /log_previous instead of the whole (untrusted)
+# result. Entries expire after ANALYSIS_CACHE_TTL_S and the cache holds at most
+# ANALYSIS_CACHE_MAX_ENTRIES (least recently used evicted first).
+#
+# With one worker this is purely in memory: an id from before a restart is
+# simply a miss, and the client falls back to sending the full result. With
+# several workers (WEB_CONCURRENCY > 1) entries are also written to the
+# analysis_cache table so /log_previous can land on any worker.
+#
+# The voice channel's "log it" means the user's newest analysis that isn't
+# logged yet (latest()), so it works whichever worker ran /analyze_food.
+#
+# Logging an entry is claimed first (log_id = PENDING, under the lock or with a
+# conditional UPDATE in shared mode), so two concurrent "log it"s for the same
+# analysis insert one row between them.
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from db import WORKERS, get_db
+from metrics import counter
+
+TTL_SECONDS = float(os.getenv("ANALYSIS_CACHE_TTL_S", "900"))
+MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "20000"))
+PENDING = -1  # log_id while some request is inserting the log row
+
+analysis_cache_lookups = counter("analysis_cache_lookups_total", "analysis_id lookups by /log_previous", ("result",))
+
+
+def init_analysis_cache(conn: sqlite3.Connection):
+    """Shared copy of the cache for multi-worker deployments."""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS analysis_cache (
+            analysis_id TEXT PRIMARY KEY,
+            username TEXT,
+            food TEXT NOT NULL,
+            log_id INTEGER,
+            expires_at REAL NOT NULL    -- unix seconds
+        )
+    """)
+    conn.execute("DELETE FROM analysis_cache WHERE expires_at < ?", (time.time(),))
+    conn.commit()
+
+
+class AnalysisCache:
+    def __init__(self, ttl: float = TTL_SECONDS, max_entries: int = MAX_ENTRIES, shared: bool = WORKERS > 1):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.shared = shared
+        self._entries = OrderedDict()  # analysis_id -> [expires_at, username, food, log_id]
+        self._lock = threading.Lock()
+
+    def put(self, username: str, food: dict) -> str:
+        # Entries always have an owner: an anonymous one would be handed to whoever asks for the id
+        if not username:
+            raise ValueError("analysis_cache.put needs a username")
+        analysis_id = secrets.token_urlsafe(12)
+        owner = username.lower().strip()
+        self._remember(analysis_id, owner, food, None, self.ttl)
+        if self.shared:
+            conn = get_db()
+            try:
+                conn.execute("DELETE FROM analysis_cache WHERE expires_at < ?", (time.time(),))
+                conn.execute(
+                    "INSERT INTO analysis_cache (analysis_id, username, food, expires_at) VALUES (?, ?, ?, ?)",
+                    (analysis_id, owner, json.dumps(food), time.time() + self.ttl)
+                )
+                conn.commit()
+            finally:
+                conn.close()
+        return analysis_id
+
+    def _remember(self, analysis_id: str, owner: Optional[str], food: dict, log_id: Optional[int], ttl: float):
+        with self._lock:
+            self._entries[analysis_id] = [time.monotonic() + ttl, owner, food, log_id]
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def _load_shared(self, analysis_id: str) -> Optional[list]:
+        conn = get_db()
+        try:
+            row = conn.execute(
+                "SELECT username, food, log_id, expires_at FROM analysis_cache WHERE analysis_id = ? AND expires_at >= ?",
+                (analysis_id, time.time())
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        self._remember(analysis_id, row[0], json.loads(row[1]), row[2], row[3] - time.time())
+        return self._entries.get(analysis_id)
+
+    def get(self, username: str, analysis_id: str) -> Optional[tuple]:
+        """(food, log_id or None) for this user's analysis, or None if unknown/expired."""
+        with self._lock:
+            entry = self._entries.get(analysis_id)
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[analysis_id]
+                entry = None
+        if self.shared and (entry is None or entry[3] in (None, PENDING)):
+            # Another worker may have created it, or logged it since we last looked
+            entry = self._load_shared(analysis_id) or entry
+        with self._lock:
+            if entry is None or entry[1] != username.lower().strip():
+                analysis_cache_lookups.inc(result="miss")
+                return None
+            if analysis_id in self._entries:
+                self._entries.move_to_end(analysis_id)
+            analysis_cache_lookups.inc(result="hit")
+            return entry[2], entry[3]
+
+    def latest(self, username: str) -> Optional[str]:
+        """The user's newest analysis that hasn't been logged, or None."""
+        owner = username.lower().strip()
+        if self.shared:
+            conn = get_db()
+            try:
+                row = conn.execute("""
+                    SELECT analysis_id FROM analysis_cache
+                    WHERE username = ? AND (log_id IS NULL OR log_id = ?) AND expires_at >= ?
+                    ORDER BY expires_at DESC LIMIT 1
+                """, (owner, PENDING, time.time())).fetchone()
+            finally:
+                conn.close()
+            return row[0] if row else None
+        now = time.monotonic()
+        with self._lock:
+            pending = [(entry[0], analysis_id) for analysis_id, entry in self._entries.items()
+                       if entry[1] == owner and entry[3] in (None, PENDING) and entry[0] >= now]
+        return max(pending)[1] if pending else None
+
+    def claim(self, username: str, analysis_id: str) -> Optional[tuple]:
+        """
+        (food, log_id, claimed) for this user's analysis, or None if unknown/expired.
+        claimed=True means the caller logs it and then calls mark_logged() (or
+        release() if that failed); otherwise log_id is the existing row or PENDING.
+        """
+        cached = self.get(username, analysis_id)
+        if cached is None:
+            return None
+        food, log_id = cached
+        if log_id is not None:
+            return food, log_id, False
+        if self.shared:
+            conn = get_db()
+            try:
+                claimed = conn.execute(
+                    "UPDATE analysis_cache SET log_id = ? WHERE analysis_id = ? AND log_id IS NULL",
+                    (PENDING, analysis_id)
+                ).rowcount == 1
+                conn.commit()
+            finally:
+                conn.close()
+            if not claimed:
+                cached = self.get(username, analysis_id)  # someone else got there first
+                return food, cached[1] if cached else PENDING, False
+        with self._lock:
+            entry = self._entries.get(analysis_id)
+            if self.shared:
+                if entry is not None:
+                    entry[3] = PENDING
+                return food, None, True
+            if entry is None:
+                return None  # evicted since get()
+            if entry[3] is not None:
+                return food, entry[3], False
+            entry[3] = PENDING
+            return food, None, True
+
+    def release(self, analysis_id: str):
+        """Gives up a claim whose insert failed, so the analysis can be logged again."""
+        with self._lock:
+            entry = self._entries.get(analysis_id)
+            if entry is not None and entry[3] == PENDING:
+                entry[3] = None
+        if self.shared:
+            conn = get_db()
+            try:
+                conn.execute("UPDATE analysis_cache SET log_id = NULL WHERE analysis_id = ? AND log_id = ?",
+                             (analysis_id, PENDING))
+                conn.commit()
+            finally:
+                conn.close()
+
+    def mark_latest_logged(self, username: str, description: str, calories: int, log_id: int):
+        """A resent result was logged: if it's the user's newest pending analysis, that one is logged too."""
+        analysis_id = self.latest(username)
+        claim = self.claim(username, analysis_id) if analysis_id else None
+        if claim is None or not claim[2]:
+            return
+        food = claim[0]
+        if food["description"] == description and int(food["calories"]) == int(calories):
+            self.mark_logged(analysis_id, log_id)
+        else:
+            self.release(analysis_id)
+
+    def mark_logged(self, analysis_id: str, log_id: int):
+        """Remember the log row so a retried request doesn't log the food twice."""
+        with self._lock:
+            entry = self._entries.get(analysis_id)
+            if entry is not None:
+                entry[3] = log_id
+        if self.shared:
+            conn = get_db()
+            try:
+                conn.execute("UPDATE analysis_cache SET log_id = ? WHERE analysis_id = ?", (log_id, analysis_id))
+                conn.commit()
+            finally:
+                conn.close()
+
+
+analysis_cache = AnalysisCache()
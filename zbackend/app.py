@@ -1,10 +1,20 @@
 # app.py - True MVP: Voice Router + Simple Endpoints
-from fastapi import FastAPI, UploadFile, File, Header, HTTPException, BackgroundTasks
-from typing import Optional, Literal
+#
+# Built by create_app(): importing this module only defines routes. Schema
+# setup, crash recovery and background workers run in the lifespan, the
+# OpenAI client is created on first use, and app_cold_start_seconds records
+# how long a worker took from import to serving. Run several workers with
+# WEB_CONCURRENCY=N (see db.py for what changes when N > 1).
+import time
+_IMPORT_STARTED = time.perf_counter()
+
+from fastapi import APIRouter, FastAPI, UploadFile, File, Header, HTTPException, BackgroundTasks, Request, Depends, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from typing import List, Optional, Literal
 import sqlite3
-from openai import OpenAI
 import base64
 import asyncio
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -17,24 +27,132 @@ import os
 from pydantic import BaseModel, Field
 import re
 
-app = FastAPI()
+from admission import admit, admitted
+from db import get_db, init_lock
+from logging_setup import setup_logging, get_logger, request_id_var, new_request_id
+from llm import chat_completion, achat_completion, astream_chat_completion, transcribe
+from circuit_breaker import CircuitOpenError, snapshot as circuit_snapshot
+from model_router import route, unavailable, routing_table
+from prompt_compact import fit_prompt, table, meal_plan_rows, shopping_list_rows, token_usage
+from intent_rules import classify_intent_locally
+from analysis_cache import PENDING as PENDING_LOG, analysis_cache, init_analysis_cache
+from log_writer import log_writer
+from fast_json import FastJSONResponse, CompressionMiddleware, dumps, raw_json, json_object, json_array
+from metrics import REGISTRY, app_cold_start_seconds, http_request_seconds, background_queue_depth, background_task_seconds, request_profiles, span
+import profiling
+from pricing import PriceCatalog, init_price_catalog, optimize_shopping_list
+from nutrition import init_nutrition_db, lookup_macros, lookup_metrics
+from exercise import init_exercise, samples_to_array, append_samples, load_samples, compute_session, MET_TABLE
+from exercise_sessions import ActiveSession, active_sessions, run_sweeper
+from archive import init_archive, log_source, run_archiver
+from sync import init_sync, prune_tombstones, changes_since
+from trends import init_trends, compute_trends
+from meal_plan_index import init_meal_plan_index, meal_plan_index, adapt_plan
+from food_history import init_food_history, search_history, find_usual, relog, meal_from_text, MEAL_WINDOWS
+
+router = APIRouter()
 
 load_dotenv()
-client = OpenAI(api_key=os.getenv("OPENAI"))
-
-#CORS
-# Add CORS middleware - CRITICAL for frontend to work
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+setup_logging()
+logger = get_logger("app")
+
+client = None  # created by get_client() on first use (importing openai is the slowest part of startup)
+
+
+def get_client():
+    global client
+    if client is None:
+        from openai import OpenAI
+        # Short timeout + one retry: a hung model call should fail fast and count against its circuit breaker
+        client = OpenAI(
+            api_key=os.getenv("OPENAI"),
+            timeout=float(os.getenv("OPENAI_TIMEOUT_S", "30")),
+            max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "1"))
+        )
+    return client
+
+# Request latency per route (route template, not raw path, to keep label cardinality low)
+async def record_request_metrics(request: Request, call_next):
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        route = request.scope.get("route")
+        http_request_seconds.observe(
+            time.perf_counter() - started,
+            method=request.method,
+            route=getattr(route, "path", "unmatched"),
+            status=status
+        )
+
+# Request id for log correlation (taken from X-Request-ID when the client sends one)
+async def assign_request_id(request: Request, call_next):
+    request_id = request.headers.get("x-request-id") or new_request_id()
+    token = request_id_var.set(request_id)
+    try:
+        response = await call_next(request)
+        response.headers["X-Request-ID"] = request_id
+        return response
+    finally:
+        request_id_var.reset(token)
+
+# Opt-in profiling (X-Profile: <admin token>, or PROFILE_SAMPLE_RATE; see profiling.py).
+# The profile ends with the last body chunk so streamed responses are covered too.
+_profile_writes = set()  # keeps report writes referenced until they finish
+
+
+def _save_profile(report: dict):
+    conn = get_db()
+    try:
+        profiling.save_profile(conn, report)
+    finally:
+        conn.close()
+
+
+def _finish_profile(profile, request: Request, status: int):
+    report = profiling.finish(profile, status, getattr(request.scope.get("route"), "path", "unmatched"))
+    request_profiles.inc(trigger=profile.trigger)
+    task = asyncio.get_running_loop().create_task(asyncio.to_thread(_save_profile, report))
+    _profile_writes.add(task)
+    task.add_done_callback(_profile_writes.discard)
+
+
+async def profile_request(request: Request, call_next):
+    trigger = profiling.trigger_for(request.headers.get("x-profile"))
+    if trigger is None:
+        return await call_next(request)
+    profile, token = profiling.start(request_id_var.get(), request.method, request.url.path, trigger)
+    try:
+        response = await call_next(request)
+    except BaseException:
+        _finish_profile(profile, request, 500)
+        raise
+    finally:
+        profiling.detach(token)
+    response.headers["X-Profile-Id"] = profile.request_id
+    body = response.body_iterator
+
+    async def profiled_body():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            _finish_profile(profile, request, response.status_code)
+
+    response.body_iterator = profiled_body()
+    return response
 
 # Simple DB setup
 def init_db():
-    conn = sqlite3.connect("fitness.db")
+    # Workers starting together would race each other's CREATE/ALTER statements
+    with init_lock():
+        _init_schema()
+
+def _init_schema():
+    conn = get_db()
     cursor = conn.cursor()
 
     # Create users' 
@@ -94,10 +212,47 @@ def init_db():
         )
     """)
 
+    # Local grocery prices for the budget optimizer
+    init_price_catalog(conn)
+
+    # Local nutrition reference (checked before any macro LLM call)
+    init_nutrition_db(conn)
+
+    # Full-text index over users' food history (search + quick relog)
+    init_food_history(conn)
+
+    # Per-activity METs + packed session samples
+    init_exercise(conn)
+
+    # Archive watermarks/manifest (the sync and rollup triggers check archive_state)
+    init_archive(conn)
+
+    # Change sequence numbers + tombstones for /sync
+    init_sync(conn)
+    prune_tombstones(conn)
+
+    # Per-day totals behind /trends
+    init_trends(conn)
+
+    # Profile vectors for reusing plans across similar users
+    init_meal_plan_index(conn)
+
+    # Shared copy of /analyze_food results (multi-worker only)
+    init_analysis_cache(conn)
+
+    # Stored request profiles for /admin/profiles
+    profiling.init_profiling(conn)
+
     conn.commit()
     conn.close()
 
-init_db()
+
+def recover_sessions():
+    conn = get_db()
+    try:
+        return active_sessions.load(conn)  # sessions left running before a restart
+    finally:
+        conn.close()
 
 
 # Define a Pydantic model for the incoming data
@@ -115,10 +270,28 @@ class User(BaseModel):
 class LoginRequest(BaseModel):
     username: str
 
+class RelogRequest(BaseModel):
+    log_id: int
+
+class UsualRequest(BaseModel):
+    meal: Optional[str] = None  # breakfast | lunch | dinner | snack, defaults to time of day
+
 class ExerciseRequest(BaseModel):
     action: Literal['start', 'stop']
     session_id: int | None = None # session_id is only needed for the 'stop' action
-    exercise_type: str = 'running' # Add this with a default value for now
+    exercise_type: str = 'running' # see MET_TABLE in exercise.py
+    intensity: Optional[Literal['low', 'moderate', 'high']] = None
+
+class ExerciseSample(BaseModel):
+    ts: Optional[float] = None     # unix seconds, or...
+    t: Optional[float] = None      # ...seconds since the session started
+    hr: Optional[float] = None     # heart rate, bpm
+    speed: Optional[float] = None  # m/s
+    lat: Optional[float] = None
+    lon: Optional[float] = None
+
+class ExerciseSamplesRequest(BaseModel):
+    samples: List[ExerciseSample]
 
 
 # =============================================================================
@@ -128,22 +301,14 @@ class ExerciseRequest(BaseModel):
 class MealPlanAgent:
     """Agent 1: Generates weekly meal plan based on user data"""
     
-    def __init__(self, openai_client):
-        self.client = openai_client
-    
-    async def generate_plan(self, user_data):
-        """Generate meal plan from user preferences and history"""
-        
-        # Prepare context from user's food history
-        food_context = self._build_food_context(user_data.get('food_history', []))
-        
-        prompt = f"""
+    PROMPT = """
         Create a 7-day meal plan for a user with these preferences:
-        - Goal: {user_data.get('goal', 'maintain')}
-        - Budget: ${user_data.get('budget', 100)}/week
-        - Allergies: {user_data.get('allergies', 'none')}
-        - Food History: {food_context}
-        - Target Calories: {user_data.get('target_calories', 2000)}/day
+        - Goal: {goal}
+        - Budget: ${budget}/week
+        - Allergies: {allergies}
+        - Target Calories: {target_calories}/day
+        - Recent foods:
+        {history}
         
         Return JSON format:
         {{
@@ -159,40 +324,53 @@ class MealPlanAgent:
             "reasoning": "Why these meals fit the user's profile"
         }}
         """
+    
+    def __init__(self, openai_client):
+        self.client = openai_client
+        self.model_used = None
+        self.tokens = {}
+    
+    async def generate_plan(self, user_data):
+        """Generate meal plan from user preferences and history"""
+        
+        self.model_used = route("meal_plan")
+        prompt, estimate = fit_prompt(
+            "meal_plan", self.PROMPT, self.model_used,
+            goal=user_data.get('goal', 'maintain'),
+            budget=user_data.get('budget', 100),
+            allergies=', '.join(user_data.get('allergies') or []) or 'none',
+            target_calories=user_data.get('target_calories', 2000),
+            history=self._build_food_context(user_data.get('food_history', []))
+        )
         
-        response = await self._call_openai(prompt)
+        response = await self._call_openai(prompt, estimate)
         return json.loads(response)
     
     def _build_food_context(self, food_history):
-        """Summarize user's eating patterns"""
+        """Summarize user's eating patterns as a food|kcal table"""
         if not food_history:
             return "No previous food history"
         
         recent_foods = food_history[-10:]  # Last 10 entries
-        return f"Recent foods: {', '.join([food['description'] for food in recent_foods])}"
+        return table(("food", "kcal"), [(food['description'], food['calories']) for food in recent_foods])
     
-    async def _call_openai(self, prompt: str) -> str:
+    async def _call_openai(self, prompt: str, estimate: int) -> str:
         """Helper method for OpenAI API calls"""
-        response = await asyncio.to_thread(
-            self.client.chat.completions.create,
-            model="o4-mini",
+        response = await achat_completion(
+            self.client, "meal_plan",
+            model=self.model_used,
             messages=[{"role": "user", "content": prompt}],
             response_format={"type": "json_object"}
         )
+        self.tokens = token_usage(response, estimate)
         return response.choices[0].message.content
 
 class ShoppingListAgent:
     """Agent 2: Converts meal plan to consolidated grocery list"""
     
-    def __init__(self, openai_client):
-        self.client = openai_client
-    
-    async def compile_list(self, meal_plan):
-        """Convert meal plan to grocery list with quantities"""
-        
-        prompt = f"""
-        Convert this meal plan to a consolidated grocery list:
-        {json.dumps(meal_plan['week_plan'])}
+    PROMPT = """
+        Convert this meal plan (day|meal|recipe) to a consolidated grocery list:
+        {meals}
         
         Consolidate ingredients (e.g., if multiple recipes need eggs, calculate total needed).
         Estimate realistic quantities for grocery shopping.
@@ -208,33 +386,45 @@ class ShoppingListAgent:
             "shopping_categories": ["produce", "meat", "dairy", "pantry"]
         }}
         """
+    
+    def __init__(self, openai_client):
+        self.client = openai_client
+        self.model_used = None
+        self.tokens = {}
+    
+    async def compile_list(self, meal_plan):
+        """Convert meal plan to grocery list with quantities"""
+        
+        # Only recipe names matter here - calories and prep times are left out
+        self.model_used = route("shopping_list")
+        prompt, estimate = fit_prompt(
+            "shopping_list", self.PROMPT, self.model_used,
+            meals=meal_plan_rows(meal_plan.get('week_plan'), with_calories=False)
+        )
         
-        response = await self._call_openai(prompt)
+        response = await self._call_openai(prompt, estimate)
         return json.loads(response)
     
-    async def _call_openai(self, prompt: str) -> str:
-        response = await asyncio.to_thread(
-            self.client.chat.completions.create,
-            model="o4-mini",
+    async def _call_openai(self, prompt: str, estimate: int) -> str:
+        response = await achat_completion(
+            self.client, "shopping_list",
+            model=self.model_used,
             messages=[{"role": "user", "content": prompt}],
             response_format={"type": "json_object"}
         )
+        self.tokens = token_usage(response, estimate)
         return response.choices[0].message.content
 
 class HealthValidatorAgent:
     """Agent 3: Validates nutritional completeness and safety"""
     
-    def __init__(self, openai_client):
-        self.client = openai_client
-    
-    async def validate_plan(self, meal_plan, shopping_list, user_data):
-        """Analyze nutritional completeness and flag potential issues"""
-        
-        prompt = f"""
+    PROMPT = """
         Analyze this meal plan for nutritional completeness:
-        Meal Plan: {json.dumps(meal_plan)}
-        Shopping List: {json.dumps(shopping_list)}
-        User Info: Goal={user_data.get('goal')}, Allergies={user_data.get('allergies')}
+        Meal Plan:
+        {meals}
+        Shopping List:
+        {groceries}
+        User Info: Goal={goal}, Allergies={allergies}
         
         Check for:
         1. Macro balance (protein/carbs/fats)
@@ -255,67 +445,60 @@ class HealthValidatorAgent:
             "approval_status": "approved|needs_revision"
         }}
         """
-        
-        response = await self._call_openai(prompt)
-        return json.loads(response)
-    
-    async def _call_openai(self, prompt: str) -> str:
-        response = await asyncio.to_thread(
-            self.client.chat.completions.create,
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": prompt}],
-            response_format={"type": "json_object"}
-        )
-        return response.choices[0].message.content
-
-class BudgetOptimizerAgent:
-    """Agent 4: Optimizes shopping list within budget constraints"""
     
     def __init__(self, openai_client):
         self.client = openai_client
+        self.model_used = None
+        self.tokens = {}
     
-    async def optimize_budget(self, shopping_list, health_analysis, budget):
-        """Optimize shopping list for budget while maintaining nutrition"""
-        
-        prompt = f"""
-        Optimize this shopping list within budget ${budget}:
-        Shopping List: {json.dumps(shopping_list)}
-        Health Analysis: {json.dumps(health_analysis)}
-        
-        Priority rules:
-        1. Don't compromise on allergy safety
-        2. Maintain protein adequacy
-        3. Suggest cheaper alternatives for expensive items
-        4. Remove/reduce non-essential items if over budget
+    async def validate_plan(self, meal_plan, shopping_list, user_data):
+        """Analyze nutritional completeness and flag potential issues"""
         
-        Return JSON format:
-        {{
-            "optimized_list": [
-                {{"item": "chicken thighs", "quantity": "2 lbs", "price": 8.99, "substituted_from": "chicken breast"}},
-                // ...
-            ],
-            "total_cost": 0,
-            "savings": 0,
-            "substitutions_made": [
-                {{"original": "chicken breast", "replacement": "chicken thighs", "reason": "50% cost savings, similar protein"}}
-            ],
-            "removed_items": ["expensive_spice"],
-            "budget_status": "under|over|exact"
-        }}
-        """
+        self.model_used = route("health_validation")
+        prompt, estimate = fit_prompt(
+            "health_validation", self.PROMPT, self.model_used,
+            meals=meal_plan_rows(meal_plan.get('week_plan')),
+            groceries=shopping_list_rows(shopping_list),
+            goal=user_data.get('goal'),
+            allergies=', '.join(user_data.get('allergies') or []) or 'none'
+        )
         
-        response = await self._call_openai(prompt)
+        response = await self._call_openai(prompt, estimate)
         return json.loads(response)
     
-    async def _call_openai(self, prompt: str) -> str:
-        response = await asyncio.to_thread(
-            self.client.chat.completions.create,
-            model="gpt-4o-mini",
+    async def _call_openai(self, prompt: str, estimate: int) -> str:
+        response = await achat_completion(
+            self.client, "health_validation",
+            model=self.model_used,
             messages=[{"role": "user", "content": prompt}],
             response_format={"type": "json_object"}
         )
+        self.tokens = token_usage(response, estimate)
         return response.choices[0].message.content
 
+class BudgetOptimizerAgent:
+    """Agent 4: Optimizes shopping list within budget constraints (local solver, no LLM)"""
+    
+    async def optimize_budget(self, shopping_list, health_analysis, budget, allergies=None):
+        """Optimize shopping list for budget while maintaining nutrition"""
+        
+        # Priority rules (enforced by the solver in pricing.py):
+        # 1. Don't compromise on allergy safety
+        # 2. Maintain protein adequacy
+        # 3. Suggest cheaper alternatives for expensive items
+        # 4. Remove/reduce non-essential items if over budget
+        # The DP is pure Python (~100ms for a long list), so it runs off the event loop
+        return await asyncio.to_thread(self._optimize, shopping_list, health_analysis, budget, allergies)
+
+    @staticmethod
+    def _optimize(shopping_list, health_analysis, budget, allergies):
+        conn = get_db()
+        try:
+            catalog = PriceCatalog.load(conn)
+        finally:
+            conn.close()
+        return optimize_shopping_list(shopping_list, health_analysis, budget, allergies, catalog)
+
 class MealPlanOrchestrator:
     """Coordinates all agents and manages the pipeline"""
     
@@ -323,7 +506,7 @@ class MealPlanOrchestrator:
         self.meal_agent = MealPlanAgent(openai_client)
         self.shopping_agent = ShoppingListAgent(openai_client)
         self.health_agent = HealthValidatorAgent(openai_client)
-        self.budget_agent = BudgetOptimizerAgent(openai_client)
+        self.budget_agent = BudgetOptimizerAgent()
     
     async def create_meal_plan(self, user_data):
         """Execute full meal planning pipeline"""
@@ -333,37 +516,56 @@ class MealPlanOrchestrator:
         
         try:
             # Agent 1: Generate meal plan
-            print("Agent 1: Generating meal plan...")
-            meal_plan = await self.meal_agent.generate_plan(user_data)
+            logger.info("meal plan stage started", extra={"fields": {"stage": "generate_plan"}})
+            with span("meal_plan.generate_plan"):
+                meal_plan = await self.meal_agent.generate_plan(user_data)
             pipeline_results['meal_plan'] = meal_plan
             
             # Agent 2: Create shopping list
-            print("Agent 2: Creating shopping list...")
-            shopping_list = await self.shopping_agent.compile_list(meal_plan)
+            logger.info("meal plan stage started", extra={"fields": {"stage": "shopping_list"}})
+            with span("meal_plan.shopping_list"):
+                shopping_list = await self.shopping_agent.compile_list(meal_plan)
             pipeline_results['shopping_list'] = shopping_list
             
             # Agent 3: Health validation
-            print("Agent 3: Validating health...")
-            health_analysis = await self.health_agent.validate_plan(meal_plan, shopping_list, user_data)
+            logger.info("meal plan stage started", extra={"fields": {"stage": "health_validation"}})
+            with span("meal_plan.health_validation"):
+                health_analysis = await self.health_agent.validate_plan(meal_plan, shopping_list, user_data)
             pipeline_results['health_analysis'] = health_analysis
             
             # Agent 4: Budget optimization
-            print("Agent 4: Optimizing budget...")
-            budget_optimization = await self.budget_agent.optimize_budget(
-                shopping_list, health_analysis, user_data.get('budget', 100)
-            )
+            logger.info("meal plan stage started", extra={"fields": {"stage": "budget_optimization"}})
+            with span("meal_plan.budget_optimization"):
+                budget_optimization = await self.budget_agent.optimize_budget(
+                    shopping_list, health_analysis, user_data.get('budget', 100), user_data.get('allergies')
+                )
             pipeline_results['budget_optimization'] = budget_optimization
             
             # Calculate execution metrics
+            agents = (self.meal_agent, self.shopping_agent, self.health_agent)
             execution_time = (datetime.now() - start_time).total_seconds()
             pipeline_results['execution_metrics'] = {
                 'total_time_seconds': execution_time,
-                'agent_calls': 4,
+                'agent_calls': 3,  # budget optimization runs locally
+                'served_by_model': {
+                    'meal_plan': self.meal_agent.model_used,
+                    'shopping_list': self.shopping_agent.model_used,
+                    'health_validation': self.health_agent.model_used
+                },
+                'tokens': {
+                    'meal_plan': self.meal_agent.tokens,
+                    'shopping_list': self.shopping_agent.tokens,
+                    'health_validation': self.health_agent.tokens
+                },
+                'input_tokens': sum(a.tokens.get('input', 0) for a in agents),
+                'output_tokens': sum(a.tokens.get('output', 0) for a in agents),
                 'estimated_cost': execution_time * 0.002  # Rough cost estimate
             }
             
             return pipeline_results
             
+        except CircuitOpenError:
+            raise  # the endpoint serves a cached plan instead
         except Exception as e:
             return {
                 'error': str(e),
@@ -375,28 +577,7 @@ class MealPlanOrchestrator:
 # VOICE COMMAND ROUTER v2 - NLP Intent Recognition
 # =============================================================================
 
-@app.post("/voice_command")
-async def voice_command(audio: UploadFile = File(...)):
-    """
-    Accepts audio, transcribes it, and uses an LLM to determine user intent.
-    """
-    try:
-        # Step 1: Transcribe audio to text with Whisper
-        temp_audio_path = "temp_audio.webm"
-        with open(temp_audio_path, "wb") as buffer:
-            buffer.write(await audio.read())
-        
-        with open(temp_audio_path, "rb") as audio_file:
-            transcription = client.audio.transcriptions.create(
-              model="whisper-1", 
-              file=audio_file
-            )
-        
-        user_text = transcription.text
-        print(f"DEBUG: Transcribed text = '{user_text}'")
-
-        # Step 2: Improved intent classification
-        system_prompt = """
+INTENT_PROMPT = """
             You are an intent classifier for a fitness app. Analyze the user's text and return JSON with "action" and "confidence" fields.
 
             Actions:
@@ -410,6 +591,8 @@ async def voice_command(audio: UploadFile = File(...)):
             Examples: "going for a run", "starting workout", "exercise time", "start my run", "begin workout", "track my run"
              - "stop_exercise": User wants to end their current workout  
             Examples: "stop my run", "end workout", "I'm done exercising", "finish time"
+            - "log_usual": User wants to re-log a meal they usually eat (no photo needed)
+            Examples: "log my usual breakfast", "I had my usual lunch", "same as always for dinner", "log my usual"
             - "get_summary": Summary requests
             Examples: "how am I doing", "daily summary", "my calories", "show my progress"
             - "clarify": Ambiguous commands that need clarification depending on context 
@@ -420,50 +603,330 @@ async def voice_command(audio: UploadFile = File(...)):
             2. "log it/save it/log that" = log_previous (refers to something already analyzed)
             3. "log this/save this/track this" = log_food (refers to current view)
             4. Any mention of physical activity like running, workouts, or exercising should be classified as "start_exercise" or "stop_exercise".
-            5. Return confidence: "high" (>90% sure), "medium" (70-90%), "low" (<70%)
+            5. "usual/same as always" = log_usual. Include "meal" (breakfast|lunch|dinner|snack) if mentioned.
+            6. Return confidence: "high" (>90% sure), "medium" (70-90%), "low" (<70%)
 
-            Response format: {"action": "...", "confidence": "high|medium|low"}
+            Response format: {"action": "...", "confidence": "high|medium|low", "meal": "..."}
         """
 
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",  # Fixed typo: was "o4-mini" 
+
+async def transcribe_audio(filename: str, audio_bytes: bytes) -> tuple:
+    """Whisper (or whichever model the router picks) on an in-memory upload. Returns (text, model)."""
+    # (in-memory upload - a shared temp file isn't safe once calls run concurrently)
+    model = route("voice_transcription")
+    transcription = await asyncio.to_thread(
+        transcribe, get_client(), "voice_transcription",
+        model=model,
+        file=(filename, audio_bytes)
+    )
+    return transcription.text, model
+
+
+async def classify_voice_text(user_text: str) -> tuple:
+    """LLM intent classification with the local keyword rules as fallback. Returns (intent_data, degraded, model)."""
+    try:
+        intent_model = route("voice_intent")
+        response = await achat_completion(
+            get_client(), "voice_intent",
+            model=intent_model,
             response_format={ "type": "json_object" },
             messages=[
-                {"role": "system", "content": system_prompt},
+                {"role": "system", "content": INTENT_PROMPT},
                 {"role": "user", "content": user_text}
             ]
         )
+        return json.loads(response.choices[0].message.content), False, intent_model
+    except Exception as e:
+        # Classifier down/slow (or breaker open): keyword rules are good enough for the common commands
+        logger.warning("intent classifier unavailable, using local rules", extra={"fields": {"error": type(e).__name__}})
+        return classify_intent_locally(user_text), True, None
+
+
+@router.post("/voice_command", dependencies=[Depends(admit("llm"))])
+async def voice_command(background_tasks: BackgroundTasks, audio: UploadFile = File(...), x_username: Optional[str] = Header(None)):
+    """
+    Accepts audio, transcribes it, and uses an LLM to determine user intent.
+    """
+    try:
+        # Step 1: Transcribe audio to text
+        audio_bytes = await audio.read()
+        user_text, transcription_model = await transcribe_audio(audio.filename or "voice_command.webm", audio_bytes)
+        logger.debug("voice transcribed", extra={"fields": {"chars": len(user_text)}})
+
+        # Step 2: Improved intent classification
+        intent_data, degraded, intent_model = await classify_voice_text(user_text)
+        served_by_model = {"transcription": transcription_model, "intent": intent_model}
 
-        intent_data = json.loads(response.choices[0].message.content)
         action = intent_data.get("action", "unknown")
-        print(f"DEBUG: Classified action = '{action}'")
+        logger.info("voice intent classified", extra={"fields": {"action": action}})
+
+        # "log my usual ..." is handled right here - one indexed query + insert, no photo
+        if action == "log_usual" and x_username:
+            meal = intent_data.get("meal") or meal_from_text(user_text)
+            return {
+                "transcribed_text": user_text,
+                "action": action,
+                "degraded": degraded,
+                "served_by_model": served_by_model,
+                **await relog_usual(x_username, meal, background_tasks)
+            }
 
         # Step 3: Simple return - let frontend handle routing
         return {
             "transcribed_text": user_text,
             "action": action,
-            "message": intent_data.get("message", "")
+            "message": intent_data.get("message", ""),
+            "degraded": degraded,
+            "served_by_model": served_by_model
         }
 
+    except CircuitOpenError:
+        # Transcription is down - answer immediately instead of waiting on a timeout
+        return {
+            "action": "unknown",
+            "message": "Voice commands are temporarily unavailable. Please use the buttons for now.",
+            "transcribed_text": "",
+            "degraded": True
+        }
     except Exception as e:
-        print(f"ERROR in voice_command: {e}")
+        logger.exception("voice_command failed")
         return {
             "action": "unknown", 
             "message": "Sorry, I couldn't process that. Please try again.",
             "transcribed_text": ""
         }
     
+# -----------------------------------------------------------------------------
+# Voice over WebSocket: one connection per user, context kept server-side
+# -----------------------------------------------------------------------------
+# Follow-ups read shared state, not the socket's worker: "log it" logs the
+# newest unlogged analysis in analysis_cache, and workouts come from the
+# exercise session registry.
+#
+#   client -> server   binary frames: audio chunks of the current segment
+#                      {"type": "segment"}        segment complete (a standalone audio file),
+#                                                 transcribe it now while the user keeps talking
+#                      {"type": "end"}            utterance complete, process it
+#                      {"type": "text", "text"}   typed command, skips transcription
+#                      {"type": "cancel"}         drop the utterance's audio
+#   server -> client   {"type": "result", "transcribed_text", "action", ...}
+#                      {"type": "error", "detail", "retry_after"?}
+# A client that cuts segments at pauses only waits for the last one to be
+# transcribed after "end"; one that never sends "segment" gets the whole
+# utterance transcribed at "end". Utterances are processed in order while the
+# next one is still being received.
+
+VOICE_WS_MAX_AUDIO_BYTES = int(os.getenv("VOICE_WS_MAX_AUDIO_BYTES", 5 * 1024 * 1024))
+_voice_background = set()  # keeps fire-and-forget macro tasks referenced
+
+
+def _run_in_background(tasks: BackgroundTasks):
+    """Runs queued BackgroundTasks for code paths without a response to attach them to (the voice socket)."""
+    task = asyncio.create_task(tasks())
+    _voice_background.add(task)
+    task.add_done_callback(_voice_background.discard)
+
+
+def load_voice_user(username: str) -> tuple:
+    """(user, running exercise session or None). Blocking - run it with asyncio.to_thread."""
+    conn = get_db()
+    try:
+        user = get_user_by_username(username, conn)
+        return user, active_sessions.for_user(user["id"], conn)
+    finally:
+        conn.close()
+
+
+async def resolve_voice_action(username: str, user_text: str, intent_data: dict) -> dict:
+    """Carries out follow-up commands using the server-held context; everything else goes back to the client."""
+    action = intent_data.get("action", "unknown")
+
+    if action == "log_usual":
+        meal = intent_data.get("meal") or meal_from_text(user_text)
+        return await relog_usual(username, meal)
+
+    if action == "log_previous":
+        # The newest unlogged /analyze_food result, from whichever worker ran it
+        analysis_id = await asyncio.to_thread(analysis_cache.latest, username)
+        tasks = BackgroundTasks()
+        try:
+            if analysis_id is None:
+                raise HTTPException(status_code=404)
+            logged = await log_cached_analysis(analysis_id, tasks, username)
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+            return {"status": "needs_food", "message": "Nothing to log yet - take a photo of your food first."}
+        _run_in_background(tasks)
+        return {"status": "logged", "description": logged["description"], "calories": logged["calories"],
+                "message": f"Logged {logged['description']} ({logged['calories']} cal)"}
+
+    if action == "start_exercise":
+        user, running = await asyncio.to_thread(load_voice_user, username)
+        if running is not None:
+            return {"status": "already_running", "session_id": running.session_id}
+        session_id = await start_exercise_session(user["id"], "running")
+        return {"status": "exercise_started", "session_id": session_id}
+
+    if action == "stop_exercise":
+        user, running = await asyncio.to_thread(load_voice_user, username)
+        if running is None:
+            return {"status": "no_active_session", "message": "You don't have a workout running."}
+        return await asyncio.to_thread(stop_exercise_session, user, running.session_id)
+
+    if action == "get_summary":
+        return {"summary": await daily_summary(x_username=username)}
+
+    return {"message": intent_data.get("message", "")}
+
+
+async def transcribe_voice_segment(username: str, audio_bytes: bytes) -> tuple:
+    async with admitted(username.lower().strip(), "llm"):
+        return await transcribe_audio("voice_command.webm", audio_bytes)
+
+
+async def handle_voice_utterance(username: str, segments: Optional[list], text: Optional[str]) -> dict:
+    """`segments` are the utterance's transcription tasks in order (None for a typed command)."""
+    served_by_model = {"transcription": None, "intent": None}
+    try:
+        if text is None:
+            transcripts = await asyncio.gather(*segments)
+            text = " ".join(t.strip() for t, _ in transcripts if t and t.strip())
+            served_by_model["transcription"] = transcripts[-1][1]
+        async with admitted(username.lower().strip(), "llm"):
+            intent_data, degraded, served_by_model["intent"] = await classify_voice_text(text)
+    except CircuitOpenError:
+        return {"type": "result", "action": "unknown", "transcribed_text": "", "degraded": True,
+                "message": "Voice commands are temporarily unavailable. Please use the buttons for now."}
+
+    action = intent_data.get("action", "unknown")
+    logger.info("voice intent classified", extra={"fields": {"action": action, "channel": "ws"}})
+    return {
+        "type": "result",
+        "transcribed_text": text,
+        "action": action,
+        "degraded": degraded,
+        "served_by_model": served_by_model,
+        **await resolve_voice_action(username, text, intent_data)
+    }
+
+
+@router.websocket("/ws/voice")
+async def voice_socket(websocket: WebSocket, username: Optional[str] = None):
+    """Persistent voice channel; `username` query param or X-Username header."""
+    username = username or websocket.headers.get("x-username")
+    if not username:
+        await websocket.close(code=4401, reason="username required")
+        return
+    try:
+        await asyncio.to_thread(load_voice_user, username)
+    except HTTPException:
+        await websocket.close(code=4404, reason="user not found")
+        return
+
+    await websocket.accept()
+    utterances = asyncio.Queue(maxsize=4)
+    transcribing = set()  # every segment task still running, so a disconnect can cancel them
+
+    async def process():
+        while True:
+            segments, text = await utterances.get()
+            try:
+                reply = await handle_voice_utterance(username, segments, text)
+            except HTTPException as e:
+                reply = {"type": "error", "detail": e.detail}
+                if e.headers and "Retry-After" in e.headers:
+                    reply["retry_after"] = int(e.headers["Retry-After"])
+            except Exception:
+                logger.exception("voice socket utterance failed")
+                reply = {"type": "error", "detail": "Sorry, I couldn't process that. Please try again."}
+            await websocket.send_json(reply)
+
+    worker = asyncio.create_task(process())
+    buffer = bytearray()
+    segments = []      # transcription tasks of the utterance being received
+    received = 0       # its audio bytes so far, across segments
+
+    def cut_segment():
+        task = asyncio.create_task(transcribe_voice_segment(username, bytes(buffer)))
+        transcribing.add(task)
+        task.add_done_callback(transcribing.discard)
+        segments.append(task)
+        buffer.clear()
+
+    def drop_utterance():
+        nonlocal received
+        for task in segments:
+            task.cancel()
+        segments.clear()
+        buffer.clear()
+        received = 0
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes") is not None:
+                buffer.extend(message["bytes"])
+                received += len(message["bytes"])
+                if received > VOICE_WS_MAX_AUDIO_BYTES:
+                    drop_utterance()
+                    await websocket.send_json({"type": "error", "detail": "Utterance too long."})
+                continue
+            try:
+                command = json.loads(message.get("text") or "{}")
+            except ValueError:
+                await websocket.send_json({"type": "error", "detail": "Expected JSON text frames."})
+                continue
+            try:
+                if command.get("type") == "segment" and buffer:
+                    cut_segment()
+                elif command.get("type") == "end" and (buffer or segments):
+                    if buffer:
+                        cut_segment()
+                    utterances.put_nowait((list(segments), None))
+                    segments.clear()
+                    received = 0
+                elif command.get("type") == "text" and command.get("text"):
+                    utterances.put_nowait((None, str(command["text"])))
+                elif command.get("type") == "cancel":
+                    drop_utterance()
+            except asyncio.QueueFull:
+                drop_utterance()
+                await websocket.send_json({"type": "error", "detail": "Still working on your last commands."})
+    except WebSocketDisconnect:
+        pass
+    finally:
+        worker.cancel()
+        for task in list(transcribing):
+            task.cancel()
+
 # =============================================================================
 # Food
 # =============================================================================
-def update_macros_in_background(log_id: int, description: str, calories: int):
-    """Fetches macros from AI and updates the DB record."""
+def enqueue_background(background_tasks: BackgroundTasks, func, *args):
+    """BackgroundTasks.add_task that keeps the in-flight gauge and run time metrics up to date."""
+    background_queue_depth.inc()
 
-    #currently just a mock function - replace with AI call or condense in /log_food with fine tuned model
-    print(f"BACKGROUND TASK: Estimating macros for log_id {log_id}")
-    macros = estimate_macros_from_food(description, calories)
+    def run_tracked():
+        started = time.perf_counter()
+        try:
+            func(*args)
+        finally:
+            background_queue_depth.dec()
+            background_task_seconds.observe(time.perf_counter() - started, task=func.__name__)
+
+    background_tasks.add_task(run_tracked)
+
+
+def update_macros_in_background(log_id: int, description: str, calories: int, food_name: str = ""):
+    """Fetches macros (local nutrition DB first, then AI) and updates the DB record."""
+
+    logger.debug("estimating macros", extra={"fields": {"log_id": log_id}})
+    macros = estimate_macros_from_food(description, calories, food_name)
     
-    conn = sqlite3.connect("fitness.db")
+    conn = get_db()
     cursor = conn.cursor()
     cursor.execute(
         "UPDATE user_logs SET protein = ?, carbs = ?, fats = ? WHERE id = ?",
@@ -471,14 +934,26 @@ def update_macros_in_background(log_id: int, description: str, calories: int):
     )
     conn.commit()
     conn.close()
-    print(f"BACKGROUND TASK: Macros updated for log_id {log_id}")
+    logger.info("macros updated", extra={"fields": {"log_id": log_id, "source": macros.get("source", "ai")}})
 
 
 
-@app.post("/log_food_direct")
+async def vision_call(*args, **kwargs):
+    """achat_completion for food photos; an open breaker becomes a fast 503 instead of a hang."""
+    try:
+        return await achat_completion(*args, **kwargs)
+    except CircuitOpenError as e:
+        raise HTTPException(
+            status_code=503,
+            detail="Food photo analysis is temporarily unavailable. You can still re-log past meals from your history.",
+            headers={"Retry-After": str(max(1, int(e.retry_after)))}
+        )
+
+
+@router.post("/log_food_direct", dependencies=[Depends(admit("llm"))])
 async def log_food_direct(image: UploadFile, background_tasks: BackgroundTasks, x_username: str = Header(...)):
     """Analyze food, immediately save to DB for a specific user."""
-    conn = sqlite3.connect("fitness.db")
+    conn = get_db()
     cursor = conn.cursor()
     
     # --- ADDED: Get user_id from username ---
@@ -492,8 +967,10 @@ async def log_food_direct(image: UploadFile, background_tasks: BackgroundTasks,
     
     # AI call (same as analyze_food)
     image_data = base64.b64encode(await image.read()).decode()
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    model = route("food_vision")
+    response = await vision_call(
+        get_client(), "food_vision",
+        model=model,
         messages=[{
             "role": "user",
             "content": [
@@ -505,7 +982,7 @@ async def log_food_direct(image: UploadFile, background_tasks: BackgroundTasks,
     
     # Parse result (same parsing logic)
     result = response.choices[0].message.content.strip()
-    print(f"DEBUG: AI Response = '{result}'")
+    logger.debug("vision response received", extra={"fields": {"chars": len(result)}})
     
     parts = []
     for line in result.split('\n'):
@@ -514,7 +991,7 @@ async def log_food_direct(image: UploadFile, background_tasks: BackgroundTasks,
             break
 
     if len(parts) != 3:
-        print(f"ERROR: Could not parse AI response. Got: '{result}'")
+        logger.warning("vision response not in food|description|calories format", extra={"fields": {"chars": len(result)}})
         return {"error": f"AI format error. Got: '{result}'. Expected: 'food|description|calories'"}
     
     type_val = parts[0].strip()
@@ -524,25 +1001,32 @@ async def log_food_direct(image: UploadFile, background_tasks: BackgroundTasks,
         calories_str = re.findall(r'\d+', parts[2])[0]
         calories = int(calories_str)
     except (IndexError, ValueError):
-        print(f"ERROR: Could not parse calories from '{parts[2]}'")
+        logger.warning("could not parse calories from vision response")
         return {"error": f"Could not parse calories from AI response: '{parts[2]}'"}
 
+    # Well-known foods get macros from the local DB right away - no background AI call needed
+    macros = await asyncio.to_thread(lookup_macros, f"{type_val} {description}", calories, type_val)
+
     # Always save to DB for this endpoint
-    log_id = log_food(user_id, type_val, description, calories)
+    log_id = await log_food(user_id, type_val, description, calories, macros)
 
-    background_tasks.add_task(update_macros_in_background, log_id, description, calories)
+    if macros is None:
+        enqueue_background(background_tasks, update_macros_in_background, log_id, description, calories, type_val)
     
-    return {"description": description, "calories": calories, "saved": True}
+    return {"description": description, "calories": calories, "macros": macros, "saved": True,
+            "served_by_model": model}
 
 
-@app.post("/analyze_food")
-async def analyze_food(image: UploadFile):
+@router.post("/analyze_food", dependencies=[Depends(admit("llm"))])
+async def analyze_food(image: UploadFile, x_username: Optional[str] = Header(None)):
     """Analyze food only - for frontend memory storage"""
     
     # Same AI call and parsing logic as before...
     image_data = base64.b64encode(await image.read()).decode()
-    response = client.chat.completions.create(
-        model="gpt-4o",
+    model = route("food_vision")
+    response = await vision_call(
+        get_client(), "food_vision",
+        model=model,
         messages=[{
             "role": "user",
             "content": [
@@ -553,7 +1037,7 @@ async def analyze_food(image: UploadFile):
     )
     
     result = response.choices[0].message.content.strip()
-    print(f"DEBUG: AI Response = '{result}'")
+    logger.debug("vision response received", extra={"fields": {"chars": len(result)}})
     
     parts = []
     for line in result.split('\n'):
@@ -562,7 +1046,7 @@ async def analyze_food(image: UploadFile):
             break
 
     if len(parts) != 3:
-        print(f"ERROR: Could not parse AI response. Got: '{result}'")
+        logger.warning("vision response not in food|description|calories format", extra={"fields": {"chars": len(result)}})
         return {"error": f"AI format error. Got: '{result}'. Expected: 'food|description|calories'"}
     
     type_val = parts[0].strip()
@@ -572,32 +1056,119 @@ async def analyze_food(image: UploadFile):
         calories_str = re.findall(r'\d+', parts[2])[0]
         calories = int(calories_str)
     except (IndexError, ValueError):
-        print(f"ERROR: Could not parse calories from '{parts[2]}'")
+        logger.warning("could not parse calories from vision response")
         return {"error": f"Could not parse calories from AI response: '{parts[2]}'"}
 
+    macros = await asyncio.to_thread(lookup_macros, f"{type_val} {description}", calories, type_val)
+    food = {"type": type_val, "description": description, "calories": calories, "macros": macros}
+    # /log_previous can log this by id later instead of taking the result back from the client
+    # /log_previous needs a user anyway, so anonymous analyses get no id
+    # also what a follow-up "log it" over the voice channel logs, so it needs no re-upload
+    analysis_id = analysis_cache.put(x_username, food) if x_username else None
+
     # Never save to DB for this endpoint
-    return {"description": description, "calories": calories, "saved": False}
+    return {**food, "analysis_id": analysis_id, "saved": False, "served_by_model": model}
 
 
-def log_food(user_id: int, type_val: str, description: str, calories: int) -> int:
-    """Logs food to the database and returns the new log's ID."""
-    conn = sqlite3.connect("fitness.db")
-    cursor = conn.cursor()
-    cursor.execute(
-        "INSERT INTO user_logs (user_id, timestamp, type, description, calories) VALUES (?, ?, ?, ?, ?)",
-        (user_id, datetime.now().isoformat(), type_val, description, int(calories))
+def sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+@router.post("/analyze_food/stream", dependencies=[Depends(admit("llm"))])
+async def analyze_food_stream(image: UploadFile, x_username: Optional[str] = Header(None)):
+    """
+    Streaming /analyze_food (Server-Sent Events). Fields are pushed as soon as
+    they are complete in the model output:
+      event: name         {"type"}
+      event: description  {"type", "description"}
+      event: result       same body as /analyze_food
+      event: error        {"error"}
+    """
+    model = route("food_vision_stream")
+    if unavailable("food_vision_stream"):
+        raise HTTPException(
+            status_code=503,
+            detail="Food photo analysis is temporarily unavailable. You can still re-log past meals from your history.",
+            headers={"Retry-After": "30"}
+        )
+    image_data = base64.b64encode(await image.read()).decode()
+
+    async def events():
+        result = ""
+        fields_sent = 0
+        try:
+            async for text in astream_chat_completion(
+                get_client(), "food_vision_stream",
+                model=model,
+                messages=[{
+                    "role": "user",
+                    "content": [
+                        {"type": "text", "text": "Analyze the food item in the image. Your response MUST be a single line in the format: food_name|description|calories_as_integer. For example: Apple|A fresh red apple|95. Do not include any other text, explanations, or markdown."},
+                        {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{image_data}"}}
+                    ]
+                }]
+            ):
+                result += text
+                parts = result.strip().split('|')
+                # A field is complete once the separator after it has arrived
+                if fields_sent == 0 and len(parts) > 1:
+                    yield sse_event("name", {"type": parts[0].strip()})
+                    fields_sent = 1
+                if fields_sent == 1 and len(parts) > 2:
+                    yield sse_event("description", {"type": parts[0].strip(), "description": parts[1].strip()})
+                    fields_sent = 2
+        except CircuitOpenError:
+            yield sse_event("error", {"error": "Food photo analysis is temporarily unavailable."})
+            return
+        except Exception:
+            logger.exception("streamed food analysis failed")
+            yield sse_event("error", {"error": "Food analysis failed. Please try again."})
+            return
+
+        result = result.strip()
+        parts = result.split('|')
+        if len(parts) != 3:
+            logger.warning("vision response not in food|description|calories format", extra={"fields": {"chars": len(result)}})
+            yield sse_event("error", {"error": f"AI format error. Got: '{result}'. Expected: 'food|description|calories'"})
+            return
+        type_val = parts[0].strip()
+        description = parts[1].strip()
+        try:
+            calories = int(re.findall(r'\d+', parts[2])[0])
+        except (IndexError, ValueError):
+            yield sse_event("error", {"error": f"Could not parse calories from AI response: '{parts[2]}'"})
+            return
+
+        macros = await asyncio.to_thread(lookup_macros, f"{type_val} {description}", calories, type_val)
+        food = {"type": type_val, "description": description, "calories": calories, "macros": macros}
+        analysis_id = analysis_cache.put(x_username, food) if x_username else None
+        yield sse_event("result", {**food, "analysis_id": analysis_id, "saved": False, "served_by_model": model})
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+async def log_food(user_id: int, type_val: str, description: str, calories: int, macros: Optional[dict] = None) -> int:
+    """Logs food to the database and returns the new log's ID (group-committed, see log_writer.py)."""
+    macros = macros or {}
+    return await log_writer.ainsert(
+        "INSERT INTO user_logs (user_id, timestamp, type, description, calories, protein, carbs, fats) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        (user_id, datetime.now().isoformat(), type_val, description, int(calories),
+         macros.get("protein", 0), macros.get("carbs", 0), macros.get("fats", 0))
     )
-    log_id = cursor.lastrowid  # Get the ID of the new row
-    conn.commit()
-    conn.close()
-    return log_id
 
 
-@app.post("/log_previous")
+@router.post("/log_previous")
 async def log_previous(data: dict, background_tasks: BackgroundTasks, x_username: str = Header(...)):
-    """Directly log pre-analyzed food for a specific user."""
+    """
+    Directly log pre-analyzed food for a specific user.
+    Send {"analysis_id"} from /analyze_food, or (older clients) the full {"type", "description", "calories"}.
+    """
+    if data.get("analysis_id") and not data.get("description"):
+        return await log_cached_analysis(str(data["analysis_id"]), background_tasks, x_username)
+
     try:
-        conn = sqlite3.connect("fitness.db")
+        conn = get_db()
         cursor = conn.cursor()
         
         # First, get the user's ID from their username
@@ -606,98 +1177,281 @@ async def log_previous(data: dict, background_tasks: BackgroundTasks, x_username
         if not user_record:
             raise HTTPException(status_code=404, detail="User not found.")
         user_id = user_record[0]
+        conn.close()
 
         description = data["description"]
         calories = int(data["calories"])
 
         # Now, insert the log with the user_id
-        cursor.execute(
-            "INSERT INTO user_logs (user_id, timestamp, type, description, calories) VALUES (?, ?, ?, ?, ?)",
-            (user_id, datetime.now().isoformat(), data["type"], data["description"], int(data["calories"]))
-        )
-        log_id = cursor.lastrowid
-        conn.commit()
-        conn.close()
+        log_id = await log_food(user_id, data["type"], description, calories)
 
-        background_tasks.add_task(update_macros_in_background, log_id, description, calories)
+        enqueue_background(background_tasks, update_macros_in_background, log_id, description, calories, data["type"])
+        # logged - "log it" shouldn't add it again
+        await asyncio.to_thread(analysis_cache.mark_latest_logged, x_username, description, calories, log_id)
         
         return {"status": "logged", "description": data["description"], "calories": data["calories"]}
     except Exception as e:
         return {"error": str(e)}    
 
+ANALYSIS_LOG_WAIT_SECONDS = 5.0  # how long a duplicate "log it" waits for the first one's log_id
+
+
+async def log_cached_analysis(analysis_id: str, background_tasks: BackgroundTasks, username: str) -> dict:
+    """/log_previous by analysis_id: one insert, reusing the macros found at analysis time."""
+    claim = await asyncio.to_thread(analysis_cache.claim, username, analysis_id)
+    if claim is None:
+        raise HTTPException(status_code=404, detail="Analysis expired - please send the food details or analyze again.")
+    food, log_id, claimed = claim
+    if claimed:
+        try:
+            user = await asyncio.to_thread(load_user, username)
+            log_id = await log_food(user["id"], food["type"], food["description"], food["calories"], food["macros"])
+        except BaseException:
+            await asyncio.to_thread(analysis_cache.release, analysis_id)
+            raise
+        await asyncio.to_thread(analysis_cache.mark_logged, analysis_id, log_id)
+        if food["macros"] is None:
+            enqueue_background(background_tasks, update_macros_in_background,
+                               log_id, food["description"], food["calories"], food["type"])
+    else:
+        # A concurrent request for the same analysis is inserting it - answer with its row
+        deadline = time.monotonic() + ANALYSIS_LOG_WAIT_SECONDS
+        while log_id == PENDING_LOG and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+            cached = await asyncio.to_thread(analysis_cache.get, username, analysis_id)
+            log_id = cached[1] if cached else None
+        if log_id is None or log_id == PENDING_LOG:
+            raise HTTPException(status_code=409, detail="This analysis is already being logged.")
+    return {"status": "logged", "log_id": log_id, "description": food["description"], "calories": food["calories"]}
+
 # =============================================================================
-# Exercise
+# Food history (search + quick relog)
 # =============================================================================
 
-@app.post("/exercise")
-async def handle_exercise(req: ExerciseRequest, x_username: str = Header(...)):
-    """Starts or stops an exercise session for a user."""
-    conn = sqlite3.connect("fitness.db")
-    conn.row_factory = sqlite3.Row # Allows accessing columns by name
-    user = get_user_by_username(x_username, conn) # Reuse our helper
+@router.get("/food_history/search")
+async def food_history_search(q: str = "", limit: int = 10, x_username: str = Header(...)):
+    """Search the user's past foods, ranked by frequency and recency."""
+    conn = get_db()
+    try:
+        user = get_user_by_username(x_username, conn)
+        return {"results": search_history(conn, user["id"], q, min(max(limit, 1), 50))}
+    finally:
+        conn.close()
 
-    if req.action == 'start':
-        # Create a new exercise log entry
-        cursor = conn.cursor()
-        cursor.execute(
-            "INSERT INTO exercise_logs (user_id, start_time, exercise_type) VALUES (?, ?, ?)",
-            (user['id'], datetime.now().isoformat(), req.exercise_type)
-        )
-        conn.commit()
-        new_session_id = cursor.lastrowid
+@router.post("/food_history/relog")
+async def food_history_relog(req: RelogRequest, background_tasks: BackgroundTasks, x_username: str = Header(...)):
+    """Re-log a past item by id, copying its calories and macros (no AI call)."""
+    conn = get_db()
+    try:
+        user = get_user_by_username(x_username, conn)
+        logged = relog(conn, user["id"], req.log_id)
+        if logged is None:
+            raise HTTPException(status_code=404, detail="Food log not found.")
+    finally:
         conn.close()
-        return {"status": "exercise_started", "session_id": new_session_id}
+    backfill_relogged_macros(logged, background_tasks)
+    return {"status": "logged", **logged}
+
+def backfill_relogged_macros(logged: dict, background_tasks: Optional[BackgroundTasks] = None):
+    """relog() copies the source's macros; if its estimate never finished they're all 0, so estimate now."""
+    if any(logged.get(key) for key in ("protein", "carbs", "fats")):
+        return
+    args = (update_macros_in_background, logged["log_id"], logged["description"], logged["calories"], logged["type"])
+    if background_tasks is not None:
+        enqueue_background(background_tasks, *args)
+    else:
+        tasks = BackgroundTasks()
+        enqueue_background(tasks, *args)
+        _run_in_background(tasks)
 
-    if req.action == 'stop':
-        if not req.session_id:
-            raise HTTPException(status_code=400, detail="session_id is required to stop an exercise.")
-        
-        # Get the start time from the DB
+def log_usual_for_user(username: str, meal: str) -> dict:
+    """Finds the user's usual item for a meal and logs it again."""
+    conn = get_db()
+    try:
+        user = get_user_by_username(username, conn)
+        usual = find_usual(conn, user["id"], meal)
+        if usual is None:
+            return {"status": "not_found", "meal": meal,
+                    "message": f"I don't know your usual {meal} yet. Log it once with a photo!"}
+        logged = relog(conn, user["id"], usual["log_id"])
+        return {"status": "logged", "meal": meal, **logged,
+                "message": f"Logged your usual {meal}: {logged['description']} ({logged['calories']} cal)"}
+    finally:
+        conn.close()
+
+async def relog_usual(username: str, meal: str, background_tasks: Optional[BackgroundTasks] = None) -> dict:
+    """log_usual_for_user() on a worker thread, plus the macro backfill for copied zeros."""
+    result = await asyncio.to_thread(log_usual_for_user, username, meal)
+    if result["status"] == "logged":
+        backfill_relogged_macros(result, background_tasks)
+    return result
+
+@router.post("/log_usual")
+async def log_usual(req: UsualRequest, background_tasks: BackgroundTasks, x_username: str = Header(...)):
+    """Log the user's usual breakfast/lunch/dinner/snack."""
+    meal = req.meal if req.meal in MEAL_WINDOWS else meal_from_text(req.meal or "")
+    return await relog_usual(x_username, meal, background_tasks)
+
+# =============================================================================
+# Exercise
+# =============================================================================
+
+async def start_exercise_session(user_id: int, exercise_type: str, intensity: Optional[str] = None) -> int:
+    """Creates an open exercise log entry, registers it as running and returns its session id."""
+    started_at = datetime.now()
+    session_id = await log_writer.ainsert(
+        "INSERT INTO exercise_logs (user_id, start_time, exercise_type, intensity) VALUES (?, ?, ?, ?)",
+        (user_id, started_at.isoformat(), exercise_type, intensity)
+    )
+    active_sessions.add(ActiveSession(session_id, user_id, exercise_type, intensity, started_at))
+    return session_id
+
+
+def _stopped_session(row) -> dict:
+    """Response for a session that's already closed (by an earlier stop, or by the stale-session sweeper)."""
+    return {
+        "status": "exercise_stopped",
+        "duration_seconds": row["duration_seconds"],
+        "calories_burned": row["calories_burned"],
+        "distance_m": row["distance_m"],
+        "avg_heart_rate": row["avg_heart_rate"],
+        "calorie_method": None,
+        "auto_closed": bool(row["auto_closed"]),
+    }
+
+
+def stop_exercise_session(user: dict, session_id: int) -> dict:
+    """Closes an exercise session and works out the calories burned (see exercise.py)."""
+    conn = get_db()
+    conn.row_factory = sqlite3.Row # Allows accessing columns by name
+    try:
         cursor = conn.cursor()
-        cursor.execute(
-            "SELECT start_time FROM exercise_logs WHERE id = ? AND user_id = ?",
-            (req.session_id, user['id'])
-        )
-        session = cursor.fetchone()
-        if not session:
-            raise HTTPException(status_code=404, detail="Active exercise session not found.")
-        
-        start_time = datetime.fromisoformat(session['start_time'])
+        stored_sql = """
+            SELECT start_time, end_time, exercise_type, intensity, duration_seconds, calories_burned,
+                   distance_m, avg_heart_rate, auto_closed
+            FROM exercise_logs WHERE id = ? AND user_id = ?
+        """
+        active = active_sessions.get(session_id, user['id'])
+        if active is not None:
+            start_time, exercise_type, intensity = active.started_at, active.exercise_type, active.intensity
+        else:
+            # Not started through this process (another worker, or before a restart): ask the DB
+            session = cursor.execute(stored_sql, (session_id, user['id'])).fetchone()
+            if not session:
+                raise HTTPException(status_code=404, detail="Active exercise session not found.")
+            if session['end_time'] is not None:
+                # Already closed (e.g. auto-closed by the sweeper) - keep its numbers, don't stretch it to now
+                active_sessions.remove(session_id)
+                return _stopped_session(session)
+            start_time = datetime.fromisoformat(session['start_time'])
+            exercise_type, intensity = session['exercise_type'], session['intensity']
+
         end_time = datetime.now()
         duration = end_time - start_time
         duration_seconds = int(duration.total_seconds())
 
-        # Estimate calories burned
-        # Formula: METs * user_weight_kg * duration_in_hours
-        # METs for running is ~9.8
-        met_value = 9.8
-        duration_hours = duration_seconds / 3600.0
-        calories_burned = int(met_value * user['weight_kg'] * duration_hours)
+        # MET for the activity/intensity, refined by any samples sent during the session
+        burn = compute_session(user, exercise_type, intensity, duration_seconds, load_samples(conn, session_id))
 
-        # Update the record
+        # Update the record (unless the sweeper closed it in the meantime)
         cursor.execute("""
             UPDATE exercise_logs 
-            SET end_time = ?, duration_seconds = ?, calories_burned = ?
-            WHERE id = ?
-        """, (end_time.isoformat(), duration_seconds, calories_burned, req.session_id))
+            SET end_time = ?, duration_seconds = ?, calories_burned = ?, distance_m = ?, avg_heart_rate = ?
+            WHERE id = ? AND end_time IS NULL
+        """, (end_time.isoformat(), duration_seconds, burn["calories_burned"], burn["distance_m"],
+              burn["avg_heart_rate"], session_id))
+        closed_elsewhere = cursor.rowcount == 0
         conn.commit()
+        active_sessions.remove(session_id)
+        if closed_elsewhere:
+            return _stopped_session(cursor.execute(stored_sql, (session_id, user['id'])).fetchone())
+    finally:
         conn.close()
 
-        return {
-            "status": "exercise_stopped",
-            "duration_seconds": duration_seconds,
-            "calories_burned": calories_burned
-        }
+    return {
+        "status": "exercise_stopped",
+        "duration_seconds": duration_seconds,
+        "calories_burned": burn["calories_burned"],
+        "distance_m": burn["distance_m"],
+        "avg_heart_rate": burn["avg_heart_rate"],
+        "calorie_method": burn["method"],
+        "auto_closed": False,
+    }
+
+
+@router.post("/exercise")
+async def handle_exercise(req: ExerciseRequest, x_username: str = Header(...)):
+    """Starts or stops an exercise session for a user."""
+    conn = get_db()
+    try:
+        user = get_user_by_username(x_username, conn) # Reuse our helper
+    finally:
+        conn.close()
+
+    if req.action == 'start':
+        new_session_id = await start_exercise_session(user['id'], req.exercise_type, req.intensity)
+        return {"status": "exercise_started", "session_id": new_session_id}
+
+    if req.action == 'stop':
+        if not req.session_id:
+            raise HTTPException(status_code=400, detail="session_id is required to stop an exercise.")
+        # SQLite read/write + integrating up to 2000 samples: keep it off the event loop
+        return await asyncio.to_thread(stop_exercise_session, user, req.session_id)
+
+@router.get("/exercise/active")
+async def active_exercise(x_username: str = Header(...)):
+    """The user's running session, if any (served from the in-memory registry)."""
+    conn = get_db()
+    try:
+        user = get_user_by_username(x_username, conn)
+        session = active_sessions.for_user(user["id"], conn)
+    finally:
+        conn.close()
+    return {"active": session is not None, "session": session.as_dict() if session else None}
+
+@router.post("/exercise/{session_id}/samples")
+async def add_exercise_samples(session_id: int, req: ExerciseSamplesRequest, x_username: str = Header(...)):
+    """Batch of heart rate / speed / GPS samples for a running session (send every ~15-60s)."""
+    if any(sample.ts is None and sample.t is None for sample in req.samples):
+        raise HTTPException(status_code=400, detail="Every sample needs ts (unix seconds) or t (seconds since start).")
+    conn = get_db()
+    try:
+        user = get_user_by_username(x_username, conn)
+        active = active_sessions.get(session_id, user["id"])
+        if active is not None:
+            started_at = active.started_at
+        else:
+            session = conn.execute(
+                "SELECT start_time FROM exercise_logs WHERE id = ? AND user_id = ? AND end_time IS NULL",
+                (session_id, user["id"])
+            ).fetchone()
+            if not session:
+                raise HTTPException(status_code=404, detail="Active exercise session not found.")
+            started_at = datetime.fromisoformat(session[0])
+        if not req.samples:
+            return {"session_id": session_id, "stored_samples": None}
+        rows = samples_to_array([sample.dict() for sample in req.samples], started_at.timestamp())
+        stored = append_samples(conn, session_id, user["id"], rows)
+        active_sessions.touch(session_id, has_samples=True)
+        return {"session_id": session_id, "stored_samples": stored}
+    finally:
+        conn.close()
+
+@router.get("/exercise/types")
+async def exercise_types():
+    """Supported exercise types with their MET per intensity."""
+    return {name: {"met": activity["intensity"], "speed_based": "speed_kmh" in activity}
+            for name, activity in MET_TABLE.items()}
     
 # =============================================================================
 # Stats
 # =============================================================================
 
 
-@app.get("/summary")
+@router.get("/summary")
 async def daily_summary(x_username: str = Header(...)):
     """Provides a personalized daily summary based on user goals."""
-    conn = sqlite3.connect("fitness.db")
+    conn = get_db()
     try:
         user = get_user_by_username(x_username, conn)
         
@@ -733,10 +1487,10 @@ async def daily_summary(x_username: str = Header(...)):
 
 # app.py
 
-@app.get("/macro_summary")
+@router.get("/macro_summary")
 async def get_macro_summary(x_username: str = Header(...)):
     """Get macro nutrient breakdown from saved food log data."""
-    conn = sqlite3.connect("fitness.db")
+    conn = get_db()
     try:
         user = get_user_by_username(x_username, conn)
         today = datetime.now().date().isoformat()
@@ -792,14 +1546,19 @@ async def get_macro_summary(x_username: str = Header(...)):
     finally:
         conn.close()
         
-def estimate_macros_from_food(description: str, calories: int):
+def estimate_macros_from_food(description: str, calories: int, food_name: str = ""):
     """
-    Use AI to estimate macro breakdown from food description.
-    This replaces the mock data with AI-powered estimates.
+    Estimate macro breakdown from food description.
+    Checks the local nutrition database first and only falls back to AI for unknown foods.
     """
+    local = lookup_macros(f"{food_name} {description}", calories, food_name or None)
+    if local is not None:
+        return local
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o-mini",
+        response = chat_completion(
+            get_client(), "macro_estimate",
+            model=route("macro_estimate"),
             messages=[{
                 "role": "user",
                 "content": f"""
@@ -825,7 +1584,7 @@ def estimate_macros_from_food(description: str, calories: int):
         }
         
     except Exception as e:
-        print(f"Error estimating macros: {e}")
+        logger.warning("macro estimate failed, using ratio fallback", extra={"fields": {"error": type(e).__name__}})
         # Fallback to simple estimation if AI fails
         return {
             "protein": calories * 0.25 / 4,  # 25% from protein
@@ -833,10 +1592,23 @@ def estimate_macros_from_food(description: str, calories: int):
             "fats": calories * 0.25 / 9      # 25% from fats
         }
 
-@app.get("/exercise_summary")
+@router.get("/nutrition/lookup")
+async def nutrition_lookup(q: str, calories: Optional[int] = None):
+    """Look up a food in the local nutrition database (no AI call)."""
+    macros = await asyncio.to_thread(lookup_macros, q, calories)
+    if macros is None:
+        raise HTTPException(status_code=404, detail="Food not found in local nutrition database.")
+    return macros
+
+@router.get("/nutrition/metrics")
+async def nutrition_metrics():
+    """Local nutrition lookup latency and match rate."""
+    return lookup_metrics.snapshot()
+
+@router.get("/exercise_summary")
 async def get_exercise_summary(x_username: str = Header(...)):
     """Get today's exercise summary from exercise logs."""
-    conn = sqlite3.connect("fitness.db")
+    conn = get_db()
     conn.row_factory = sqlite3.Row
     try:
         user = get_user_by_username(x_username, conn)
@@ -862,9 +1634,9 @@ async def get_exercise_summary(x_username: str = Header(...)):
             total_calories += calories
             
             # Check if this is a personal record (simple version - longest duration for this exercise type)
-            cursor.execute("""
+            cursor.execute(f"""
                 SELECT MAX(duration_seconds) as max_duration
-                FROM exercise_logs 
+                FROM {log_source(conn, "exercise_logs")} 
                 WHERE user_id = ? AND exercise_type = ? AND end_time IS NOT NULL
             """, (user["id"], exercise["exercise_type"]))
             
@@ -899,10 +1671,10 @@ async def get_exercise_summary(x_username: str = Header(...)):
     finally:
         conn.close()
 
-@app.get("/streak_data")
+@router.get("/streak_data")
 async def get_streak_data(x_username: str = Header(...)):
     """Calculate streak data from user activity logs."""
-    conn = sqlite3.connect("fitness.db")
+    conn = get_db()
     try:
         user = get_user_by_username(x_username, conn)
         
@@ -998,14 +1770,53 @@ async def get_streak_data(x_username: str = Header(...)):
         conn.close()
 
 
+def trends_for_user(username: str, days: int) -> dict:
+    conn = get_db()
+    try:
+        user = get_user_by_username(username, conn)
+        target = calculate_target_calories(
+            sex=user["sex"], age=user["age"],
+            height_cm=user["height_cm"], weight_kg=user["weight_kg"],
+            goal=user["goal"]
+        )
+        return compute_trends(conn, user["id"], target, days, datetime.now().date())
+    finally:
+        conn.close()
+
+@router.get("/trends")
+async def get_trends(days: int = 90, x_username: str = Header(...)):
+    """Daily, weekly and monthly calorie / macro / exercise series with adherence to the calorie target."""
+    if days < 1:
+        raise HTTPException(status_code=400, detail="days must be at least 1.")
+    return await asyncio.to_thread(trends_for_user, x_username, days)
+
+
+# =============================================================================
+# Delta sync (mobile offline cache)
+# =============================================================================
+
+@router.get("/sync")
+async def sync_changes(since: int = 0, limit: int = 500, x_username: str = Header(...)):
+    """
+    Food logs, exercise logs and meal plans changed (or deleted) since the
+    client's cursor. since=0 returns everything; page while has_more is true.
+    If "reset" is true the cursor is too old - drop the local copy and start from 0.
+    """
+    conn = get_db()
+    try:
+        user = get_user_by_username(x_username, conn)
+        return changes_since(conn, user["id"], max(0, since), max(1, min(limit, 2000)))
+    finally:
+        conn.close()
+
 # =============================================================================
 # Auth end points (User Register / Login)
 # =============================================================================
 
-@app.post("/register")
+@router.post("/register")
 async def register_user(user: User):
     """Registers a new user."""
-    conn = sqlite3.connect("fitness.db")
+    conn = get_db()
     cursor = conn.cursor()
     try:
         username = user.username.lower().strip()  # Convert to lowercase and trim spaces
@@ -1020,10 +1831,10 @@ async def register_user(user: User):
         conn.close()
     return {"status": "User registered successfully", "username": username}
 
-@app.post("/login")
+@router.post("/login")
 async def login_user(req: LoginRequest):
     """Logs in a user by checking if they exist."""
-    conn = sqlite3.connect("fitness.db")
+    conn = get_db()
     cursor = conn.cursor()
     username = req.username.lower().strip() # Convert to lowercase
     cursor.execute("SELECT id FROM users WHERE username = ?", (username,))
@@ -1048,6 +1859,14 @@ def get_user_by_username(username: str, db: sqlite3.Connection):
         "height_cm": user_record[3], "weight_kg": user_record[4], "goal": user_record[5]
     }
 
+def load_user(username: str) -> dict:
+    """get_user_by_username on its own connection, for asyncio.to_thread."""
+    conn = get_db()
+    try:
+        return get_user_by_username(username, conn)
+    finally:
+        conn.close()
+
 def calculate_target_calories(sex: str, age: int, height_cm: int, weight_kg: int, goal: str) -> int:
     """
     Calculates the target daily calories based on user data and goals.
@@ -1073,9 +1892,9 @@ def calculate_target_calories(sex: str, age: int, height_cm: int, weight_kg: int
 
     return int(target_calories)
 
-@app.get("/profile")
+@router.get("/profile")
 async def get_profile(x_username: str = Header(...)):
-    conn = sqlite3.connect("fitness.db")
+    conn = get_db()
     try:
         user = get_user_by_username(x_username, conn)
         return {
@@ -1093,14 +1912,14 @@ async def get_profile(x_username: str = Header(...)):
 # API Endpoints
 # =============================================================================
 
-@app.post("/create_meal_plan")
+@router.post("/create_meal_plan", dependencies=[Depends(admit("llm_heavy"))])
 async def create_meal_plan(
     req: dict, # Updated to receive a dict
     x_username: str = Header(...)
 ):
     """Generate and SAVE a complete meal plan using the multi-agent system."""
     
-    conn = sqlite3.connect("fitness.db")
+    conn = get_db()
     try:
         user = get_user_by_username(x_username, conn)
         budget = req.get('budget', 100)
@@ -1122,28 +1941,90 @@ async def create_meal_plan(
             'target_calories': target_calories,
             'food_history': food_history
         }
+
+        # Someone with a similar profile already has a plan: adapt it instead of running the pipeline
+        # (send "fresh": true to always generate)
+        if not req.get('fresh'):
+            with span("meal_plan.reuse_lookup"):
+                body = await asyncio.to_thread(reuse_similar_plan, user["id"], user["goal"], target_calories,
+                                               budget, user_data['allergies'])
+            if body is not None:
+                return raw_json(body)
         
-        orchestrator = MealPlanOrchestrator(client)
-        results = await orchestrator.create_meal_plan(user_data)
+        # Model outage: don't start a pipeline that will just time out, serve the last plan instead
+        if unavailable("meal_plan") or unavailable("shopping_list"):
+            return cached_meal_plan(conn, user["id"])
+
+        orchestrator = MealPlanOrchestrator(get_client())
+        try:
+            with span("meal_plan.pipeline"):
+                results = await orchestrator.create_meal_plan(user_data)
+        except CircuitOpenError:
+            return cached_meal_plan(conn, user["id"])
         
         # --- NEW LOGIC TO SAVE THE PLAN ---
         if 'error' not in results:
-            # 1. Deactivate any old plans for this user
-            cursor.execute("UPDATE meal_plans SET is_active = 0 WHERE user_id = ?", (user["id"],))
-            
-            # 2. Insert the new plan as a JSON string
-            cursor.execute("""
-                INSERT INTO meal_plans (user_id, created_at, plan_data, is_active)
-                VALUES (?, ?, ?, ?)
-            """, (user["id"], datetime.now().isoformat(), json.dumps(results), 1))
-            
+            plan_id, body = save_meal_plan(conn, user["id"], results)
+            # Generated plans become reuse candidates for similar profiles (see meal_plan_index.py)
+            meal_plan_index.add(conn, plan_id, user["id"], user["goal"], target_calories, budget,
+                                user_data['allergies'])
             conn.commit()        
+            return raw_json(body)  # serialized once, for both the DB and the response
         return results
         
     finally:
         conn.close()
 
-@app.get("/meal_plan_status")
+def reuse_similar_plan(user_id: int, goal: str, target_calories: int, budget: float, allergies) -> Optional[bytes]:
+    """Adapts and stores the nearest similar plan (see meal_plan_index.py). JSON bytes, or None on a miss."""
+    # Candidate parsing, catalog load and the budget DP are all blocking, so this runs on a worker thread
+    conn = get_db()
+    try:
+        match = meal_plan_index.nearest(conn, user_id, goal, target_calories, budget, allergies)
+        if match is None:
+            return None
+        results = adapt_plan(match, target_calories, budget, allergies, conn)
+        _, body = save_meal_plan(conn, user_id, results)
+        conn.commit()
+        return body
+    finally:
+        conn.close()
+
+def save_meal_plan(conn: sqlite3.Connection, user_id: int, results: dict) -> tuple:
+    """Stores a plan as the user's active one (the caller commits). Returns (plan_id, JSON bytes)."""
+    body = dumps(results)
+    cursor = conn.cursor()
+    # 1. Deactivate any old plans for this user
+    # (only rows that change - each updated row gets a new sync sequence)
+    cursor.execute("UPDATE meal_plans SET is_active = 0 WHERE user_id = ? AND is_active = 1", (user_id,))
+
+    # 2. Insert the new plan as a JSON string
+    cursor.execute("""
+        INSERT INTO meal_plans (user_id, created_at, plan_data, is_active)
+        VALUES (?, ?, ?, ?)
+    """, (user_id, datetime.now().isoformat(), body.decode("utf-8"), 1))
+    return cursor.lastrowid, body
+
+def cached_meal_plan(conn: sqlite3.Connection, user_id: int) -> dict:
+    """Degraded-mode answer for /create_meal_plan: the user's most recent stored plan."""
+    cursor = conn.cursor()
+    cursor.execute(
+        "SELECT plan_data, created_at FROM meal_plans WHERE user_id = ? ORDER BY is_active DESC, created_at DESC LIMIT 1",
+        (user_id,)
+    )
+    row = cursor.fetchone()
+    if not row:
+        raise HTTPException(
+            status_code=503,
+            detail="Meal planning is temporarily unavailable. Please try again in a few minutes.",
+            headers={"Retry-After": "30"}
+        )
+    plan = json.loads(row[0])
+    plan["degraded"] = True
+    plan["served_from_cache"] = {"created_at": row[1]}
+    return plan
+
+@router.get("/meal_plan_status")
 async def get_meal_plan_status(x_username: str = Header(...)):
     """Get current meal plan status (placeholder for future persistence)"""
     return {
@@ -1152,10 +2033,10 @@ async def get_meal_plan_status(x_username: str = Header(...)):
         "plan_id": None
     }
 
-@app.get("/get_active_meal_plan")
+@router.get("/get_active_meal_plan")
 async def get_active_meal_plan(x_username: str = Header(...)):
     """Fetches the current active meal plan for a user from the database."""
-    conn = sqlite3.connect("fitness.db")
+    conn = get_db()
     try:
         user = get_user_by_username(x_username, conn)
         cursor = conn.cursor()
@@ -1167,8 +2048,8 @@ async def get_active_meal_plan(x_username: str = Header(...)):
         active_plan = cursor.fetchone()
         
         if active_plan:
-            # The data is stored as a string, so we parse it back into JSON
-            return json.loads(active_plan[0])
+            # Stored as JSON text already - send it as is
+            return raw_json(active_plan[0])
         else:
             # No active plan found
             raise HTTPException(status_code=404, detail="No active meal plan found.")
@@ -1176,10 +2057,10 @@ async def get_active_meal_plan(x_username: str = Header(...)):
     finally:
         conn.close()
 
-@app.get("/get_all_meal_plans")
+@router.get("/get_all_meal_plans")
 async def get_all_meal_plans(x_username: str = Header(...)):
     """Fetches all meal plans a user has ever created."""
-    conn = sqlite3.connect("fitness.db")
+    conn = get_db()
     try:
         user = get_user_by_username(x_username, conn)
         cursor = conn.cursor()
@@ -1191,19 +2072,125 @@ async def get_all_meal_plans(x_username: str = Header(...)):
         )
         all_plans = cursor.fetchall()
         
-        # Return a list of plans
-        return [{
-            "plan_id": row[0],
-            "created_at": row[1],
-            "plan_data": json.loads(row[2]) # Parse the JSON data before sending
-        } for row in all_plans]
+        # Return a list of plans (stored plan_data is spliced in without parsing it)
+        return raw_json(json_array(
+            json_object({"plan_id": row[0], "created_at": row[1]}, {"plan_data": row[2]})
+            for row in all_plans
+        ))
             
     except Exception as e:
-        print(f"Error fetching all meal plans: {e}")
+        logger.exception("fetching all meal plans failed")
         return [] # Return an empty list on error
     finally:
         conn.close()
 
-#app.mount("/", StaticFiles(directory="static", html=True), name="static")
+# =============================================================================
+# Metrics
+# =============================================================================
+
+@router.get("/health/circuits")
+async def circuit_status():
+    """Current state of every model circuit breaker."""
+    return circuit_snapshot()
+
+@router.get("/health/models")
+async def model_routing_status():
+    """Routing policy per call type with live p95 / error rate per candidate model."""
+    return routing_table()
+
+# =============================================================================
+# Request profiles (see profiling.py)
+# =============================================================================
+
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    if not profiling.ADMIN_TOKEN:
+        raise HTTPException(status_code=404, detail="Profiling is not enabled (set PROFILE_ADMIN_TOKEN).")
+    if not profiling.is_admin(x_admin_token):
+        raise HTTPException(status_code=403, detail="Admin token required.")
+
+
+def _read_profiles(func, *args):
+    conn = get_db()
+    try:
+        return func(conn, *args)
+    finally:
+        conn.close()
+
+
+@router.get("/admin/profiles", dependencies=[Depends(require_admin)])
+async def list_request_profiles(route: Optional[str] = None, limit: int = 50):
+    """Newest stored profiles (summary only), optionally for one route template like /streak_data."""
+    return await asyncio.to_thread(_read_profiles, profiling.list_profiles, route, limit)
+
+
+@router.get("/admin/profiles/{request_id}", dependencies=[Depends(require_admin)])
+async def get_request_profile(request_id: str):
+    """Full report: sampled stacks, SQL statements, LLM calls and pipeline spans."""
+    report = await asyncio.to_thread(_read_profiles, profiling.load_profile, request_id)
+    if report is None:
+        raise HTTPException(status_code=404, detail="Profile not found.")
+    return raw_json(report)
+
+@router.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Prometheus scrape endpoint."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+# =============================================================================
+# App factory
+# =============================================================================
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    init_started = time.perf_counter()
+    await asyncio.to_thread(init_db)
+    recovered = await asyncio.to_thread(recover_sessions)
+    # Auto-closes sessions nobody stopped (see exercise_sessions.py)
+    sweeper = asyncio.create_task(run_sweeper(get_db))
+    # Moves old log rows to the archive file (see archive.py)
+    archiver = asyncio.create_task(run_archiver())
+    ready = time.perf_counter()
+    app_cold_start_seconds.set(init_started - _IMPORT_STARTED, phase="import")
+    app_cold_start_seconds.set(ready - init_started, phase="startup")
+    app_cold_start_seconds.set(ready - _IMPORT_STARTED, phase="total")
+    logger.info("app ready", extra={"fields": {
+        "cold_start_s": round(ready - _IMPORT_STARTED, 3), "pid": os.getpid(), "recovered_sessions": recovered}})
+    try:
+        yield
+    finally:
+        sweeper.cancel()
+        archiver.cancel()
+        for task in list(_voice_background):
+            task.cancel()
+        if _profile_writes:
+            await asyncio.gather(*_profile_writes, return_exceptions=True)
+        await asyncio.to_thread(log_writer.close)
+        if client is not None and hasattr(client, "close"):
+            client.close()
+
+
+def create_app() -> FastAPI:
+    app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+    # gzip / brotli for large bodies, negotiated per client (see fast_json.py)
+    app.add_middleware(CompressionMiddleware)
+
+    #CORS
+    # Add CORS middleware - CRITICAL for frontend to work
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+    )
+    app.middleware("http")(profile_request)
+    app.middleware("http")(record_request_metrics)
+    app.middleware("http")(assign_request_id)
+    app.include_router(router)
+    #app.mount("/", StaticFiles(directory="static", html=True), name="static")
+    return app
+
+
+app = create_app()
 
-# Run with: uvicorn app:app --reload
\ No newline at end of file
+# Run with: uvicorn app:app --reload  (or WEB_CONCURRENCY=4 uvicorn app:app)
\ No newline at end of file
@@ -0,0 +1,250 @@
+# archive.py - Moves old user_logs / exercise_logs rows out of the hot tables
+#
+# Rows older than LOG_ARCHIVE_AFTER_DAYS go to monthly tables
+# (user_logs_2024_01, exercise_logs_2024_01, ...) in a separate database file
+# attached as `archive`, so the hot tables and their indexes only hold recent
+# history. Per-day totals live on in daily_rollups (trends.py), which are
+# brought up to date before anything moves.
+#
+# Anything reading history beyond the hot window goes through log_source(),
+# which returns a FROM-clause source that unions the hot table with just the
+# archive partitions overlapping the requested range (via the
+# archive_partitions manifest in the main database).
+#
+# Moving is two transactions: copy into the archive file (INSERT OR REPLACE by
+# id, so a retry is harmless), then delete from the hot table and advance the
+# table's archived_before watermark together. Archive rows only count when
+# they are older than the watermark, so a crash between the two steps can't
+# double count. While the delete runs, archive_state.archiving is set so the
+# sync tombstone and rollup invalidation triggers skip it - the rows weren't
+# deleted, just moved.
+#
+# A table's newest row always stays hot, whatever its age: the tables have no
+# AUTOINCREMENT, so moving it would let SQLite hand its id out again, and the
+# next run's INSERT OR REPLACE would overwrite the archived row.
+#
+#   LOG_ARCHIVE_AFTER_DAYS   [180]   rows older than this are archived (at least 90: streaks and
+#                                     "my usual" read the last 60 / 90 days from the hot tables)
+#   LOG_ARCHIVE_DB           [<db>-archive.db]
+#   LOG_ARCHIVE_INTERVAL_S   [86400] how often the background job runs (0 = never, use the CLI)
+#
+#   python archive.py run
+import asyncio
+import os
+import sqlite3
+from datetime import datetime, timedelta
+from typing import Optional
+
+from db import DB_PATH, get_db
+from metrics import counter
+
+MIN_ARCHIVE_DAYS = 90
+ARCHIVE_AFTER_DAYS = max(int(os.getenv("LOG_ARCHIVE_AFTER_DAYS", "180")), MIN_ARCHIVE_DAYS)
+ARCHIVE_DB_PATH = os.getenv("LOG_ARCHIVE_DB", os.path.splitext(DB_PATH)[0] + "-archive.db")
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("LOG_ARCHIVE_INTERVAL_S", "86400"))
+
+# table -> (time column, extra condition for rows that may move)
+ARCHIVED_TABLES = {
+    "user_logs": ("timestamp", ""),
+    "exercise_logs": ("start_time", "AND end_time IS NOT NULL"),  # running sessions stay hot
+}
+
+rows_archived = counter("log_rows_archived_total", "Rows moved from the hot tables into the archive", ("table",))
+
+
+def init_archive(conn: sqlite3.Connection):
+    """Watermarks + partition manifest (must exist before the sync/rollup triggers that check it)."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS archive_state (
+            table_name TEXT PRIMARY KEY,
+            archived_before TEXT NOT NULL,      -- archive rows older than this are live
+            archiving INTEGER NOT NULL DEFAULT 0  -- set only inside the move transaction
+        )
+    """)
+    cursor.executemany("INSERT OR IGNORE INTO archive_state (table_name, archived_before) VALUES (?, '')",
+                       [(table,) for table in ARCHIVED_TABLES])
+    cursor.execute("UPDATE archive_state SET archiving = 0")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS archive_partitions (
+            table_name TEXT NOT NULL,
+            partition TEXT NOT NULL,            -- YYYY_MM
+            row_count INTEGER NOT NULL,
+            min_time TEXT,
+            max_time TEXT,
+            max_change_seq INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (table_name, partition)
+        )
+    """)
+    conn.commit()
+
+
+def _columns(conn: sqlite3.Connection, table: str, schema: str = "main") -> list:
+    return [(row[1], row[2]) for row in conn.execute(f"PRAGMA {schema}.table_info({table})")]
+
+
+def _attach(conn: sqlite3.Connection):
+    if not any(row[1] == "archive" for row in conn.execute("PRAGMA database_list")):
+        conn.execute("ATTACH DATABASE ? AS archive", (ARCHIVE_DB_PATH,))
+
+
+# =============================================================================
+# Query layer
+# =============================================================================
+
+def log_source(conn: sqlite3.Connection, table: str, since: Optional[str] = None,
+               min_change_seq: Optional[int] = None) -> str:
+    """
+    FROM-clause source for `table` covering hot and archived rows, e.g.
+        f"SELECT ... FROM {log_source(conn, 'user_logs', since='2024-01-01')} WHERE ..."
+    Only archive partitions that can contain rows at/after `since` (time) or
+    with change_seq > min_change_seq are included; with none it's just the hot table.
+    """
+    time_column, _ = ARCHIVED_TABLES[table]
+    query = "SELECT partition FROM archive_partitions WHERE table_name = ?"
+    params = [table]
+    if since is not None:
+        query += " AND max_time >= ?"
+        params.append(since)
+    if min_change_seq is not None:
+        query += " AND max_change_seq > ?"
+        params.append(min_change_seq)
+    partitions = [row[0] for row in conn.execute(query + " ORDER BY partition", params)]
+    if not partitions:
+        return f"main.{table}"
+
+    _attach(conn)
+    archived_before = conn.execute(
+        "SELECT archived_before FROM archive_state WHERE table_name = ?", (table,)).fetchone()[0]
+    columns = ", ".join(name for name, _ in _columns(conn, table))
+    parts = [f"SELECT {columns} FROM main.{table}"]
+    for partition in partitions:
+        parts.append(f"SELECT {columns} FROM archive.{table}_{partition} "
+                     f"WHERE {time_column} < '{archived_before}'")
+    return "(" + " UNION ALL ".join(parts) + f") AS {table}"
+
+
+# =============================================================================
+# Archival job
+# =============================================================================
+
+def _ensure_partition(conn: sqlite3.Connection, table: str, partition: str) -> str:
+    """Creates (or widens, after hot-table migrations) archive.<table>_<partition>."""
+    name = f"{table}_{partition}"
+    hot = _columns(conn, table)
+    existing = {column for column, _ in _columns(conn, name, "archive")}
+    if not existing:
+        definition = ", ".join(f"{column} {sql_type}" + (" PRIMARY KEY" if column == "id" else "")
+                               for column, sql_type in hot)
+        conn.execute(f"CREATE TABLE archive.{name} ({definition})")
+        time_column, _ = ARCHIVED_TABLES[table]
+        conn.execute(f"CREATE INDEX archive.idx_{name}_user_time ON {name} (user_id, {time_column})")
+        if any(column == "change_seq" for column, _ in hot):
+            conn.execute(f"CREATE INDEX archive.idx_{name}_user_seq ON {name} (user_id, change_seq)")
+    else:
+        for column, sql_type in hot:
+            if column not in existing:
+                conn.execute(f"ALTER TABLE archive.{name} ADD COLUMN {column} {sql_type}")
+    return name
+
+
+def archive_table(conn: sqlite3.Connection, table: str, cutoff: str) -> int:
+    """Moves rows of `table` older than `cutoff` (ISO date) into the archive. Returns rows moved."""
+    time_column, condition = ARCHIVED_TABLES[table]
+    condition += f" AND id < (SELECT MAX(id) FROM main.{table})"  # keeps ids from being reused
+    months = [row[0] for row in conn.execute(
+        f"SELECT DISTINCT strftime('%Y_%m', {time_column}) FROM {table} "
+        f"WHERE {time_column} < ? {condition} ORDER BY 1", (cutoff,))]
+    if not months:
+        return 0
+    _attach(conn)
+    columns = ", ".join(name for name, _ in _columns(conn, table))
+
+    # 1. Copy (archive file only)
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for month in months:
+            name = _ensure_partition(conn, table, month)
+            conn.execute(
+                f"INSERT OR REPLACE INTO archive.{name} ({columns}) SELECT {columns} FROM main.{table} "
+                f"WHERE {time_column} < ? AND strftime('%Y_%m', {time_column}) = ? {condition}",
+                (cutoff, month)
+            )
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+    # 2. Delete what made it into the archive + advance the watermark (main file only).
+    # Rows updated since the copy (same id, newer change_seq) stay hot until the next run.
+    has_seq = "change_seq" in columns.split(", ")
+    copied = "(id, change_seq) IN (SELECT id, change_seq" if has_seq else "id IN (SELECT id"
+    moved = 0
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("UPDATE archive_state SET archiving = 1 WHERE table_name = ?", (table,))
+        for month in months:
+            name = f"{table}_{month}"
+            moved += conn.execute(
+                f"DELETE FROM main.{table} WHERE {time_column} < ? {condition} "
+                f"AND {copied} FROM archive.{name})", (cutoff,)
+            ).rowcount
+            stats = conn.execute(
+                f"SELECT COUNT(*), MIN({time_column}), MAX({time_column}), "
+                f"{'MAX(change_seq)' if has_seq else '0'} FROM archive.{name}"
+            ).fetchone()
+            conn.execute("""
+                INSERT OR REPLACE INTO archive_partitions
+                    (table_name, partition, row_count, min_time, max_time, max_change_seq)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (table, month, stats[0], stats[1], stats[2], stats[3] or 0))
+        conn.execute("UPDATE archive_state SET archived_before = MAX(archived_before, ?), archiving = 0 "
+                     "WHERE table_name = ?", (cutoff, table))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    rows_archived.inc(moved, table=table)
+    return moved
+
+
+def archive_old_logs(after_days: int = ARCHIVE_AFTER_DAYS) -> dict:
+    """Rolls up, then archives, every row older than the horizon."""
+    from trends import refresh_rollups  # trends reads through log_source, so import late
+
+    today = datetime.now().date()
+    cutoff = (today - timedelta(days=max(after_days, MIN_ARCHIVE_DAYS))).isoformat()
+    conn = get_db()
+    conn.isolation_level = None  # explicit transactions below
+    try:
+        conn.execute("PRAGMA busy_timeout = 5000")
+        users = [row[0] for row in conn.execute(
+            "SELECT user_id FROM user_logs WHERE timestamp < ? UNION "
+            "SELECT user_id FROM exercise_logs WHERE start_time < ? AND end_time IS NOT NULL",
+            (cutoff, cutoff))]
+        for user_id in users:
+            refresh_rollups(conn, user_id, today)
+        return {table: archive_table(conn, table, cutoff) for table in ARCHIVED_TABLES}
+    finally:
+        conn.close()
+
+
+async def run_archiver(interval: float = ARCHIVE_INTERVAL_SECONDS):
+    """Background loop for the lifespan (does nothing when the interval is 0)."""
+    if interval <= 0:
+        return
+    while True:
+        try:
+            await asyncio.to_thread(archive_old_logs)
+        except Exception:
+            pass  # e.g. database busy; try again next round
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 2 or sys.argv[1] != "run":
+        print("Usage: python archive.py run")
+        sys.exit(1)
+    print(archive_old_logs())
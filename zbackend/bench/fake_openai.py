@@ -0,0 +1,195 @@
+# fake_openai.py - Offline stand-in for the OpenAI API used by the benchmarks
+#
+# Implements just enough of /v1/chat/completions and /v1/audio/transcriptions
+# for app.py: deterministic answers (same input -> same output) with a
+# configurable, seeded latency. Point the backend at it with
+#   OPENAI_BASE_URL=http://127.0.0.1:9100/v1 OPENAI=fake
+#
+# Env:
+#   FAKE_OPENAI_LATENCY_MS   per-kind latency, e.g. "chat=800,vision=1500,transcription=400"
+#                            or a single number for all kinds (default "chat=0,vision=0,transcription=0")
+#   FAKE_OPENAI_JITTER       +/- fraction of latency added per call (default 0.2)
+#
+# Run: uvicorn fake_openai:app --port 9100
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+
+from fastapi import FastAPI, Request, UploadFile, File, Form
+from fastapi.responses import StreamingResponse
+
+app = FastAPI()
+
+FOODS = [
+    ("Grilled Chicken Salad", "Grilled chicken over mixed greens", 420),
+    ("Oatmeal", "Oatmeal with blueberries and honey", 320),
+    ("Pepperoni Pizza", "Two slices of pepperoni pizza", 570),
+    ("Salmon", "Grilled salmon fillet with rice", 610),
+    ("Banana", "A ripe banana", 105),
+    ("Mystery Stew", "A hearty vegetable and bean stew", 380),
+]
+
+PHRASES = [
+    "log this food",
+    "how am I doing today",
+    "log it",
+    "start my run",
+    "stop my run",
+    "is this healthy",
+    "log my usual breakfast",
+]
+
+INTENTS = {
+    "log this food": "log_food",
+    "how am I doing today": "get_summary",
+    "log it": "log_previous",
+    "start my run": "start_exercise",
+    "stop my run": "stop_exercise",
+    "is this healthy": "analyze_food",
+    "log my usual breakfast": "log_usual",
+}
+
+
+def _latency_config() -> dict:
+    raw = os.getenv("FAKE_OPENAI_LATENCY_MS", "chat=0,vision=0,transcription=0")
+    if "=" not in raw:
+        return {kind: float(raw) for kind in ("chat", "vision", "transcription")}
+    config = {}
+    for part in raw.split(","):
+        kind, _, value = part.partition("=")
+        config[kind.strip()] = float(value or 0)
+    return config
+
+
+LATENCY_MS = _latency_config()
+JITTER = float(os.getenv("FAKE_OPENAI_JITTER", "0.2"))
+_rng = random.Random(42)
+
+
+async def _simulate_latency(kind: str):
+    base = LATENCY_MS.get(kind, 0.0)
+    if base > 0:
+        await asyncio.sleep(base * (1 + _rng.uniform(-JITTER, JITTER)) / 1000.0)
+
+
+def _pick(seed: str, options: list):
+    digest = hashlib.sha1(seed.encode("utf-8", "ignore")).digest()
+    return options[digest[0] % len(options)]
+
+
+def _text_of(messages: list) -> str:
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(p.get("text", "") for p in content if p.get("type") == "text")
+            parts.extend(p["image_url"]["url"][-64:] for p in content if p.get("type") == "image_url")
+    return "\n".join(parts)
+
+
+def _has_image(messages: list) -> bool:
+    return any(isinstance(m.get("content"), list) and
+               any(p.get("type") == "image_url" for p in m["content"]) for m in messages)
+
+
+def _meal_plan() -> dict:
+    days = {}
+    for day in range(1, 8):
+        days[f"day_{day}"] = {
+            "breakfast": {"recipe": "Oatmeal with berries", "calories": 350, "prep_time": "5 min"},
+            "lunch": {"recipe": "Grilled chicken salad", "calories": 550, "prep_time": "15 min"},
+            "dinner": {"recipe": "Salmon with brown rice and broccoli", "calories": 700, "prep_time": "25 min"},
+        }
+    return {"week_plan": days, "total_weekly_calories": 11200, "reasoning": "Balanced, high-protein week."}
+
+
+def _answer(messages: list) -> str:
+    text = _text_of(messages)
+    if _has_image(messages):
+        name, description, calories = _pick(text, FOODS)
+        return f"{name}|{description}|{calories}"
+    if "7-day meal plan" in text:
+        return json.dumps(_meal_plan())
+    if "grocery list" in text:
+        return json.dumps({
+            "grocery_list": [
+                {"item": "chicken breast", "quantity": "3 lbs", "category": "meat"},
+                {"item": "salmon", "quantity": "2 lbs", "category": "seafood"},
+                {"item": "rolled oats", "quantity": "2 lbs", "category": "grains"},
+                {"item": "berries", "quantity": "2 lbs", "category": "produce"},
+                {"item": "brown rice", "quantity": "2 lbs", "category": "grains"},
+                {"item": "broccoli", "quantity": "2 lbs", "category": "produce"},
+                {"item": "mixed greens", "quantity": "1 lb", "category": "produce"},
+            ],
+            "estimated_cost": 75,
+            "shopping_categories": ["produce", "meat", "seafood", "grains"],
+        })
+    if "nutritional completeness" in text or "health_score" in text:
+        return json.dumps({
+            "health_score": 82,
+            "nutritional_analysis": {"protein_adequacy": "adequate", "micronutrient_gaps": ["vitamin_d"],
+                                     "macro_distribution": {"protein": "30%", "carbs": "45%", "fats": "25%"}},
+            "warnings": [],
+            "improvements": ["Add more leafy greens"],
+            "approval_status": "approved",
+        })
+    if "intent classifier" in text:
+        user_text = messages[-1].get("content", "") if messages else ""
+        action = INTENTS.get(user_text, "unknown")
+        result = {"action": action, "confidence": "high"}
+        if action == "log_usual":
+            result["meal"] = "breakfast"
+        return json.dumps(result)
+    if "macro" in text:
+        return json.dumps({"protein": 25, "carbs": 40, "fats": 12})
+    return "{}"
+
+
+def _usage(prompt: str, completion: str) -> dict:
+    prompt_tokens = max(len(prompt) // 4, 1)
+    completion_tokens = max(len(completion) // 4, 1)
+    return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens}
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    await _simulate_latency("vision" if _has_image(messages) else "chat")
+    content = _answer(messages)
+    model = body.get("model", "gpt-4o-mini")
+    created = int(time.time())
+
+    if body.get("stream"):
+        def chunks():
+            for i in range(0, len(content), 8):
+                chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                         "choices": [{"index": 0, "delta": {"content": content[i:i + 8]}, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+            done = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+            yield f"data: {json.dumps(done)}\n\n"
+            yield "data: [DONE]\n\n"
+        return StreamingResponse(chunks(), media_type="text/event-stream")
+
+    return {
+        "id": "chatcmpl-fake",
+        "object": "chat.completion",
+        "created": created,
+        "model": model,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": _usage(_text_of(messages), content),
+    }
+
+
+@app.post("/v1/audio/transcriptions")
+async def transcriptions(file: UploadFile = File(...), model: str = Form("whisper-1")):
+    audio = await file.read()
+    await _simulate_latency("transcription")
+    return {"text": _pick(hashlib.sha1(audio).hexdigest(), PHRASES)}
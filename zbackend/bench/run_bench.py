@@ -0,0 +1,272 @@
+# run_bench.py - Offline endpoint load test
+#
+# Spins up the fake OpenAI server and the backend (both via uvicorn) against a
+# seeded benchmark database, then drives each scenario with a fixed
+# concurrency and reports throughput, latency percentiles, bytes on the wire
+# per response and backend CPU per request (Linux, from /proc). No network
+# access or OpenAI quota needed.
+#
+#   python run_bench.py                                   # all scenarios, defaults
+#   python run_bench.py --scenarios summary,streak_data --concurrency 50 --requests 2000
+#   python run_bench.py --json results.json               # save results
+#   python run_bench.py --baseline results.json           # exit 1 if p99 regressed
+#   python run_bench.py --scenarios all_meal_plans --accept-encoding identity   # uncompressed payloads
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import httpx
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+BACKEND_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from seed_data import seed  # noqa: E402
+
+# Tiny but valid-looking payloads; the fake server only hashes them
+IMAGE_BYTES = b"\xff\xd8\xff\xe0" + b"bench-image" * 64
+VOICE_PHRASES = 16  # different audio blobs -> different (deterministic) transcriptions
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start(module: str, port: int, cwd: str, env: dict, workers: int = 1) -> subprocess.Popen:
+    cmd = [sys.executable, "-m", "uvicorn", module, "--port", str(port), "--log-level", "warning"]
+    if workers > 1:
+        # WEB_CONCURRENCY also tells the app it shares state with other workers (see db.py)
+        cmd += ["--workers", str(workers)]
+        env = dict(env, WEB_CONCURRENCY=str(workers))
+    return subprocess.Popen(cmd, cwd=cwd, env=env, stdout=subprocess.DEVNULL)
+
+
+def _cpu_seconds(pid: int) -> float:
+    """utime + stime of a process and its direct children (uvicorn workers), 0 without /proc."""
+    tick = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+    total = 0
+    try:
+        entries = [e for e in os.listdir("/proc") if e.isdigit()]
+    except OSError:
+        return 0.0
+    for entry in entries:
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        # fields[1] is ppid, [11] utime, [12] stime (counting from the state field)
+        if int(entry) == pid or int(fields[1]) == pid:
+            total += int(fields[11]) + int(fields[12])
+    return total / tick
+
+
+def _wait_ready(url: str, timeout: float = 30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            httpx.get(url, timeout=1.0)
+            return
+        except httpx.HTTPError:
+            time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+# =============================================================================
+# Scenarios: each returns kwargs for httpx.AsyncClient.request
+# =============================================================================
+
+def scenario_summary(user: str, i: int) -> dict:
+    return {"method": "GET", "url": "/summary", "headers": {"X-Username": user}}
+
+
+def scenario_streak_data(user: str, i: int) -> dict:
+    return {"method": "GET", "url": "/streak_data", "headers": {"X-Username": user}}
+
+
+def scenario_log_food_direct(user: str, i: int) -> dict:
+    return {"method": "POST", "url": "/log_food_direct", "headers": {"X-Username": user},
+            "files": {"image": ("food.jpg", IMAGE_BYTES + str(i % 6).encode(), "image/jpeg")}}
+
+
+def scenario_voice_command(user: str, i: int) -> dict:
+    return {"method": "POST", "url": "/voice_command", "headers": {"X-Username": user},
+            "files": {"audio": ("voice.webm", f"bench-audio-{i % VOICE_PHRASES}".encode(), "audio/webm")}}
+
+
+def scenario_create_meal_plan(user: str, i: int) -> dict:
+    return {"method": "POST", "url": "/create_meal_plan", "headers": {"X-Username": user},
+            "json": {"budget": random.Random(i).choice([40, 75, 120]), "allergies": ""}}
+
+
+def scenario_active_meal_plan(user: str, i: int) -> dict:
+    return {"method": "GET", "url": "/get_active_meal_plan", "headers": {"X-Username": user}}
+
+
+def scenario_all_meal_plans(user: str, i: int) -> dict:
+    return {"method": "GET", "url": "/get_all_meal_plans", "headers": {"X-Username": user}}
+
+
+SCENARIOS = {
+    "summary": scenario_summary,
+    "streak_data": scenario_streak_data,
+    "log_food_direct": scenario_log_food_direct,
+    "voice_command": scenario_voice_command,
+    "create_meal_plan": scenario_create_meal_plan,
+    "active_meal_plan": scenario_active_meal_plan,
+    "all_meal_plans": scenario_all_meal_plans,
+}
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(int(round(pct / 100.0 * (len(sorted_values) - 1))), len(sorted_values) - 1)
+    return sorted_values[index]
+
+
+async def run_scenario(base_url: str, name: str, users: list, total: int, concurrency: int,
+                       accept_encoding: str = "gzip, br", server_pid: int = None) -> dict:
+    build = SCENARIOS[name]
+    latencies, errors, statuses = [], 0, {}
+    wire_bytes = 0
+    next_index = 0
+
+    async with httpx.AsyncClient(base_url=base_url, timeout=120.0,
+                                 headers={"Accept-Encoding": accept_encoding}) as client:
+        async def worker():
+            nonlocal next_index, errors, wire_bytes
+            while next_index < total:
+                i = next_index
+                next_index += 1
+                request = build(users[i % len(users)], i)
+                started = time.perf_counter()
+                try:
+                    response = await client.request(**request)
+                    statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                    wire_bytes += response.num_bytes_downloaded
+                    if response.status_code >= 400:
+                        errors += 1
+                except httpx.HTTPError:
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        cpu_before = _cpu_seconds(server_pid) if server_pid else 0.0
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        cpu = (_cpu_seconds(server_pid) - cpu_before) if server_pid else 0.0
+
+    latencies.sort()
+    return {
+        "scenario": name,
+        "requests": total,
+        "concurrency": concurrency,
+        "errors": errors,
+        "status_codes": {str(k): v for k, v in sorted(statuses.items())},
+        "throughput_rps": round(total / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50) * 1000, 1),
+        "p90_ms": round(percentile(latencies, 90) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 1),
+        "max_ms": round(latencies[-1] * 1000, 1) if latencies else 0.0,
+        "avg_response_bytes": round(wire_bytes / total) if total else 0,
+        "cpu_ms_per_request": round(cpu * 1000 / total, 2) if total else 0.0,
+    }
+
+
+def compare(results: list, baseline_path: str, max_regression: float) -> list:
+    with open(baseline_path) as f:
+        baseline = {r["scenario"]: r for r in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        before = baseline.get(result["scenario"])
+        if before and before["p99_ms"] > 0 and result["p99_ms"] > before["p99_ms"] * (1 + max_regression):
+            regressions.append(f"{result['scenario']}: p99 {before['p99_ms']}ms -> {result['p99_ms']}ms")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline backend load test")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--users", type=int, default=50, help="synthetic users to seed")
+    parser.add_argument("--days", type=int, default=730, help="days of history per user")
+    parser.add_argument("--requests", type=int, default=300, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers for the backend")
+    parser.add_argument("--latency-ms", default="chat=300,vision=600,transcription=200",
+                        help="fake OpenAI latency (see fake_openai.py)")
+    parser.add_argument("--rate-limits", action="store_true",
+                        help="keep the per-user LLM rate limits (off by default so a few users can drive load)")
+    parser.add_argument("--accept-encoding", default="gzip, br",
+                        help="Accept-Encoding sent by the client (identity = no compression)")
+    parser.add_argument("--db", help="reuse an already seeded database instead of a temp one")
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--baseline", help="compare p99 against a previous --json file")
+    parser.add_argument("--max-regression", type=float, default=0.2, help="allowed p99 increase (0.2 = 20%%)")
+    args = parser.parse_args()
+
+    names = [n.strip() for n in args.scenarios.split(",") if n.strip()]
+    unknown = [n for n in names if n not in SCENARIOS]
+    if unknown:
+        parser.error(f"unknown scenarios: {unknown}. Choose from {list(SCENARIOS)}")
+
+    workdir = tempfile.mkdtemp(prefix="athyra-bench-")
+    db_path = os.path.abspath(args.db) if args.db else os.path.join(workdir, "bench.db")
+    if not args.db:
+        seconds = seed(db_path, args.users, args.days)
+        print(f"Seeded {args.users} users x {args.days} days in {seconds:.1f}s")
+    users = [f"bench_user_{n}" for n in range(args.users)]
+
+    fake_port, app_port = _free_port(), _free_port()
+    env = dict(os.environ, FAKE_OPENAI_LATENCY_MS=args.latency_ms, FITNESS_DB=db_path, OPENAI="fake",
+               OPENAI_BASE_URL=f"http://127.0.0.1:{fake_port}/v1", LOG_LEVEL="WARNING")
+    if not args.rate_limits:
+        env.update(LLM_RATE_PER_MIN="1000000", LLM_BURST="1000000",
+                   LLM_HEAVY_RATE_PER_MIN="1000000", LLM_HEAVY_BURST="1000000")
+    processes = [_start("fake_openai:app", fake_port, BENCH_DIR, env)]
+    try:
+        _wait_ready(f"http://127.0.0.1:{fake_port}/docs")
+        processes.append(_start("app:app", app_port, BACKEND_DIR, env, args.workers))
+        _wait_ready(f"http://127.0.0.1:{app_port}/docs")
+
+        results = []
+        for name in names:
+            result = asyncio.run(run_scenario(f"http://127.0.0.1:{app_port}", name, users,
+                                              args.requests, args.concurrency, args.accept_encoding,
+                                              processes[-1].pid))
+            results.append(result)
+            print(f"{name:<18} {result['throughput_rps']:>8} req/s  p50 {result['p50_ms']:>8}ms  "
+                  f"p90 {result['p90_ms']:>8}ms  p99 {result['p99_ms']:>8}ms  "
+                  f"{result['avg_response_bytes']:>8} B/resp  {result['cpu_ms_per_request']:>6} cpu-ms/req  "
+                  f"errors {result['errors']}")
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.wait(timeout=10)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"created_at": time.time(), "config": vars(args), "results": results}, f, indent=2)
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.max_regression)
+        for line in regressions:
+            print(f"REGRESSION {line}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+# seed_data.py - Synthetic data generator for benchmarks
+#
+# Creates N users with `days` of food + exercise history (and a few stored
+# meal plans) in a fitness.db-compatible database.
+#
+#   python seed_data.py --db bench.db --users 100 --days 730
+import argparse
+import json
+import os
+import random
+import sqlite3
+import sys
+import time
+from datetime import datetime, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (type, description, calories, protein, carbs, fats) per meal slot hour
+FOODS = {
+    8: [("Oatmeal", "Oatmeal with blueberries", 320, 10, 55, 6),
+        ("Eggs", "Scrambled eggs and toast", 350, 20, 25, 18),
+        ("Yogurt", "Greek yogurt with granola", 300, 20, 35, 8)],
+    13: [("Salad", "Grilled chicken salad", 420, 38, 14, 22),
+         ("Sandwich", "Turkey sandwich", 430, 28, 44, 15),
+         ("Burrito", "Chicken burrito", 600, 27, 71, 22)],
+    19: [("Salmon", "Salmon with rice and broccoli", 610, 42, 55, 20),
+         ("Pasta", "Spaghetti bolognese", 560, 28, 65, 20),
+         ("Pizza", "Two slices of pepperoni pizza", 570, 24, 72, 20)],
+    15: [("Apple", "An apple", 95, 0, 25, 0),
+         ("Protein bar", "Protein bar", 210, 20, 22, 7)],
+}
+EXERCISES = ["running", "walking", "cycling", "swimming", "strength", "yoga"]
+GOALS = ["lose_weight", "gain_muscle", "maintain"]
+RECIPES = {
+    "breakfast": ["Overnight oats with berries", "Spinach and feta omelette", "Greek yogurt parfait"],
+    "lunch": ["Chicken quinoa bowl", "Lentil soup with whole grain bread", "Turkey avocado wrap"],
+    "dinner": ["Baked salmon with sweet potato", "Beef and broccoli stir fry", "Chickpea curry with rice"],
+    "snack": ["Apple with peanut butter", "Hummus and carrot sticks", "Cottage cheese with pineapple"],
+}
+GROCERIES = ["oats", "blueberries", "eggs", "spinach", "feta", "greek yogurt", "chicken breast", "quinoa",
+             "lentils", "whole grain bread", "turkey", "avocado", "salmon", "sweet potato", "beef", "broccoli",
+             "chickpeas", "rice", "apples", "peanut butter", "hummus", "carrots", "cottage cheese", "pineapple"]
+
+
+def meal_plan_data(rng: random.Random, target: int) -> dict:
+    """A stored plan shaped like a full pipeline result (tens of KB of JSON, like the real ones)."""
+    share = {"breakfast": 0.25, "lunch": 0.3, "dinner": 0.35, "snack": 0.1}
+    week_plan = {}
+    for d in range(1, 8):
+        week_plan[f"day_{d}"] = {
+            slot: {
+                "recipe": rng.choice(options),
+                "calories": int(target * share[slot]),
+                "protein": rng.randint(10, 45),
+                "carbs": rng.randint(15, 80),
+                "fats": rng.randint(5, 30),
+                "ingredients": rng.sample(GROCERIES, 5),
+                "instructions": "Prep the ingredients, cook until done and season to taste. " * 3,
+            }
+            for slot, options in RECIPES.items()
+        }
+    grocery_list = [{"item": item, "quantity": f"{rng.randint(1, 4)} units", "category": "produce",
+                     "estimated_cost": round(rng.uniform(1, 12), 2)} for item in GROCERIES]
+    return {
+        "health_analysis": {"target_calories": target, "macro_split": {"protein": 30, "carbs": 40, "fats": 30},
+                            "observations": ["Protein intake is below target on most days."] * 5},
+        "meal_plan": {"week_plan": week_plan, "total_weekly_calories": target * 7,
+                      "reasoning": "Balanced macros spread across four meals to keep energy stable. " * 4},
+        "shopping_list": {"grocery_list": grocery_list, "total_estimated_cost": 95.0},
+        "budget_optimization": {"optimized_list": grocery_list, "total_cost": 88.5,
+                                "savings_tips": ["Buy oats and rice in bulk."] * 5},
+        "execution_metrics": {"total_time_seconds": 0, "agent_calls": 4},
+    }
+
+
+def seed(db_path: str, users: int, days: int, seed_value: int = 1, prefix: str = "bench_user_"):
+    os.environ["FITNESS_DB"] = db_path
+    os.environ.setdefault("OPENAI", "fake")
+    sys.path.insert(0, BACKEND_DIR)
+    import app
+    app.init_db()
+
+    rng = random.Random(seed_value)
+    conn = sqlite3.connect(db_path)
+    started = time.perf_counter()
+    now = datetime.now().replace(microsecond=0)
+
+    for n in range(users):
+        username = f"{prefix}{n}"
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO users (username, age, sex, height_cm, weight_kg, goal) VALUES (?, ?, ?, ?, ?, ?)",
+            (username, rng.randint(18, 70), rng.choice(["male", "female"]), rng.randint(150, 195),
+             rng.randint(50, 120), rng.choice(GOALS))
+        )
+        if cursor.rowcount == 0:
+            continue
+        user_id = cursor.lastrowid
+
+        food_rows, exercise_rows = [], []
+        for day in range(days):
+            date = now - timedelta(days=day)
+            if rng.random() < 0.15:  # skipped days break streaks
+                continue
+            for hour, options in FOODS.items():
+                if rng.random() < 0.8:
+                    food = rng.choice(options)
+                    ts = date.replace(hour=hour, minute=rng.randint(0, 59))
+                    food_rows.append((user_id, ts.isoformat()) + food)
+            if rng.random() < 0.4:
+                start = date.replace(hour=rng.choice([6, 7, 17, 18]), minute=rng.randint(0, 59))
+                duration = rng.randint(15, 90) * 60
+                exercise_rows.append((user_id, rng.choice(EXERCISES), start.isoformat(),
+                                      (start + timedelta(seconds=duration)).isoformat(), duration,
+                                      int(duration / 3600 * 8 * 75)))
+
+        conn.executemany(
+            "INSERT INTO user_logs (user_id, timestamp, type, description, calories, protein, carbs, fats) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", food_rows)
+        conn.executemany(
+            "INSERT INTO exercise_logs (user_id, exercise_type, start_time, end_time, duration_seconds, calories_burned) "
+            "VALUES (?, ?, ?, ?, ?, ?)", exercise_rows)
+        for k in range(3):
+            plan = meal_plan_data(rng, rng.choice([1800, 2200, 2600]))
+            conn.execute(
+                "INSERT INTO meal_plans (user_id, created_at, plan_data, is_active) VALUES (?, ?, ?, ?)",
+                (user_id, (now - timedelta(days=7 * k)).isoformat(), json.dumps(plan), int(k == 0)))
+        conn.commit()
+
+    conn.close()
+    return time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Seed a benchmark database")
+    parser.add_argument("--db", default="bench.db")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    elapsed = seed(args.db, args.users, args.days, args.seed)
+    print(f"Seeded {args.users} users x {args.days} days into {args.db} in {elapsed:.1f}s")
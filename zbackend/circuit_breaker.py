@@ -0,0 +1,135 @@
+# circuit_breaker.py - Fail fast when a model is erroring or too slow
+#
+# One breaker per (model, call). It trips OPEN when, over the last
+# CB_WINDOW_S seconds (and at least CB_MIN_CALLS calls), the error rate or the
+# slow-call rate reaches CB_FAILURE_RATE. While open, calls are refused
+# immediately (CircuitOpenError) so endpoints can serve a degraded answer.
+# After CB_OPEN_S it goes HALF_OPEN and lets a single probe through: success
+# closes it, failure re-opens it.
+import os
+import threading
+import time
+from collections import deque
+
+from metrics import counter, gauge
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUE = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+FAILURE_RATE = float(os.getenv("CB_FAILURE_RATE", "0.5"))
+MIN_CALLS = int(os.getenv("CB_MIN_CALLS", "5"))
+WINDOW_SECONDS = float(os.getenv("CB_WINDOW_S", "60"))
+OPEN_SECONDS = float(os.getenv("CB_OPEN_S", "30"))
+
+# A call slower than this counts against the breaker even if it succeeds
+SLOW_CALL_SECONDS = {
+    "food_vision": 20.0,
+    "food_vision_stream": 20.0,
+    "voice_transcription": 15.0,
+    "voice_intent": 8.0,
+    "macro_estimate": 10.0,
+    "meal_plan": 90.0,
+    "shopping_list": 60.0,
+    "health_validation": 30.0,
+}
+DEFAULT_SLOW_CALL_SECONDS = 30.0
+
+circuit_state = gauge("circuit_breaker_state", "0 = closed, 1 = half open, 2 = open", ("breaker",))
+circuit_rejections = counter("circuit_breaker_rejections_total", "Calls refused by an open breaker", ("breaker",))
+circuit_trips = counter("circuit_breaker_trips_total", "Times a breaker opened", ("breaker",))
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling a model whose breaker is open."""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"circuit '{name}' is open")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, slow_call_seconds: float):
+        self.name = name
+        self.slow_call_seconds = slow_call_seconds
+        self.state = CLOSED
+        self.opened_at = 0.0
+        self.probe_in_flight = False
+        self._calls = deque()  # (timestamp, failed_or_slow)
+        self._lock = threading.Lock()
+        circuit_state.set(0, breaker=name)
+
+    def _set_state(self, state: str):
+        self.state = state
+        circuit_state.set(_STATE_VALUE[state], breaker=self.name)
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + OPEN_SECONDS - time.monotonic())
+
+    def allow(self) -> bool:
+        """True if a call may go ahead. Callers that get True must call record()."""
+        with self._lock:
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < OPEN_SECONDS:
+                    circuit_rejections.inc(breaker=self.name)
+                    return False
+                self._set_state(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self.probe_in_flight:
+                    circuit_rejections.inc(breaker=self.name)
+                    return False
+                self.probe_in_flight = True
+            return True
+
+    def is_open(self) -> bool:
+        """Peek without claiming a probe slot."""
+        with self._lock:
+            return self.state == OPEN and time.monotonic() - self.opened_at < OPEN_SECONDS
+
+    def record(self, ok: bool, duration: float):
+        bad = (not ok) or duration >= self.slow_call_seconds
+        now = time.monotonic()
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self.probe_in_flight = False
+                if bad:
+                    self._trip(now)
+                else:
+                    self._calls.clear()
+                    self._set_state(CLOSED)
+                return
+
+            self._calls.append((now, bad))
+            while self._calls and now - self._calls[0][0] > WINDOW_SECONDS:
+                self._calls.popleft()
+            if self.state == CLOSED and len(self._calls) >= MIN_CALLS:
+                bad_calls = sum(1 for _, was_bad in self._calls if was_bad)
+                if bad_calls / len(self._calls) >= FAILURE_RATE:
+                    self._trip(now)
+
+    def _trip(self, now: float):
+        self.opened_at = now
+        self._calls.clear()
+        self._set_state(OPEN)
+        circuit_trips.inc(breaker=self.name)
+
+
+_breakers = {}
+_registry_lock = threading.Lock()
+
+
+def get_breaker(model: str, call: str) -> CircuitBreaker:
+    name = f"{model}:{call}"
+    breaker = _breakers.get(name)
+    if breaker is None:
+        with _registry_lock:
+            breaker = _breakers.get(name)
+            if breaker is None:
+                breaker = _breakers[name] = CircuitBreaker(
+                    name, SLOW_CALL_SECONDS.get(call, DEFAULT_SLOW_CALL_SECONDS))
+    return breaker
+
+
+def snapshot() -> dict:
+    return {name: {"state": b.state, "retry_after_seconds": round(b.retry_after(), 1)}
+            for name, b in list(_breakers.items())}
@@ -0,0 +1,82 @@
+# db.py - SQLite connection helper
+#
+# Every endpoint opens its own short-lived connection through get_db() so
+# statement timings end up in the sqlite_query_duration_seconds histogram
+# (and in the request's profile when it's being profiled, see profiling.py).
+#
+# With several workers (WEB_CONCURRENCY > 1, read by both uvicorn and
+# gunicorn) every process opens the same file: schema setup runs under
+# init_lock(), and the per-process caches that can't tolerate a stale answer
+# (analysis_cache.py, exercise_sessions.py) check SQLite on a miss.
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: single worker only
+    fcntl = None
+
+from metrics import sqlite_query_seconds
+from profiling import record_query
+
+DB_PATH = os.getenv("FITNESS_DB", "fitness.db")
+WORKERS = int(os.getenv("WEB_CONCURRENCY", "1"))
+
+
+def _operation(sql: str) -> str:
+    words = sql.lstrip().split(None, 1)
+    return words[0].upper() if words else "UNKNOWN"
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that records how long each statement takes."""
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            sqlite_query_seconds.observe(elapsed, operation=_operation(sql))
+            record_query(sql, started, elapsed)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = time.perf_counter() - started
+            sqlite_query_seconds.observe(elapsed, operation=_operation(sql))
+            record_query(sql, started, elapsed, many=True)
+
+
+class TimedConnection(sqlite3.Connection):
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+def get_db() -> sqlite3.Connection:
+    """Opens a connection to the app database with query timing enabled."""
+    return sqlite3.connect(DB_PATH, factory=TimedConnection)
+
+
+@contextmanager
+def init_lock():
+    """Serializes schema creation/migrations between worker processes starting at the same time."""
+    if fcntl is None:
+        yield
+        return
+    with open(f"{DB_PATH}.init.lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
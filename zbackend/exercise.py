@@ -0,0 +1,215 @@
+# exercise.py - MET table, session sample storage and calorie integration
+#
+# Calories used to be 9.8 MET (running) x weight x hours for every activity.
+# Now each exercise_type has its own MET values (by intensity, and by speed for
+# activities where speed matters), the app can stream samples during a session
+# (heart rate, speed, GPS) and on stop we integrate calories over them:
+#   heart rate   -> Keytel et al. (2005) energy expenditure from HR, age, sex, weight
+#   speed / GPS  -> MET interpolated from the activity's speed curve
+#   neither      -> the activity's MET for the chosen intensity
+# Stretches without samples (before the first one, after the last, or gaps
+# longer than MAX_GAP_SECONDS) fall back to the base MET.
+#
+# Samples live in one row per session as a packed float64 matrix
+# (t_offset, hr, speed, lat, lon; NaN = not reported) and are downsampled by
+# time-bucket averaging once a session passes MAX_SAMPLES (float64 so GPS
+# points keep sub-metre precision).
+import os
+import sqlite3
+from datetime import datetime
+from typing import Optional
+
+import numpy as np
+
+# Compendium of Physical Activities values (rounded)
+MET_TABLE = {
+    "running":    {"intensity": {"low": 8.3, "moderate": 9.8, "high": 11.8},
+                   "speed_kmh": [6.4, 8.0, 9.7, 10.8, 12.1, 13.8, 16.1], "speed_met": [6.0, 8.3, 9.8, 10.5, 11.8, 12.3, 14.5]},
+    "walking":    {"intensity": {"low": 2.8, "moderate": 3.5, "high": 5.0},
+                   "speed_kmh": [3.2, 4.0, 4.8, 5.6, 6.4, 7.2], "speed_met": [2.8, 3.0, 3.5, 4.3, 5.0, 7.0]},
+    "cycling":    {"intensity": {"low": 5.8, "moderate": 7.5, "high": 10.0},
+                   "speed_kmh": [10.0, 16.0, 19.0, 22.5, 25.7, 30.6], "speed_met": [4.0, 5.8, 6.8, 8.0, 10.0, 12.0]},
+    "hiking":     {"intensity": {"low": 5.3, "moderate": 6.0, "high": 7.8}},
+    "swimming":   {"intensity": {"low": 5.8, "moderate": 7.0, "high": 9.8}},
+    "rowing":     {"intensity": {"low": 4.8, "moderate": 7.0, "high": 8.5}},
+    "elliptical": {"intensity": {"low": 4.6, "moderate": 5.0, "high": 6.5}},
+    "strength":   {"intensity": {"low": 3.5, "moderate": 5.0, "high": 6.0}},
+    "hiit":       {"intensity": {"low": 6.0, "moderate": 8.0, "high": 10.0}},
+    "yoga":       {"intensity": {"low": 2.3, "moderate": 2.5, "high": 4.0}},
+}
+DEFAULT_ACTIVITY = "running"
+DEFAULT_INTENSITY = "moderate"
+
+MAX_SAMPLES = int(os.getenv("EXERCISE_MAX_SAMPLES", "2000"))
+MAX_GAP_SECONDS = float(os.getenv("EXERCISE_MAX_GAP_S", "60"))
+COLUMNS = ("t", "hr", "speed", "lat", "lon")  # t = seconds since session start, speed in m/s
+
+
+def init_exercise(conn: sqlite3.Connection):
+    """Sample storage + the extra exercise_logs columns."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS exercise_samples (
+            session_id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            sample_count INTEGER NOT NULL,
+            data BLOB NOT NULL,            -- float64 matrix, sample_count x len(COLUMNS)
+            updated_at TEXT,               -- last batch received (the stale-session sweeper reads it)
+            FOREIGN KEY (session_id) REFERENCES exercise_logs (id)
+        )
+    """)
+    if "updated_at" not in {row[1] for row in cursor.execute("PRAGMA table_info(exercise_samples)")}:
+        cursor.execute("ALTER TABLE exercise_samples ADD COLUMN updated_at TEXT")
+    existing = {row[1] for row in cursor.execute("PRAGMA table_info(exercise_logs)")}
+    for column, sql_type in (("intensity", "TEXT"), ("distance_m", "REAL"), ("avg_heart_rate", "REAL"),
+                             ("auto_closed", "INTEGER DEFAULT 0")):
+        if column not in existing:
+            cursor.execute(f"ALTER TABLE exercise_logs ADD COLUMN {column} {sql_type}")
+    # The sweeper and crash recovery both look for open sessions
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_exercise_logs_open ON exercise_logs (end_time) WHERE end_time IS NULL")
+    conn.commit()
+
+
+def met_for(exercise_type: str, intensity: Optional[str] = None) -> float:
+    activity = MET_TABLE.get((exercise_type or "").lower(), MET_TABLE[DEFAULT_ACTIVITY])
+    return activity["intensity"].get(intensity or DEFAULT_INTENSITY, activity["intensity"][DEFAULT_INTENSITY])
+
+
+# =============================================================================
+# Sample storage
+# =============================================================================
+
+def _unpack(blob: bytes, count: int) -> np.ndarray:
+    return np.frombuffer(blob, dtype=np.float64).reshape(count, len(COLUMNS)).copy()
+
+
+def samples_to_array(samples: list, session_start_ts: float) -> np.ndarray:
+    """
+    Request samples -> float64 matrix sorted by time. Each sample has either
+    ts (unix seconds) or t (seconds since start), plus optional hr/speed/lat/lon.
+    """
+    rows = np.full((len(samples), len(COLUMNS)), np.nan, dtype=np.float64)
+    for i, sample in enumerate(samples):
+        rows[i, 0] = sample["t"] if sample.get("t") is not None else sample["ts"] - session_start_ts
+        for j, name in enumerate(COLUMNS[1:], start=1):
+            value = sample.get(name)
+            if value is not None:
+                rows[i, j] = value
+    return rows[np.argsort(rows[:, 0], kind="stable")]
+
+
+def downsample(data: np.ndarray, max_samples: int = MAX_SAMPLES) -> np.ndarray:
+    """Average into equal time buckets so at most max_samples/2 rows remain (NaNs ignored)."""
+    if len(data) <= max_samples:
+        return data
+    buckets = max(1, max_samples // 2)
+    t = data[:, 0]
+    edges = np.linspace(t[0], t[-1], buckets + 1)
+    index = np.clip(np.searchsorted(edges, t, side="right") - 1, 0, buckets - 1)
+    present = ~np.isnan(data)
+    sums = np.zeros((buckets, data.shape[1]))
+    counts = np.zeros((buckets, data.shape[1]))
+    np.add.at(sums, index, np.where(present, data, 0.0))
+    np.add.at(counts, index, present)
+    with np.errstate(invalid="ignore"):
+        averaged = sums / counts  # 0/0 -> NaN for buckets/columns with no data
+    return averaged[counts[:, 0] > 0]
+
+
+def append_samples(conn: sqlite3.Connection, session_id: int, user_id: int, new_rows: np.ndarray) -> int:
+    """Merges a batch into the session's packed samples. Returns the stored sample count."""
+    cursor = conn.cursor()
+    cursor.execute("SELECT sample_count, data FROM exercise_samples WHERE session_id = ?", (session_id,))
+    row = cursor.fetchone()
+    data = new_rows if row is None else np.concatenate([_unpack(row[1], row[0]), new_rows])
+    if row is not None and len(new_rows) and new_rows[0, 0] < data[row[0] - 1, 0]:
+        data = data[np.argsort(data[:, 0], kind="stable")]  # a late batch arrived out of order
+    data = downsample(data)
+    cursor.execute(
+        "INSERT OR REPLACE INTO exercise_samples (session_id, user_id, sample_count, data, updated_at) "
+        "VALUES (?, ?, ?, ?, ?)",
+        (session_id, user_id, len(data), data.tobytes(), datetime.now().isoformat())
+    )
+    conn.commit()
+    return len(data)
+
+
+def load_samples(conn: sqlite3.Connection, session_id: int) -> Optional[np.ndarray]:
+    row = conn.execute("SELECT sample_count, data FROM exercise_samples WHERE session_id = ?", (session_id,)).fetchone()
+    return _unpack(row[1], row[0]) if row else None
+
+
+# =============================================================================
+# Calorie integration
+# =============================================================================
+
+def _gps_speed(t: np.ndarray, lat: np.ndarray, lon: np.ndarray) -> tuple:
+    """Per-interval speed (m/s) and distance (m) from GPS points (haversine)."""
+    lat_r, lon_r = np.radians(lat), np.radians(lon)
+    dlat, dlon = np.diff(lat_r), np.diff(lon_r)
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat_r[:-1]) * np.cos(lat_r[1:]) * np.sin(dlon / 2) ** 2
+    meters = 2 * 6371000.0 * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+    dt = np.diff(t)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        speed = np.where(dt > 0, meters / dt, np.nan)
+    return speed, meters
+
+
+def _keytel_kcal_per_min(hr: np.ndarray, user: dict) -> np.ndarray:
+    weight, age = float(user["weight_kg"]), float(user["age"])
+    if (user.get("sex") or "").lower() == "male":
+        return (-55.0969 + 0.6309 * hr + 0.1988 * weight + 0.2017 * age) / 4.184
+    return (-20.4022 + 0.4472 * hr - 0.1263 * weight + 0.074 * age) / 4.184
+
+
+def compute_session(user: dict, exercise_type: str, intensity: Optional[str], duration_seconds: float,
+                    samples: Optional[np.ndarray]) -> dict:
+    """Calories (plus distance / average HR when samples allow) for a finished session."""
+    weight = float(user["weight_kg"])
+    base_met = met_for(exercise_type, intensity)
+    base_kcal_per_s = base_met * weight / 3600.0
+    result = {"calories_burned": int(base_kcal_per_s * max(duration_seconds, 0)), "distance_m": None,
+              "avg_heart_rate": None, "met": base_met, "method": "met"}
+    if samples is None or len(samples) < 2:
+        return result
+
+    data = samples[(samples[:, 0] >= 0) & (samples[:, 0] <= duration_seconds)]
+    if len(data) < 2:
+        return result
+    t, hr, speed, lat, lon = (data[:, i] for i in range(len(COLUMNS)))
+    dt = np.diff(t)
+
+    # Interval speed: reported speed (mean of both ends), else derived from GPS
+    interval_speed = (speed[:-1] + speed[1:]) / 2
+    has_gps = ~np.isnan(lat) & ~np.isnan(lon)
+    distance = None
+    if has_gps.sum() >= 2:
+        gps_speed, meters = _gps_speed(t, lat, lon)
+        both = has_gps[:-1] & has_gps[1:]
+        interval_speed = np.where(np.isnan(interval_speed) & both, gps_speed, interval_speed)
+        distance = float(np.sum(np.where(both, meters, 0.0)))
+    elif not np.all(np.isnan(interval_speed)):
+        distance = float(np.nansum(interval_speed * dt))
+
+    # Per-interval energy rate (kcal/s), best source first
+    rate = np.full(len(dt), base_kcal_per_s)
+    activity = MET_TABLE.get((exercise_type or "").lower(), {})
+    if "speed_kmh" in activity:
+        speed_met = np.interp(interval_speed * 3.6, activity["speed_kmh"], activity["speed_met"])
+        moving = ~np.isnan(interval_speed) & (interval_speed > 0.3)
+        rate = np.where(moving, speed_met * weight / 3600.0, rate)
+    interval_hr = (hr[:-1] + hr[1:]) / 2
+    hr_rate = np.maximum(_keytel_kcal_per_min(interval_hr, user) / 60.0, weight / 3600.0)  # never below 1 MET
+    rate = np.where(~np.isnan(interval_hr) & (interval_hr >= 60), hr_rate, rate)
+    rate = np.where(dt > MAX_GAP_SECONDS, base_kcal_per_s, rate)  # long gaps: don't trust the endpoints
+
+    covered = float(np.sum(dt))
+    calories = float(np.sum(rate * dt)) + base_kcal_per_s * max(duration_seconds - covered, 0.0)
+    valid_hr = hr[~np.isnan(hr)]
+    result.update({
+        "calories_burned": int(round(calories)),
+        "distance_m": round(distance, 1) if distance is not None else None,
+        "avg_heart_rate": round(float(valid_hr.mean()), 1) if len(valid_hr) else None,
+        "method": "heart_rate" if len(valid_hr) else ("speed" if "speed_kmh" in activity and distance else "met"),
+    })
+    return result
@@ -0,0 +1,179 @@
+# exercise_sessions.py - In-memory registry of running exercise sessions + stale-session sweeper
+#
+# exercise_logs rows with end_time NULL are still the source of truth (and what
+# we reload after a restart), but start/stop/"is something running?" are served
+# from this registry without touching SQLite. Stopping a session this process
+# doesn't know about (started before the registry existed) falls back to the
+# DB. With several workers (WEB_CONCURRENCY > 1) another process may have
+# started or stopped a session, so lookups go to the DB instead (the registry
+# still feeds the gauge and the sweeper's bookkeeping).
+#
+# Sessions that never get a stop call used to stay open forever and never
+# showed up in summaries. The sweeper closes sessions with no activity (start
+# or last sample batch) for EXERCISE_STALE_AFTER_S, ending them at their last
+# activity rather than "now", and marks them auto_closed.
+import asyncio
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+from typing import Optional
+
+from db import WORKERS
+from exercise import compute_session, load_samples
+from logging_setup import get_logger
+from metrics import counter, gauge
+
+STALE_AFTER_SECONDS = float(os.getenv("EXERCISE_STALE_AFTER_S", str(4 * 3600)))
+SWEEP_INTERVAL_SECONDS = float(os.getenv("EXERCISE_SWEEP_INTERVAL_S", "300"))
+
+active_sessions_gauge = gauge("exercise_sessions_active", "Exercise sessions running (this process)")
+sessions_auto_closed = counter("exercise_sessions_auto_closed_total", "Stale exercise sessions closed by the sweeper")
+
+logger = get_logger("exercise_sessions")
+
+
+class ActiveSession:
+    __slots__ = ("session_id", "user_id", "exercise_type", "intensity", "started_at", "last_activity", "has_samples")
+
+    def __init__(self, session_id: int, user_id: int, exercise_type: str, intensity: Optional[str],
+                 started_at: datetime, last_activity: Optional[datetime] = None, has_samples: bool = False):
+        self.session_id = session_id
+        self.user_id = user_id
+        self.exercise_type = exercise_type
+        self.intensity = intensity
+        self.started_at = started_at
+        self.last_activity = last_activity or started_at
+        self.has_samples = has_samples
+
+    def as_dict(self) -> dict:
+        return {"session_id": self.session_id, "exercise_type": self.exercise_type, "intensity": self.intensity,
+                "start_time": self.started_at.isoformat(),
+                "elapsed_seconds": int((datetime.now() - self.started_at).total_seconds())}
+
+
+class SessionRegistry:
+    def __init__(self, shared: bool = WORKERS > 1):
+        self.shared = shared
+        self._by_id = {}
+        self._by_user = {}  # user_id -> session_id of their latest running session
+        self._lock = threading.Lock()
+
+    def add(self, session: ActiveSession):
+        with self._lock:
+            self._by_id[session.session_id] = session
+            self._by_user[session.user_id] = session.session_id
+            active_sessions_gauge.set(len(self._by_id))
+
+    def get(self, session_id: int, user_id: int) -> Optional[ActiveSession]:
+        """The running session if this process can vouch for it (None -> ask the DB)."""
+        if self.shared:
+            return None
+        session = self._by_id.get(session_id)
+        return session if session is not None and session.user_id == user_id else None
+
+    def for_user(self, user_id: int, conn: sqlite3.Connection) -> Optional[ActiveSession]:
+        if not self.shared:
+            session_id = self._by_user.get(user_id)
+            return self._by_id.get(session_id) if session_id is not None else None
+        row = conn.execute("""
+            SELECT id, exercise_type, intensity, start_time FROM exercise_logs
+            WHERE user_id = ? AND end_time IS NULL ORDER BY start_time DESC LIMIT 1
+        """, (user_id,)).fetchone()
+        if row is None:
+            return None
+        return ActiveSession(row[0], user_id, row[1], row[2], datetime.fromisoformat(row[3]))
+
+    def touch(self, session_id: int, has_samples: bool = False):
+        session = self._by_id.get(session_id)
+        if session is not None:
+            session.last_activity = datetime.now()
+            session.has_samples = session.has_samples or has_samples
+
+    def remove(self, session_id: int) -> Optional[ActiveSession]:
+        with self._lock:
+            session = self._by_id.pop(session_id, None)
+            if session is not None and self._by_user.get(session.user_id) == session_id:
+                del self._by_user[session.user_id]
+                # another session of theirs still running? point at the newest one
+                others = [s for s in self._by_id.values() if s.user_id == session.user_id]
+                if others:
+                    self._by_user[session.user_id] = max(others, key=lambda s: s.started_at).session_id
+            active_sessions_gauge.set(len(self._by_id))
+            return session
+
+    def load(self, conn: sqlite3.Connection) -> int:
+        """Crash recovery: rebuild the registry from open exercise_logs rows."""
+        rows = conn.execute("""
+            SELECT e.id, e.user_id, e.exercise_type, e.intensity, e.start_time, s.updated_at
+            FROM exercise_logs e LEFT JOIN exercise_samples s ON s.session_id = e.id
+            WHERE e.end_time IS NULL
+            ORDER BY e.start_time
+        """).fetchall()
+        for session_id, user_id, exercise_type, intensity, start_time, samples_at in rows:
+            started = datetime.fromisoformat(start_time)
+            self.add(ActiveSession(session_id, user_id, exercise_type, intensity, started,
+                                   datetime.fromisoformat(samples_at) if samples_at else started,
+                                   has_samples=samples_at is not None))
+        return len(rows)
+
+
+active_sessions = SessionRegistry()
+
+
+def sweep_stale_sessions(conn: sqlite3.Connection, stale_after: float = STALE_AFTER_SECONDS) -> int:
+    """Closes every open session idle for longer than stale_after, in one transaction."""
+    cutoff = (datetime.now() - timedelta(seconds=stale_after)).isoformat()
+    # Last activity comes from the DB so sessions fed through other workers aren't cut short
+    rows = conn.execute("""
+        SELECT e.id, e.exercise_type, e.intensity, e.start_time, s.updated_at,
+               u.age, u.sex, u.weight_kg
+        FROM exercise_logs e
+        JOIN users u ON u.id = e.user_id
+        LEFT JOIN exercise_samples s ON s.session_id = e.id
+        WHERE e.end_time IS NULL AND COALESCE(s.updated_at, e.start_time) < ?
+    """, (cutoff,)).fetchall()
+    if not rows:
+        return 0
+
+    updates = []
+    for session_id, exercise_type, intensity, start_time, samples_at, age, sex, weight_kg in rows:
+        started = datetime.fromisoformat(start_time)
+        ended = datetime.fromisoformat(samples_at) if samples_at else started
+        duration = int((ended - started).total_seconds())
+        burn = compute_session({"age": age, "sex": sex, "weight_kg": weight_kg}, exercise_type, intensity, duration,
+                               load_samples(conn, session_id) if samples_at else None)
+        updates.append((ended.isoformat(), duration, burn["calories_burned"], burn["distance_m"],
+                        burn["avg_heart_rate"], session_id))
+
+    conn.executemany("""
+        UPDATE exercise_logs
+        SET end_time = ?, duration_seconds = ?, calories_burned = ?, distance_m = ?, avg_heart_rate = ?, auto_closed = 1
+        WHERE id = ? AND end_time IS NULL
+    """, updates)
+    conn.commit()
+    for update in updates:
+        active_sessions.remove(update[-1])
+    sessions_auto_closed.inc(len(updates))
+    return len(updates)
+
+
+def _sweep_once(open_db) -> int:
+    # Runs on a worker thread: sqlite3 connections can't cross threads, so it opens its own
+    conn = open_db()
+    try:
+        return sweep_stale_sessions(conn)
+    finally:
+        conn.close()
+
+
+async def run_sweeper(open_db, interval: float = SWEEP_INTERVAL_SECONDS):
+    """Background loop: sweep, sleep, repeat (start it with asyncio.create_task)."""
+    while True:
+        try:
+            closed = await asyncio.to_thread(_sweep_once, open_db)
+            if closed:
+                logger.info("stale exercise sessions closed", extra={"fields": {"sessions": closed}})
+        except Exception:
+            logger.exception("stale session sweep failed")  # never let the sweeper die; the next round retries
+        await asyncio.sleep(interval)
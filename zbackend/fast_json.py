@@ -0,0 +1,151 @@
+# fast_json.py - Faster JSON responses + negotiated compression
+#
+# Meal plans are the big responses (tens of KB each, and /get_all_meal_plans
+# returns every plan a user has). Before, each request json.loads-ed the
+# stored plan_data, ran the result through jsonable_encoder and serialized it
+# again with the json module. Now:
+#   - FastJSONResponse renders with orjson when it's installed (app default)
+#   - plan endpoints splice the stored plan_data text straight into the body
+#     (raw_json / json_object / json_array), so the plan is never parsed at all
+#   - CompressionMiddleware compresses bodies >= COMPRESS_MIN_BYTES with
+#     brotli (when the client accepts br) or gzip; without the brotli package
+#     (it's in requirements.txt) only gzip is offered
+#
+#   COMPRESS_MIN_BYTES   [1024]  smaller bodies go out as-is
+#   COMPRESS_GZIP_LEVEL  [6]
+#   COMPRESS_BR_QUALITY  [5]     brotli 4-6 is about gzip's speed at a better ratio
+#
+# Streaming responses (SSE) are never compressed so events aren't held back.
+import gzip
+import json
+import os
+from typing import Iterable
+
+from fastapi.responses import JSONResponse, Response
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESS_MIN_BYTES = int(os.getenv("COMPRESS_MIN_BYTES", "1024"))
+GZIP_LEVEL = int(os.getenv("COMPRESS_GZIP_LEVEL", "6"))
+BR_QUALITY = int(os.getenv("COMPRESS_BR_QUALITY", "5"))
+
+
+def dumps(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(content, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def raw_json(body, status_code: int = 200) -> Response:
+    """Response for JSON that is already serialized (str or bytes)."""
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    return Response(content=body, status_code=status_code, media_type="application/json")
+
+
+def json_object(fields: dict, raw_fields: dict) -> bytes:
+    """{...fields, ...raw_fields} where raw_fields values are already-serialized JSON text."""
+    members = [dumps(fields)[1:-1]] if fields else []
+    for key, value in raw_fields.items():
+        if value is None:
+            value = b"null"
+        members.append(dumps(key) + b":" + (value.encode("utf-8") if isinstance(value, str) else value))
+    return b"{" + b",".join(members) + b"}"
+
+
+def json_array(items: Iterable[bytes]) -> bytes:
+    return b"[" + b",".join(items) + b"]"
+
+
+# =============================================================================
+# Compression
+# =============================================================================
+
+def _pick_encoding(accept_encoding: str):
+    offered = {}
+    for token in accept_encoding.lower().split(","):
+        name, _, params = token.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip()] = q
+    if brotli is not None and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BR_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+def _with_vary(headers: list) -> list:
+    vary = [v for k, v in headers if k.lower() == b"vary"]
+    headers = [(k, v) for k, v in headers if k.lower() != b"vary"]
+    return headers + [(b"vary", b", ".join(vary + [b"Accept-Encoding"]))]
+
+
+class CompressionMiddleware:
+    """Pure ASGI: compresses complete (non-streamed) response bodies the client can decode."""
+
+    def __init__(self, app, min_size: int = COMPRESS_MIN_BYTES):
+        self.app = app
+        self.min_size = min_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        encoding = _pick_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        start = None
+
+        async def wrapped_send(message):
+            nonlocal start
+            if message["type"] == "http.response.start":
+                start = message  # hold it until we know whether the body gets compressed
+                return
+            if message["type"] != "http.response.body" or start is None:
+                await send(message)
+                return
+            response_start, start = start, None
+            body = message.get("body", b"")
+            response_headers = [(k, v) for k, v in response_start.get("headers", [])]
+            names = {k.lower() for k, _ in response_headers}
+            if (message.get("more_body") or len(body) < self.min_size or b"content-encoding" in names
+                    or any(k.lower() == b"content-type" and v.startswith(b"text/event-stream")
+                           for k, v in response_headers)):
+                await send(response_start)
+                await send(message)
+                return
+            if encoding is None:
+                # Would have been compressed for another client: caches must key on Accept-Encoding
+                await send(dict(response_start, headers=_with_vary(response_headers)))
+                await send(message)
+                return
+            body = compress(body, encoding)
+            response_headers = [(k, v) for k, v in response_headers if k.lower() != b"content-length"]
+            response_headers += [(b"content-encoding", encoding.encode()), (b"content-length", str(len(body)).encode())]
+            await send(dict(response_start, headers=_with_vary(response_headers)))
+            await send(dict(message, body=body))
+
+        await self.app(scope, receive, wrapped_send)
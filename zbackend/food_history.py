@@ -0,0 +1,163 @@
+# food_history.py - Per-user food history search + "log my usual"
+#
+# user_logs_fts is an external-content FTS5 index over user_logs
+# (description + type), kept in sync by triggers, so searching a user's
+# history and re-logging a past item never touches the model.
+import re
+import sqlite3
+from datetime import datetime, timedelta
+
+# Hour windows (local server time) used to decide what "breakfast" etc. means
+MEAL_WINDOWS = {
+    "breakfast": (4, 11),
+    "lunch": (11, 16),
+    "dinner": (16, 22),
+    "snack": None,  # anything, we just pick the most frequent item
+}
+
+# Recency half-life-ish constant: an item logged 14 days ago counts half as much
+RECENCY_DAYS = 14.0
+USUAL_LOOKBACK_DAYS = 90
+
+
+def init_food_history(conn: sqlite3.Connection):
+    """Creates the FTS index, sync triggers and supporting indexes."""
+    cursor = conn.cursor()
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_logs_user_time ON user_logs (user_id, timestamp)")
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS user_logs_fts USING fts5(
+            description, type,
+            content='user_logs', content_rowid='id',
+            tokenize='porter unicode61'
+        )
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS user_logs_fts_insert AFTER INSERT ON user_logs BEGIN
+            INSERT INTO user_logs_fts(rowid, description, type) VALUES (new.id, new.description, new.type);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS user_logs_fts_delete AFTER DELETE ON user_logs BEGIN
+            INSERT INTO user_logs_fts(user_logs_fts, rowid, description, type)
+            VALUES ('delete', old.id, old.description, old.type);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS user_logs_fts_update AFTER UPDATE OF description, type ON user_logs BEGIN
+            INSERT INTO user_logs_fts(user_logs_fts, rowid, description, type)
+            VALUES ('delete', old.id, old.description, old.type);
+            INSERT INTO user_logs_fts(rowid, description, type) VALUES (new.id, new.description, new.type);
+        END
+    """)
+    # Existing databases: index rows logged before the FTS table existed
+    indexed = cursor.execute("SELECT COUNT(*) FROM user_logs_fts_docsize").fetchone()[0]
+    total = cursor.execute("SELECT COUNT(*) FROM user_logs").fetchone()[0]
+    if indexed != total:
+        cursor.execute("INSERT INTO user_logs_fts(user_logs_fts) VALUES ('rebuild')")
+    conn.commit()
+
+
+def _fts_query(text: str) -> str:
+    words = re.findall(r"[a-z0-9]+", (text or "").lower())
+    # Prefix match on every word so "chick" finds "chicken"
+    return " ".join(f'"{w}"*' for w in words)
+
+
+def _rank(rows: list, now: datetime) -> list:
+    """Frequency x recency score, highest first."""
+    ranked = []
+    for row in rows:
+        try:
+            days_ago = max((now - datetime.fromisoformat(row["last_logged"])).total_seconds() / 86400, 0)
+        except (TypeError, ValueError):
+            days_ago = USUAL_LOOKBACK_DAYS
+        score = row["times_logged"] / (1.0 + days_ago / RECENCY_DAYS)
+        ranked.append((score, row))
+    ranked.sort(key=lambda pair: pair[0], reverse=True)
+    return [dict(row, score=round(score, 3)) for score, row in ranked]
+
+
+_GROUPED_COLUMNS = """
+    MAX(l.id) AS log_id, l.type, l.description, l.calories, l.protein, l.carbs, l.fats,
+    COUNT(*) AS times_logged, MAX(l.timestamp) AS last_logged
+"""
+
+
+def _as_dicts(cursor) -> list:
+    columns = [c[0] for c in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+
+def search_history(conn: sqlite3.Connection, user_id: int, query: str = "", limit: int = 10) -> list:
+    """
+    Distinct foods from a user's history matching `query`, ranked by how often
+    and how recently they were logged. An empty query returns the top items.
+    (SQLite returns the bare columns from the MAX(id) row, i.e. the latest log.)
+    """
+    match = _fts_query(query)
+    if match:
+        cursor = conn.execute(f"""
+            SELECT {_GROUPED_COLUMNS}
+            FROM user_logs_fts
+            JOIN user_logs l ON l.id = user_logs_fts.rowid
+            WHERE user_logs_fts MATCH ? AND l.user_id = ?
+            GROUP BY LOWER(l.description)
+        """, (match, user_id))
+    else:
+        cursor = conn.execute(f"""
+            SELECT {_GROUPED_COLUMNS}
+            FROM user_logs l
+            WHERE l.user_id = ?
+            GROUP BY LOWER(l.description)
+        """, (user_id,))
+    return _rank(_as_dicts(cursor), datetime.now())[:limit]
+
+
+def find_usual(conn: sqlite3.Connection, user_id: int, meal: str):
+    """The user's most frequent (recency weighted) item for a meal, or None."""
+    since = (datetime.now() - timedelta(days=USUAL_LOOKBACK_DAYS)).isoformat()
+    window = MEAL_WINDOWS.get(meal)
+    sql = f"""
+        SELECT {_GROUPED_COLUMNS}
+        FROM user_logs l
+        WHERE l.user_id = ? AND l.timestamp >= ?
+    """
+    params = [user_id, since]
+    if window:
+        sql += " AND CAST(strftime('%H', l.timestamp) AS INTEGER) >= ? AND CAST(strftime('%H', l.timestamp) AS INTEGER) < ?"
+        params += list(window)
+    sql += " GROUP BY LOWER(l.description)"
+    ranked = _rank(_as_dicts(conn.execute(sql, params)), datetime.now())
+    return ranked[0] if ranked else None
+
+
+def relog(conn: sqlite3.Connection, user_id: int, log_id: int):
+    """Copies a past log (calories + already estimated macros) as a new entry. Returns the new row."""
+    cursor = conn.execute("""
+        INSERT INTO user_logs (user_id, timestamp, type, description, calories, protein, carbs, fats)
+        SELECT user_id, ?, type, description, calories, protein, carbs, fats
+        FROM user_logs WHERE id = ? AND user_id = ?
+    """, (datetime.now().isoformat(), log_id, user_id))
+    if cursor.rowcount == 0:
+        return None
+    new_id = cursor.lastrowid
+    conn.commit()
+    row = conn.execute(
+        "SELECT id, type, description, calories, protein, carbs, fats, timestamp FROM user_logs WHERE id = ?",
+        (new_id,)
+    ).fetchone()
+    keys = ("log_id", "type", "description", "calories", "protein", "carbs", "fats", "timestamp")
+    return dict(zip(keys, row))
+
+
+def meal_from_text(text: str, now: datetime = None) -> str:
+    """Pulls the meal out of "log my usual breakfast", defaulting to the current time of day."""
+    text = (text or "").lower()
+    for meal in MEAL_WINDOWS:
+        if meal in text:
+            return meal
+    hour = (now or datetime.now()).hour
+    for meal, window in MEAL_WINDOWS.items():
+        if window and window[0] <= hour < window[1]:
+            return meal
+    return "snack"
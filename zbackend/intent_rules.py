@@ -0,0 +1,27 @@
+# intent_rules.py - Keyword intent classifier used when the LLM classifier is unavailable
+#
+# Mirrors the action list and key rules of the voice_command system prompt.
+# Rules are checked in order; the first match wins.
+import re
+
+RULES = [
+    ("log_usual", r"\b(my usual|the usual|same as (always|usual))\b"),
+    ("stop_exercise", r"\b(stop|end|finish|done)\b.*\b(run|running|workout|exercis\w*|walk|ride|swim|time)\b"
+                      r"|\bi'?m done exercising\b"),
+    ("start_exercise", r"\b(start|begin|going for|track)\b.*\b(run|running|workout|exercis\w*|walk|ride|swim)\b"
+                       r"|\bexercise time\b"),
+    ("log_previous", r"\b(log|save|add)\s+(it|that)\b|\bconfirm\b|\badd it to my log\b"),
+    ("log_food", r"\b(log|save|track|add)\s+(this|what i'?m eating)\b|\blog this\b"),
+    ("analyze_food", r"\b(is this healthy|analy[sz]e|tell me about this|fit(s)? (within|in) my)\b"),
+    ("get_summary", r"\b(how am i doing|summary|my calories|progress)\b"),
+]
+_COMPILED = [(action, re.compile(pattern)) for action, pattern in RULES]
+
+
+def classify_intent_locally(text: str) -> dict:
+    """Same response shape as the LLM classifier: {"action": ..., "confidence": ...}."""
+    normalized = (text or "").lower().strip()
+    for action, pattern in _COMPILED:
+        if pattern.search(normalized):
+            return {"action": action, "confidence": "medium"}
+    return {"action": "unknown", "confidence": "low"}
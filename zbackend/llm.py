@@ -0,0 +1,125 @@
+# llm.py - Instrumented wrappers around the OpenAI client
+#
+# All model calls go through here so latency, token usage and errors are
+# recorded per model (see metrics.py), and so a model that keeps failing or
+# timing out is cut off by its circuit breaker (see circuit_breaker.py).
+# Latency/outcome also feeds model_router.py, which picks models per call,
+# and the request's profile when it's being profiled (profiling.py).
+import asyncio
+import time
+
+from circuit_breaker import CircuitOpenError, get_breaker
+from metrics import llm_call_seconds, llm_errors, llm_first_token_seconds, llm_tokens
+from model_router import model_stats
+from profiling import record_llm
+
+
+def _record_usage(model: str, response):
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    llm_tokens.inc(getattr(usage, "prompt_tokens", 0) or 0, model=model, direction="input")
+    llm_tokens.inc(getattr(usage, "completion_tokens", 0) or 0, model=model, direction="output")
+
+
+def _guarded_call(create, call: str, kwargs: dict):
+    model = kwargs.get("model", "unknown")
+    breaker = get_breaker(model, call)
+    if not breaker.allow():
+        raise CircuitOpenError(breaker.name, breaker.retry_after())
+
+    started = time.perf_counter()
+    ok = False
+    try:
+        response = create(**kwargs)
+        ok = True
+        return response
+    except Exception:
+        llm_errors.inc(model=model, call=call)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        breaker.record(ok, elapsed)
+        model_stats.record(model, call, elapsed, ok)
+        llm_call_seconds.observe(elapsed, model=model, call=call)
+        record_llm(call, model, started, elapsed, ok)
+
+
+def chat_completion(client, call: str, **kwargs):
+    """client.chat.completions.create(**kwargs), timed and labelled with `call`."""
+    response = _guarded_call(client.chat.completions.create, call, kwargs)
+    _record_usage(kwargs.get("model", "unknown"), response)
+    return response
+
+
+async def achat_completion(client, call: str, **kwargs):
+    """chat_completion() on a worker thread so the event loop stays free."""
+    return await asyncio.to_thread(chat_completion, client, call, **kwargs)
+
+
+def stream_chat_completion(client, call: str, **kwargs):
+    """
+    Streamed client.chat.completions.create(): yields text deltas as they arrive.
+    Breaker, latency and usage are recorded when the stream ends; a consumer
+    that stops early (client went away) doesn't count as a model failure.
+    """
+    model = kwargs.get("model", "unknown")
+    breaker = get_breaker(model, call)
+    if not breaker.allow():
+        raise CircuitOpenError(breaker.name, breaker.retry_after())
+
+    started = time.perf_counter()
+    first_token = True
+    ok = False
+    try:
+        stream = client.chat.completions.create(stream=True, stream_options={"include_usage": True}, **kwargs)
+        for chunk in stream:
+            if getattr(chunk, "usage", None) is not None:
+                _record_usage(model, chunk)
+            for choice in chunk.choices or ():
+                text = getattr(choice.delta, "content", None)
+                if text:
+                    if first_token:
+                        llm_first_token_seconds.observe(time.perf_counter() - started, model=model, call=call)
+                        first_token = False
+                    yield text
+        ok = True
+    except GeneratorExit:
+        ok = True
+        raise
+    except Exception:
+        llm_errors.inc(model=model, call=call)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        breaker.record(ok, elapsed)
+        model_stats.record(model, call, elapsed, ok)
+        llm_call_seconds.observe(elapsed, model=model, call=call)
+        record_llm(call, model, started, elapsed, ok, streamed=True)
+
+
+async def astream_chat_completion(client, call: str, **kwargs):
+    """stream_chat_completion() as an async generator; each blocking read runs on a worker thread."""
+    stream = stream_chat_completion(client, call, **kwargs)
+    done = object()
+    try:
+        while True:
+            text = await asyncio.to_thread(next, stream, done)
+            if text is done:
+                return
+            yield text
+    finally:
+        try:
+            stream.close()
+        except ValueError:
+            pass  # cancelled mid-read: the worker thread still owns it, GC closes it later
+
+
+def transcribe(client, call: str, **kwargs):
+    """client.audio.transcriptions.create(**kwargs), timed and labelled with `call`."""
+    return _guarded_call(client.audio.transcriptions.create, call, kwargs)
+
+
+def is_open(model: str, call: str) -> bool:
+    """True while the breaker for this model/call is refusing requests."""
+    return get_breaker(model, call).is_open()
@@ -0,0 +1,153 @@
+# log_writer.py - Group-commit writer for food / exercise log inserts
+#
+# Opening a connection and committing one row per request caps write
+# throughput at SQLite's commit (fsync) rate. Instead, requests hand their
+# INSERT to a single writer thread, which waits up to LOG_WRITER_MAX_WAIT_MS
+# for more inserts to arrive, runs up to LOG_WRITER_MAX_BATCH of them in one
+# transaction and then hands each caller its row id. One fsync now covers the
+# whole batch.
+#
+# A caller only gets its row id after the batch has committed, so an
+# acknowledged row is never lost on an app crash. How much survives a power
+# cut depends on LOG_WRITER_DURABILITY:
+#   full    [default] synchronous=FULL   - committed rows are on disk
+#   normal  synchronous=NORMAL (WAL)      - may lose the last few commits on power loss
+#   off     synchronous=OFF               - leaves syncing to the OS entirely
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from db import get_db
+from metrics import counter, gauge, histogram
+
+MAX_WAIT_SECONDS = float(os.getenv("LOG_WRITER_MAX_WAIT_MS", "5")) / 1000.0
+MAX_BATCH = int(os.getenv("LOG_WRITER_MAX_BATCH", "256"))
+DURABILITY = os.getenv("LOG_WRITER_DURABILITY", "full").lower()
+_SYNCHRONOUS = {"full": "FULL", "normal": "NORMAL", "off": "OFF"}
+
+log_writer_batch_size = histogram(
+    "log_writer_batch_size", "Inserts committed per group-commit transaction",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512))
+log_writer_commit_seconds = histogram("log_writer_commit_seconds", "Time to run and commit one batch")
+log_writer_pending = gauge("log_writer_pending", "Inserts waiting for the writer thread")
+log_writer_failures = counter("log_writer_failures_total", "Inserts that failed inside the writer")
+
+
+class LogWriter:
+    def __init__(self, max_wait: float = MAX_WAIT_SECONDS, max_batch: int = MAX_BATCH,
+                 durability: str = DURABILITY):
+        if durability not in _SYNCHRONOUS:
+            raise ValueError(f"LOG_WRITER_DURABILITY must be one of {sorted(_SYNCHRONOUS)}")
+        self.max_wait = max_wait
+        self.max_batch = max_batch
+        self.durability = durability
+        self._queue = queue.Queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    # -- callers -------------------------------------------------------------
+
+    def submit(self, sql: str, params: tuple) -> Future:
+        """Queue one INSERT; the future resolves to its row id once the batch commits."""
+        self._ensure_started()
+        future = Future()
+        self._queue.put((sql, params, future))
+        log_writer_pending.inc()
+        return future
+
+    def insert(self, sql: str, params: tuple) -> int:
+        """Blocking submit() for code running on a worker thread."""
+        return self.submit(sql, params).result()
+
+    async def ainsert(self, sql: str, params: tuple) -> int:
+        """submit() for async endpoints - waits without holding the event loop."""
+        return await asyncio.wrap_future(self.submit(sql, params))
+
+    def close(self, timeout: float = 5.0):
+        """Flush what's queued and stop the thread."""
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+
+    # -- writer thread -------------------------------------------------------
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="log-writer", daemon=True)
+                self._thread.start()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = get_db()
+        conn.isolation_level = None  # we issue BEGIN/COMMIT ourselves
+        conn.execute("PRAGMA busy_timeout = 5000")
+        if self.durability != "full":
+            conn.execute("PRAGMA journal_mode = WAL")
+        conn.execute(f"PRAGMA synchronous = {_SYNCHRONOUS[self.durability]}")
+        return conn
+
+    def _run(self):
+        conn = self._connect()
+        stopping = False
+        while not stopping:
+            item = self._queue.get()
+            if item is None:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+            log_writer_pending.dec(len(batch))
+            self._flush(conn, batch)
+        conn.close()
+
+    def _flush(self, conn: sqlite3.Connection, batch: list):
+        started = time.perf_counter()
+        try:
+            row_ids = self._write(conn, batch)
+        except Exception:
+            # One bad row shouldn't fail everyone else's insert: retry them one by one
+            for item in batch:
+                try:
+                    item[2].set_result(self._write(conn, [item])[0])
+                except Exception as e:
+                    log_writer_failures.inc()
+                    item[2].set_exception(e)
+            return
+        log_writer_batch_size.observe(len(batch))
+        log_writer_commit_seconds.observe(time.perf_counter() - started)
+        for (_, _, future), row_id in zip(batch, row_ids):
+            future.set_result(row_id)
+
+    @staticmethod
+    def _write(conn: sqlite3.Connection, batch: list) -> list:
+        cursor = conn.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            row_ids = []
+            for sql, params, _ in batch:
+                cursor.execute(sql, params)
+                row_ids.append(cursor.lastrowid)
+            cursor.execute("COMMIT")
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        return row_ids
+
+
+log_writer = LogWriter()
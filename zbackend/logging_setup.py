@@ -0,0 +1,106 @@
+# logging_setup.py - Structured, non-blocking logging
+#
+# Request handlers only put records on an in-memory queue (QueueHandler); a
+# background QueueListener thread formats them as JSON lines and writes them
+# to stdout. Each record carries the request id of the request that emitted
+# it, and high-volume DEBUG lines are sampled.
+#
+# Env:
+#   LOG_LEVEL                 DEBUG | INFO | WARNING | ERROR   (default INFO)
+#   LOG_DEBUG_SAMPLE_RATE     fraction of DEBUG records kept    (default 0.1)
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import sys
+import uuid
+from datetime import datetime, timezone
+
+request_id_var = contextvars.ContextVar("request_id", default="-")
+
+_listener = None
+
+
+def new_request_id() -> str:
+    return uuid.uuid4().hex[:16]
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps every record with the current request id."""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Keeps only a fraction of DEBUG records. A call site can pick its own rate
+    with extra={"sample_rate": 0.01}; WARNING and above are never sampled.
+    """
+
+    def __init__(self, debug_rate: float):
+        super().__init__()
+        self.debug_rate = debug_rate
+
+    def filter(self, record):
+        rate = getattr(record, "sample_rate", None)
+        if rate is None:
+            rate = self.debug_rate if record.levelno <= logging.DEBUG else 1.0
+        if record.levelno >= logging.WARNING or rate >= 1.0:
+            return True
+        return random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "request_id": getattr(record, "request_id", "-"),
+        }
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging():
+    """Routes the app's loggers through a queue to a JSON stdout handler. Idempotent."""
+    global _listener
+    if _listener is not None:
+        return
+
+    level = getattr(logging, os.getenv("LOG_LEVEL", "INFO").upper(), logging.INFO)
+    debug_rate = float(os.getenv("LOG_DEBUG_SAMPLE_RATE", "0.1"))
+
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(JsonFormatter())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Filters run on the calling thread, before the record is queued, so the
+    # request id is captured from the right context and dropped DEBUG lines cost ~nothing
+    queue_handler.addFilter(RequestIdFilter())
+    queue_handler.addFilter(SamplingFilter(debug_rate))
+
+    app_logger = logging.getLogger("athyra")
+    app_logger.setLevel(level)
+    app_logger.addHandler(queue_handler)
+    app_logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+
+def get_logger(name: str) -> logging.Logger:
+    return logging.getLogger(f"athyra.{name}")
@@ -0,0 +1,226 @@
+# meal_plan_index.py - Reuse an existing meal plan for a similar profile
+#
+# Plenty of users ask for a plan with the same goal, a similar calorie target
+# and a similar budget. Every generated plan gets a small feature vector
+#   [goal one-hot * GOAL_WEIGHT, target_calories / CALORIE_SCALE, ln(budget) / ln(1 + BUDGET_SCALE)]
+# and /create_meal_plan first looks for the nearest stored plan (brute-force
+# numpy, a few thousand plans is microseconds). Similarity is
+# exp(-distance^2 / 2): 1.0 for an identical profile, ~0.6 for one unit off
+# (CALORIE_SCALE kcal, or a BUDGET_SCALE relative budget difference). Different
+# goals are never close enough to match.
+#
+# A candidate must also be allergy-safe for the requester, which only counts
+# when it was generated for a superset of their allergies: matching recipe
+# names against allergens misses too much (Pad Thai and peanuts). A hit is
+# adapted (calories and grocery quantities scaled to the requester's target,
+# budget optimizer re-run with their budget) instead of running the four-agent
+# pipeline. The donor's health_analysis is dropped: its approval and warnings
+# were made for someone else.
+#
+#   MEAL_PLAN_REUSE_THRESHOLD      [0.6]   minimum similarity; set above 1 to turn reuse off
+#   MEAL_PLAN_REUSE_CALORIE_SCALE  [150]   kcal difference worth one unit of distance
+#   MEAL_PLAN_REUSE_BUDGET_SCALE   [0.25]  relative budget difference worth one unit
+#   MEAL_PLAN_REUSE_MAX_AGE_DAYS   [90]    older plans aren't offered
+#
+# Only generated plans are indexed (not reused copies), and a user is never
+# handed one of their own earlier plans. The in-memory matrix picks up plans
+# written by other workers incrementally (plan_id > last seen) on each lookup.
+import copy
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Optional
+
+import numpy as np
+
+from metrics import counter, gauge, histogram
+from pricing import PriceCatalog, optimize_shopping_list
+
+REUSE_THRESHOLD = float(os.getenv("MEAL_PLAN_REUSE_THRESHOLD", "0.6"))
+CALORIE_SCALE = float(os.getenv("MEAL_PLAN_REUSE_CALORIE_SCALE", "150"))
+BUDGET_SCALE = float(os.getenv("MEAL_PLAN_REUSE_BUDGET_SCALE", "0.25"))
+MAX_AGE_DAYS = int(os.getenv("MEAL_PLAN_REUSE_MAX_AGE_DAYS", "90"))
+GOALS = ("lose_weight", "maintain", "gain_muscle")
+GOAL_WEIGHT = 3.0
+CANDIDATES = 8  # nearest plans checked against the allergy constraint
+
+meal_plan_reuse_lookups = counter(
+    "meal_plan_reuse_lookups_total",
+    "Similar-plan lookups by outcome (hit / below_threshold / allergy_conflict / no_candidates / disabled)",
+    ("result",))
+meal_plan_reuse_similarity = histogram(
+    "meal_plan_reuse_similarity", "Similarity of the nearest stored plan",
+    buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99, 1.0))
+meal_plan_index_size = gauge("meal_plan_index_size", "Plans in the in-memory similarity index")
+
+
+def init_meal_plan_index(conn: sqlite3.Connection):
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS meal_plan_features (
+            plan_id INTEGER PRIMARY KEY,
+            user_id INTEGER,
+            created_at TEXT,
+            goal TEXT,
+            target_calories INTEGER,
+            budget REAL,
+            allergies TEXT,     -- normalized, ',' separated
+            vector BLOB,        -- float32 features()
+            FOREIGN KEY (plan_id) REFERENCES meal_plans (id)
+        )
+    """)
+    conn.commit()
+
+
+def normalize_allergies(allergies) -> frozenset:
+    if isinstance(allergies, str):
+        allergies = allergies.split(",")
+    return frozenset(a.strip().lower() for a in allergies or [] if a and a.strip().lower() not in ("", "none", "no"))
+
+
+def features(goal: str, target_calories: float, budget: float) -> np.ndarray:
+    vector = np.zeros(len(GOALS) + 2, dtype=np.float32)
+    if goal in GOALS:
+        vector[GOALS.index(goal)] = GOAL_WEIGHT
+    vector[-2] = float(target_calories) / CALORIE_SCALE
+    vector[-1] = math.log(max(float(budget or 0), 1.0)) / math.log1p(BUDGET_SCALE)
+    return vector
+
+
+def _scale_quantity(quantity, ratio: float):
+    """'2 lbs' * 1.5 -> '3 lbs'. Quantities without a leading number are left alone."""
+    text = str(quantity or "")
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)(?:\s*/\s*(\d+))?", text)
+    if not match:
+        return quantity
+    amount = float(match.group(1))
+    if match.group(2):
+        amount = amount / float(match.group(2))
+    return f"{round(amount * ratio, 2):g}{text[match.end():]}"
+
+
+class MealPlanIndex:
+    def __init__(self):
+        self._ids = np.zeros(0, dtype=np.int64)
+        self._users = np.zeros(0, dtype=np.int64)
+        self._created = np.zeros(0, dtype=np.float64)  # unix seconds
+        self._targets = np.zeros(0, dtype=np.float64)
+        self._vectors = np.zeros((0, len(GOALS) + 2), dtype=np.float32)
+        self._allergies = []
+        self._max_id = 0
+        self._lock = threading.Lock()
+
+    def add(self, conn: sqlite3.Connection, plan_id: int, user_id: int, goal: str, target_calories: int,
+            budget: float, allergies):
+        """Indexes a freshly generated plan (the caller commits)."""
+        conn.execute("""
+            INSERT OR REPLACE INTO meal_plan_features
+                (plan_id, user_id, created_at, goal, target_calories, budget, allergies, vector)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """, (plan_id, user_id, datetime.now().isoformat(), goal, target_calories, budget,
+              ",".join(sorted(normalize_allergies(allergies))), features(goal, target_calories, budget).tobytes()))
+
+    def _refresh(self, conn: sqlite3.Connection):
+        rows = conn.execute("""
+            SELECT plan_id, user_id, created_at, target_calories, allergies, vector
+            FROM meal_plan_features WHERE plan_id > ? ORDER BY plan_id
+        """, (self._max_id,)).fetchall()
+        if not rows:
+            return
+        with self._lock:
+            rows = [r for r in rows if r[0] > self._max_id]  # another thread may have got here first
+            if not rows:
+                return
+            self._ids = np.concatenate([self._ids, [r[0] for r in rows]])
+            self._users = np.concatenate([self._users, [r[1] or 0 for r in rows]])
+            self._created = np.concatenate([self._created, [datetime.fromisoformat(r[2]).timestamp() for r in rows]])
+            self._targets = np.concatenate([self._targets, [r[3] or 0 for r in rows]])
+            self._vectors = np.vstack([self._vectors] + [np.frombuffer(r[5], dtype=np.float32) for r in rows])
+            self._allergies += [normalize_allergies(r[4]) for r in rows]
+            self._max_id = rows[-1][0]
+            meal_plan_index_size.set(len(self._ids))
+
+    def nearest(self, conn: sqlite3.Connection, user_id: int, goal: str, target_calories: int, budget: float,
+                allergies) -> Optional[dict]:
+        """Best allergy-safe stored plan above the threshold, as {plan_id, similarity, plan, target_calories}."""
+        if REUSE_THRESHOLD > 1:
+            meal_plan_reuse_lookups.inc(result="disabled")
+            return None
+        self._refresh(conn)
+        with self._lock:
+            ids, users, created, targets = self._ids, self._users, self._created, self._targets
+            vectors, stored_allergies = self._vectors, self._allergies
+
+        cutoff = (datetime.now() - timedelta(days=MAX_AGE_DAYS)).timestamp()
+        eligible = np.flatnonzero((users != user_id) & (created >= cutoff))
+        if not len(eligible):
+            meal_plan_reuse_lookups.inc(result="no_candidates")
+            return None
+        query = features(goal, target_calories, budget)
+        distance_sq = np.sum((vectors[eligible] - query) ** 2, axis=1)
+        similarity = np.exp(-distance_sq / 2.0)
+        order = np.argsort(-similarity, kind="stable")[:CANDIDATES]
+        meal_plan_reuse_similarity.observe(float(similarity[order[0]]))
+
+        wanted = normalize_allergies(allergies)
+        for i in order:
+            if similarity[i] < REUSE_THRESHOLD:
+                break
+            row = eligible[i]
+            if not wanted <= stored_allergies[row]:
+                continue
+            stored = conn.execute("SELECT plan_data FROM meal_plans WHERE id = ?", (int(ids[row]),)).fetchone()
+            if stored is None:
+                continue  # plan deleted since it was indexed
+            plan = json.loads(stored[0])
+            meal_plan_reuse_lookups.inc(result="hit")
+            return {"plan_id": int(ids[row]), "similarity": round(float(similarity[i]), 4), "plan": plan,
+                    "target_calories": int(targets[row])}
+
+        meal_plan_reuse_lookups.inc(
+            result="below_threshold" if similarity[order[0]] < REUSE_THRESHOLD else "allergy_conflict")
+        return None
+
+
+meal_plan_index = MealPlanIndex()
+
+
+def adapt_plan(match: dict, target_calories: int, budget: float, allergies, conn: sqlite3.Connection) -> dict:
+    """Copy of a matched plan fitted to the requester: calories and quantities rescaled, budget re-optimized."""
+    started = time.perf_counter()
+    plan = copy.deepcopy(match["plan"])
+    plan.pop("health_analysis", None)  # validated against the donor's target and allergies, not ours
+    meal_plan = plan.get("meal_plan") or {}
+    ratio = target_calories / match["target_calories"] if match["target_calories"] else 1.0
+    for meals in (meal_plan.get("week_plan") or {}).values():
+        for meal in (meals or {}).values():
+            if isinstance(meal, dict) and isinstance(meal.get("calories"), (int, float)):
+                meal["calories"] = int(round(meal["calories"] * ratio))
+    if isinstance(meal_plan.get("total_weekly_calories"), (int, float)):
+        meal_plan["total_weekly_calories"] = int(round(meal_plan["total_weekly_calories"] * ratio))
+    # Same ratio for the groceries, or the bigger plan would be shopped for with the smaller list
+    shopping_list = plan.get("shopping_list") or {}
+    for entry in shopping_list.get("grocery_list") or []:
+        if isinstance(entry, dict) and "quantity" in entry:
+            entry["quantity"] = _scale_quantity(entry["quantity"], ratio)
+    if isinstance(shopping_list.get("estimated_cost"), (int, float)):
+        shopping_list["estimated_cost"] = round(shopping_list["estimated_cost"] * ratio, 2)
+    # The original reasoning was written for someone else's food history
+    meal_plan["reasoning"] = "Adapted from a plan generated for a similar goal, calorie target and budget."
+
+    plan["budget_optimization"] = optimize_shopping_list(
+        plan.get("shopping_list"), None, budget, allergies, PriceCatalog.load(conn))
+    plan["execution_metrics"] = {
+        "total_time_seconds": time.perf_counter() - started,
+        "agent_calls": 0,
+        "reused_from": {"plan_id": match["plan_id"], "similarity": match["similarity"]},
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "estimated_cost": 0.0,
+    }
+    return plan
@@ -0,0 +1,217 @@
+# metrics.py - Tiny in-process metrics registry with Prometheus text output
+#
+# Counters, gauges and histograms with labels, plus span() for timing named
+# stages (e.g. each MealPlanOrchestrator agent). Everything is exposed at
+# GET /metrics in the Prometheus exposition format.
+import threading
+import time
+from contextlib import contextmanager
+
+from profiling import record_span
+
+# Latency buckets in seconds: covers fast SQLite queries up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+
+def _label_key(label_names: tuple, labels: dict) -> tuple:
+    return tuple(str(labels.get(name, "")) for name in label_names)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(label_names: tuple, key: tuple, extra: dict = None) -> str:
+    pairs = list(zip(label_names, key)) + list((extra or {}).items())
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in pairs) + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.label_names, labels), 0.0)
+
+    def render(self) -> list:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, k)} {v}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self._values = {}
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[_label_key(self.label_names, labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def value(self, **labels) -> float:
+        return self._values.get(_label_key(self.label_names, labels), 0.0)
+
+    def render(self) -> list:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.label_names, k)} {v}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}  # key -> [bucket_counts, sum, count]
+
+    def observe(self, value: float, **labels):
+        key = _label_key(self.label_names, labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> list:
+        with self._lock:
+            items = [(k, (list(s[0]), s[1], s[2])) for k, s in self._series.items()]
+        lines = self.header()
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, {'le': bound})} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(self.label_names, key, {'le': '+Inf'})} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.label_names, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.label_names, key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, documentation, labels=()) -> Counter:
+    return REGISTRY.register(Counter(name, documentation, labels))
+
+
+def gauge(name, documentation, labels=()) -> Gauge:
+    return REGISTRY.register(Gauge(name, documentation, labels))
+
+
+def histogram(name, documentation, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+    return REGISTRY.register(Histogram(name, documentation, labels, buckets))
+
+
+# =============================================================================
+# Metrics used across the backend
+# =============================================================================
+
+http_request_seconds = histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route", "status"))
+sqlite_query_seconds = histogram(
+    "sqlite_query_duration_seconds", "SQLite statement latency by operation", ("operation",))
+llm_call_seconds = histogram(
+    "llm_call_duration_seconds", "OpenAI call latency by model and call type", ("model", "call"))
+llm_first_token_seconds = histogram(
+    "llm_first_token_seconds", "Time to the first streamed token by model and call type", ("model", "call"))
+llm_tokens = counter(
+    "llm_tokens_total", "OpenAI tokens used by model and direction", ("model", "direction"))
+llm_errors = counter(
+    "llm_errors_total", "Failed OpenAI calls by model and call type", ("model", "call"))
+background_queue_depth = gauge(
+    "background_tasks_in_flight", "Background tasks queued or running")
+background_task_seconds = histogram(
+    "background_task_duration_seconds", "Background task run time", ("task",))
+span_seconds = histogram(
+    "span_duration_seconds", "Duration of named pipeline stages", ("span",))
+span_errors = counter(
+    "span_errors_total", "Named pipeline stages that raised", ("span",))
+app_cold_start_seconds = gauge(
+    "app_cold_start_seconds", "Worker start-up time: module import, lifespan startup, total", ("phase",))
+request_profiles = counter(
+    "request_profiles_total", "Requests profiled, by trigger (header / sampled)", ("trigger",))
+
+
+@contextmanager
+def span(name: str):
+    """Times a named stage: `with span("meal_plan.generate"): ...`"""
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    except BaseException:
+        span_errors.inc(span=name)
+        raise
+    finally:
+        elapsed = time.perf_counter() - started
+        span_seconds.observe(elapsed, span=name)
+        record_span(name, started, elapsed, ok)
@@ -0,0 +1,135 @@
+# model_router.py - Pick the model for each call from a policy + live latency/error stats
+#
+# Each call type has an ordered list of candidate models (best quality first)
+# and a p95 latency SLO. route(call) returns the first candidate that is
+# meeting its SLO, has an acceptable error rate and whose circuit breaker
+# isn't open. When nothing qualifies we take the candidate with the best p95.
+# A small share of traffic keeps probing the preferred model so we move back
+# to it once it recovers.
+#
+# Override the policy with MODEL_POLICY (JSON string or path to a JSON file):
+#   {"food_vision": {"models": ["gpt-4o", "gpt-4o-mini"], "p95_slo_s": 6}}
+#
+# Env (defaults in brackets):
+#   ROUTER_WINDOW_S [300]   ROUTER_MIN_SAMPLES [20]   ROUTER_MAX_ERROR_RATE [0.2]   ROUTER_PROBE_RATE [0.05]
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from circuit_breaker import get_breaker
+from metrics import counter
+
+DEFAULT_POLICY = {
+    "food_vision": {"models": ["gpt-4o", "gpt-4o-mini"], "p95_slo_s": 6.0},
+    "food_vision_stream": {"models": ["gpt-4o", "gpt-4o-mini"], "p95_slo_s": 6.0},
+    "voice_transcription": {"models": ["whisper-1", "gpt-4o-mini-transcribe"], "p95_slo_s": 4.0},
+    "voice_intent": {"models": ["gpt-4o-mini"], "p95_slo_s": 2.0},
+    "macro_estimate": {"models": ["gpt-4o-mini"], "p95_slo_s": 5.0},
+    "meal_plan": {"models": ["o4-mini", "gpt-4o-mini"], "p95_slo_s": 60.0},
+    "shopping_list": {"models": ["o4-mini", "gpt-4o-mini"], "p95_slo_s": 40.0},
+    "health_validation": {"models": ["gpt-4o-mini"], "p95_slo_s": 20.0},
+}
+
+WINDOW_SECONDS = float(os.getenv("ROUTER_WINDOW_S", "300"))
+MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "20"))
+MAX_ERROR_RATE = float(os.getenv("ROUTER_MAX_ERROR_RATE", "0.2"))
+PROBE_RATE = float(os.getenv("ROUTER_PROBE_RATE", "0.05"))
+
+route_decisions = counter("model_route_decisions_total", "Model chosen per call type", ("call", "model", "reason"))
+
+
+def _load_policy() -> dict:
+    policy = {call: dict(rule) for call, rule in DEFAULT_POLICY.items()}
+    raw = os.getenv("MODEL_POLICY", "").strip()
+    if raw:
+        if not raw.startswith("{"):
+            with open(raw) as f:
+                raw = f.read()
+        for call, rule in json.loads(raw).items():
+            policy.setdefault(call, {}).update(rule)
+    return policy
+
+
+POLICY = _load_policy()
+
+
+class ModelStats:
+    """Rolling latency/error samples per (model, call)."""
+
+    def __init__(self, max_samples: int = 500):
+        self.max_samples = max_samples
+        self._samples = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, call: str, seconds: float, ok: bool):
+        with self._lock:
+            samples = self._samples.setdefault((model, call), deque(maxlen=self.max_samples))
+            samples.append((time.monotonic(), seconds, ok))
+
+    def summary(self, model: str, call: str) -> dict:
+        cutoff = time.monotonic() - WINDOW_SECONDS
+        with self._lock:
+            samples = [s for s in self._samples.get((model, call), ()) if s[0] >= cutoff]
+        if not samples:
+            return {"samples": 0, "p95_s": None, "error_rate": 0.0}
+        latencies = sorted(s[1] for s in samples)
+        p95 = latencies[min(int(len(latencies) * 0.95), len(latencies) - 1)]
+        errors = sum(1 for s in samples if not s[2])
+        return {"samples": len(samples), "p95_s": round(p95, 3), "error_rate": round(errors / len(samples), 3)}
+
+
+model_stats = ModelStats()
+
+
+def _healthy(model: str, call: str, slo: float) -> bool:
+    if get_breaker(model, call).is_open():
+        return False
+    stats = model_stats.summary(model, call)
+    if stats["samples"] < MIN_SAMPLES:
+        return True  # not enough data to judge - give it traffic
+    return stats["p95_s"] <= slo and stats["error_rate"] <= MAX_ERROR_RATE
+
+
+def route(call: str, default: str = "gpt-4o-mini") -> str:
+    """The model that should serve this call right now."""
+    rule = POLICY.get(call)
+    if not rule or not rule.get("models"):
+        return default
+    models = rule["models"]
+    slo = float(rule.get("p95_slo_s", 30.0))
+
+    for position, model in enumerate(models):
+        if _healthy(model, call, slo):
+            reason = "preferred" if position == 0 else "slo_fallback"
+            if position > 0 and random.random() < PROBE_RATE and not get_breaker(models[0], call).is_open():
+                model, reason = models[0], "probe"
+            route_decisions.inc(call=call, model=model, reason=reason)
+            return model
+
+    # Nobody meets the SLO: take the fastest model that isn't cut off
+    available = [m for m in models if not get_breaker(m, call).is_open()] or models
+    model = min(available, key=lambda m: model_stats.summary(m, call)["p95_s"] or 0.0)
+    route_decisions.inc(call=call, model=model, reason="best_effort")
+    return model
+
+
+def unavailable(call: str) -> bool:
+    """True when every candidate model for this call has an open breaker."""
+    rule = POLICY.get(call) or {}
+    return all(get_breaker(m, call).is_open() for m in rule.get("models", ())) if rule.get("models") else False
+
+
+def routing_table() -> dict:
+    """Current policy, live stats and decision per call type (for the admin endpoint)."""
+    table = {}
+    for call, rule in POLICY.items():
+        models = rule.get("models", [])
+        slo = float(rule.get("p95_slo_s", 30.0))
+        table[call] = {
+            "p95_slo_s": slo,
+            "models": {m: dict(model_stats.summary(m, call), healthy=_healthy(m, call, slo)) for m in models},
+        }
+    return table
@@ -0,0 +1,334 @@
+# nutrition.py - Local nutrition reference database (SQLite + FTS5)
+#
+# Consulted before any LLM call when we need macros for a food. Foods live in
+# nutrition_foods (per-serving values) with an FTS5 index over name + aliases.
+# A match has to account for the dish name: "oatmeal with banana and peanut
+# butter" is a dish, not peanut butter, so it's left to the LLM estimate. When
+# the caller knows the dish name separately (the food type from the vision
+# model), only that has to be covered and the description just helps pick a
+# candidate, so "Banana" / "a ripe yellow banana" is still a banana.
+# When we scale to a calorie count, a serving that would need scaling by more
+# than NUTRITION_MAX_SCALE either way (black coffee at 300 kcal) is the wrong
+# food, so that's a miss too.
+#
+#   NUTRITION_MIN_COVERAGE   [0.6]  share of the dish name's words the matched name must cover
+#   NUTRITION_MAX_SCALE      [4]    largest calorie ratio between the logged food and one serving
+#
+# Import data with:
+#   python nutrition.py csv data/nutrition.csv     (our simple per-serving CSV)
+#   python nutrition.py fdc ./FoodData_Central_csv (USDA FoodData Central download)
+import csv
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from db import get_db
+from metrics import counter, histogram
+
+DEFAULT_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nutrition.csv")
+
+# USDA FoodData Central nutrient ids
+FDC_ENERGY_KCAL = {1008, 2047, 2048}
+FDC_PROTEIN = 1003
+FDC_FAT = 1004
+FDC_CARBS = 1005
+
+STOPWORDS = {"a", "an", "the", "of", "with", "and", "in", "on", "some", "fresh", "plate", "bowl",
+             "serving", "side", "piece", "pieces", "slice", "slices", "cup", "glass", "homemade"}
+# Portion words: still searched, but a match doesn't have to cover them ("large banana" is a banana)
+MODIFIERS = {"small", "medium", "large", "big", "extra", "half", "one", "two", "three", "four", "five",
+             "six", "double", "single", "mini", "whole"}
+MIN_COVERAGE = float(os.getenv("NUTRITION_MIN_COVERAGE", "0.6"))
+MAX_SCALE = float(os.getenv("NUTRITION_MAX_SCALE", "4"))
+
+
+def init_nutrition_db(conn: sqlite3.Connection, seed_csv: str = DEFAULT_CSV):
+    """Creates the nutrition tables and seeds them from the bundled CSV if empty."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS nutrition_foods (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            aliases TEXT,          -- ';' separated
+            source TEXT,           -- 'seed', 'csv', 'fdc'
+            source_id TEXT,
+            serving_desc TEXT,
+            serving_g REAL,
+            calories REAL,         -- per serving
+            protein REAL,
+            carbs REAL,
+            fats REAL,
+            UNIQUE (source, source_id)
+        )
+    """)
+    cursor.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS nutrition_fts USING fts5(
+            name, aliases,
+            content='nutrition_foods', content_rowid='id',
+            tokenize='porter unicode61'
+        )
+    """)
+    cursor.execute("SELECT COUNT(*) FROM nutrition_foods")
+    if cursor.fetchone()[0] == 0 and seed_csv and os.path.exists(seed_csv):
+        import_csv(seed_csv, conn, source="seed")
+    conn.commit()
+
+
+def _rebuild_index(conn: sqlite3.Connection):
+    conn.execute("INSERT INTO nutrition_fts(nutrition_fts) VALUES ('rebuild')")
+
+
+def _upsert_foods(conn: sqlite3.Connection, rows: list):
+    conn.executemany("""
+        INSERT INTO nutrition_foods
+            (name, aliases, source, source_id, serving_desc, serving_g, calories, protein, carbs, fats)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(source, source_id) DO UPDATE SET
+            name = excluded.name, aliases = excluded.aliases, serving_desc = excluded.serving_desc,
+            serving_g = excluded.serving_g, calories = excluded.calories, protein = excluded.protein,
+            carbs = excluded.carbs, fats = excluded.fats
+    """, rows)
+    _rebuild_index(conn)
+    conn.commit()
+
+
+def import_csv(csv_path: str, conn: sqlite3.Connection, source: str = "csv") -> int:
+    """Imports a per-serving CSV (name,aliases,serving_desc,serving_g,calories,protein,carbs,fats)."""
+    rows = []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            name = row["name"].strip().lower()
+            rows.append((
+                name, row.get("aliases", "").lower(), source, name,
+                row.get("serving_desc", ""), float(row.get("serving_g") or 100),
+                float(row["calories"]), float(row["protein"]), float(row["carbs"]), float(row["fats"]),
+            ))
+    _upsert_foods(conn, rows)
+    return len(rows)
+
+
+def import_fdc(fdc_dir: str, conn: sqlite3.Connection) -> int:
+    """
+    Imports a USDA FoodData Central CSV download (SR Legacy / Foundation / Survey).
+    Uses food.csv, food_nutrient.csv and (optionally) food_portion.csv. FDC values
+    are per 100 g; we scale them to the first listed portion when one exists.
+    """
+    foods = {}
+    with open(os.path.join(fdc_dir, "food.csv"), newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            foods[row["fdc_id"]] = {"name": row["description"].strip().lower(),
+                                    "kcal": None, "protein": 0.0, "carbs": 0.0, "fats": 0.0}
+
+    with open(os.path.join(fdc_dir, "food_nutrient.csv"), newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            food = foods.get(row["fdc_id"])
+            if food is None or not row.get("amount"):
+                continue
+            nutrient_id = int(row["nutrient_id"])
+            amount = float(row["amount"])
+            if nutrient_id in FDC_ENERGY_KCAL and food["kcal"] is None:
+                food["kcal"] = amount
+            elif nutrient_id == FDC_PROTEIN:
+                food["protein"] = amount
+            elif nutrient_id == FDC_CARBS:
+                food["carbs"] = amount
+            elif nutrient_id == FDC_FAT:
+                food["fats"] = amount
+
+    portions = {}
+    portion_path = os.path.join(fdc_dir, "food_portion.csv")
+    if os.path.exists(portion_path):
+        with open(portion_path, newline="", encoding="utf-8") as f:
+            for row in csv.DictReader(f):
+                if row["fdc_id"] in portions or not row.get("gram_weight"):
+                    continue
+                desc = " ".join(p for p in (row.get("amount", ""), row.get("portion_description") or row.get("modifier", "")) if p)
+                portions[row["fdc_id"]] = (desc.strip() or "1 serving", float(row["gram_weight"]))
+
+    rows = []
+    for fdc_id, food in foods.items():
+        if food["kcal"] is None:
+            continue
+        serving_desc, serving_g = portions.get(fdc_id, ("100 g", 100.0))
+        scale = serving_g / 100.0
+        # FDC descriptions look like "Chicken, broiler, breast, meat only, cooked" -> alias "chicken breast"
+        parts = [p.strip() for p in food["name"].split(",")]
+        alias = " ".join(parts[:3]) if len(parts) > 1 else ""
+        rows.append((food["name"], alias, "fdc", fdc_id, serving_desc, serving_g,
+                     food["kcal"] * scale, food["protein"] * scale,
+                     food["carbs"] * scale, food["fats"] * scale))
+    _upsert_foods(conn, rows)
+    return len(rows)
+
+
+# =============================================================================
+# Lookup + metrics
+# =============================================================================
+
+class LookupMetrics:
+    """Thread-safe counters for lookup latency and match rate."""
+
+    def __init__(self, window: int = 1000):
+        self._lock = threading.Lock()
+        self.lookups = 0
+        self.hits = 0
+        self.total_ms = 0.0
+        self._recent_ms = deque(maxlen=window)
+
+    def record(self, hit: bool, elapsed_ms: float):
+        with self._lock:
+            self.lookups += 1
+            self.hits += int(hit)
+            self.total_ms += elapsed_ms
+            self._recent_ms.append(elapsed_ms)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            recent = sorted(self._recent_ms)
+            p95 = recent[int(len(recent) * 0.95) - 1] if recent else 0.0
+            return {
+                "lookups": self.lookups,
+                "hits": self.hits,
+                "misses": self.lookups - self.hits,
+                "match_rate": round(self.hits / self.lookups, 4) if self.lookups else 0.0,
+                "avg_latency_ms": round(self.total_ms / self.lookups, 3) if self.lookups else 0.0,
+                "p95_latency_ms": round(p95, 3),
+            }
+
+
+lookup_metrics = LookupMetrics()
+
+# Same numbers for the Prometheus scrape
+nutrition_lookups = counter("nutrition_lookups_total", "Local nutrition DB lookups by result", ("result",))
+nutrition_lookup_seconds = histogram("nutrition_lookup_duration_seconds", "Local nutrition DB lookup latency")
+
+
+def _tokens(text: str) -> list:
+    words = re.findall(r"[a-z0-9]+", (text or "").lower())
+    return [w for w in words if w not in STOPWORDS and len(w) > 1]
+
+
+def _stem(word: str) -> str:
+    if word.endswith("ies") and len(word) > 4:
+        return word[:-3] + "y"
+    if word.endswith("es") and word[:-2].endswith(("ch", "sh", "o", "x")):
+        return word[:-2]
+    if word.endswith("s") and not word.endswith("ss") and len(word) > 3:
+        return word[:-1]
+    return word
+
+
+def _coverage(candidate_names: list, query_stems: set) -> int:
+    """Largest number of words of any candidate name/alias fully contained in the query (0 if none)."""
+    best = 0
+    for name in candidate_names:
+        stems = {_stem(w) for w in _tokens(name)}
+        if stems and stems <= query_stems:
+            best = max(best, len(stems))
+    return best
+
+
+def find_food(conn: sqlite3.Connection, text: str, dish: str = None):
+    """
+    Returns the best matching nutrition_foods row for free text, or None.
+    A candidate only matches when every word of its name (or one alias) appears
+    in the text; the most specific candidate wins, so "grilled chicken salad"
+    resolves to chicken salad rather than chicken breast. The winner must also
+    cover MIN_COVERAGE of the dish name's words (`dish`, or the whole text when
+    not given), otherwise it's one ingredient of a mixed dish ("salmon with
+    rice and broccoli" -> broccoli) and we return None.
+    """
+    words = _tokens(text)
+    if not words:
+        return None
+    query = " OR ".join(f'"{w}"' for w in dict.fromkeys(words))
+    rows = conn.execute("""
+        SELECT f.id, f.name, f.aliases, f.serving_desc, f.serving_g, f.calories, f.protein, f.carbs, f.fats
+        FROM nutrition_fts
+        JOIN nutrition_foods f ON f.id = nutrition_fts.rowid
+        WHERE nutrition_fts MATCH ?
+        ORDER BY bm25(nutrition_fts, 10.0, 5.0)
+        LIMIT 25
+    """, (query,)).fetchall()
+
+    query_stems = {_stem(w) for w in words}
+    dish_stems = ({_stem(w) for w in _tokens(dish)} & query_stems if dish else None) or query_stems
+    content = {stem for stem in dish_stems if stem not in MODIFIERS}
+    best, best_key = None, (0, 0)
+    for row in rows:
+        names = [row[1]] + [a for a in (row[2] or "").split(";") if a.strip()]
+        score = _coverage(names, query_stems)
+        if not score:
+            continue
+        # Covering the dish name beats covering more of the description
+        key = (_coverage(names, dish_stems), score)
+        if key > best_key:
+            best, best_key = row, key
+    if best is not None and best_key[0] < MIN_COVERAGE * len(content):
+        return None
+    return best
+
+
+def _scale_for(calories, food_calories):
+    """Serving multiplier for a calorie count, or None when it's implausible."""
+    if not calories:
+        return 1.0
+    if not food_calories or food_calories <= 0:
+        return None
+    scale = calories / food_calories
+    return scale if 1 / MAX_SCALE <= scale <= MAX_SCALE else None
+
+
+def lookup_macros(text: str, calories: int = None, dish: str = None):
+    """
+    Macros for a food from the local database, or None when we don't know it.
+    With `calories`, the food's macro ratio is scaled to that calorie count
+    (same contract as estimate_macros_from_food); otherwise values are per serving.
+    `dish` is the dish name when the caller has it apart from the description.
+    """
+    started = time.perf_counter()
+    conn = get_db()
+    try:
+        row = find_food(conn, text, dish)
+    except sqlite3.Error:
+        row = None
+    finally:
+        conn.close()
+    scale = _scale_for(calories, row[5]) if row is not None else None
+    elapsed = time.perf_counter() - started
+    lookup_metrics.record(scale is not None, elapsed * 1000)
+    if row is None:
+        result = "miss"
+    else:
+        result = "hit" if scale is not None else "scale_mismatch"
+    nutrition_lookups.inc(result=result)
+    nutrition_lookup_seconds.observe(elapsed)
+
+    if scale is None:
+        return None
+    _, name, _, serving_desc, serving_g, food_calories, protein, carbs, fats = row
+    return {
+        "protein": int(round(protein * scale)),
+        "carbs": int(round(carbs * scale)),
+        "fats": int(round(fats * scale)),
+        "calories": int(round(calories if calories else food_calories)),
+        "matched_food": name,
+        "serving": serving_desc,
+        "source": "local_db",
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3 or sys.argv[1] not in ("csv", "fdc"):
+        print("Usage: python nutrition.py csv <file.csv> | python nutrition.py fdc <fdc_csv_dir>")
+        sys.exit(1)
+    conn = get_db()
+    init_nutrition_db(conn, seed_csv=None)
+    loader = import_csv if sys.argv[1] == "csv" else import_fdc
+    print(f"Imported {loader(sys.argv[2], conn)} foods")
+    conn.close()
@@ -0,0 +1,443 @@
+# pricing.py - Local price catalog + deterministic budget optimizer
+#
+# Replaces the LLM-based budget agent. Prices live in a SQLite table
+# (price_catalog) that can be (re)loaded from CSV:
+#
+#   python pricing.py load data/prices.csv
+#
+# Each load bumps price_catalog_meta.version, and every worker's cached
+# catalog checks that stamp and reloads when it moves.
+#
+# The optimizer treats the shopping list as a multiple-choice knapsack:
+# every item can be kept, swapped for a substitute from the same
+# substitute_group, reduced, or removed, and we pick the combination with the
+# best "utility" that fits the budget. Allergy-unsafe options are never
+# considered and a protein floor (derived from the health analysis) is
+# enforced with a Lagrangian weight on protein. The floor only counts items
+# the user can actually eat; when no weight gets the list over it within
+# budget, protein_floor_met is false.
+import csv
+import math
+import os
+import re
+import sqlite3
+import time
+
+import numpy as np
+
+from db import get_db
+
+DEFAULT_CSV = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "prices.csv")
+
+# Unit conversion to a base unit per dimension (mass -> lb, volume -> gal)
+MASS_UNITS = {"lb": 1.0, "lbs": 1.0, "pound": 1.0, "pounds": 1.0,
+              "oz": 1 / 16, "ounce": 1 / 16, "ounces": 1 / 16,
+              "kg": 2.20462, "kgs": 2.20462, "g": 0.00220462, "grams": 0.00220462, "gram": 0.00220462}
+VOLUME_UNITS = {"gal": 1.0, "gallon": 1.0, "gallons": 1.0,
+                "qt": 0.25, "quart": 0.25, "quarts": 0.25,
+                "l": 0.264172, "liter": 0.264172, "liters": 0.264172, "litre": 0.264172,
+                "ml": 0.000264172, "cup": 0.0625, "cups": 0.0625,
+                "tbsp": 0.00390625, "tsp": 0.00130208}
+COUNT_UNITS = {"each": 1.0, "ea": 1.0, "whole": 1.0, "piece": 1.0, "pieces": 1.0, "pcs": 1.0,
+               "dozen": 12.0, "head": 1.0, "heads": 1.0, "bunch": 1.0, "bunches": 1.0,
+               "clove": 1.0, "cloves": 1.0}
+
+# Utility scores used by the solver (higher = closer to what the plan asked for)
+KEEP_UTILITY = 10.0
+SUBSTITUTE_UTILITY = 8.0
+REDUCE_UTILITY = 5.0
+REMOVE_UTILITY = 0.0
+NON_ESSENTIAL_REMOVE_UTILITY = 1.0
+
+# Fraction of the original list's protein we must keep, by protein adequacy
+PROTEIN_FLOOR = {"low": 1.0, "adequate": 0.9, "high": 0.75}
+
+# Fallback price when an item is not in the catalog and its category is unknown
+DEFAULT_ITEM_PRICE = 3.0
+
+
+def _normalize(name: str) -> str:
+    name = re.sub(r"[^a-z0-9% ]", " ", (name or "").lower())
+    return re.sub(r"\s+", " ", name).strip()
+
+
+def _singular(name: str) -> str:
+    if name.endswith("ies"):
+        return name[:-3] + "y"
+    if name.endswith("oes"):
+        return name[:-2]
+    if name.endswith("s") and not name.endswith("ss"):
+        return name[:-1]
+    return name
+
+
+def _split_list(value: str) -> list:
+    return [v.strip().lower() for v in (value or "").split(";") if v.strip()]
+
+
+def init_price_catalog(conn: sqlite3.Connection, seed_csv: str = DEFAULT_CSV):
+    """Creates the price_catalog table and seeds it from the bundled CSV if empty."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS price_catalog (
+            id INTEGER PRIMARY KEY,
+            item TEXT UNIQUE NOT NULL,
+            aliases TEXT,           -- ';' separated
+            category TEXT,
+            unit TEXT,              -- unit the price refers to (lb, gal, dozen, can, ...)
+            unit_price REAL,
+            protein_per_unit REAL,  -- grams of protein per unit
+            allergens TEXT,         -- ';' separated
+            substitute_group TEXT,
+            essential INTEGER DEFAULT 0
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS price_catalog_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL DEFAULT 0
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO price_catalog_meta (id, version) VALUES (1, 0)")
+    cursor.execute("SELECT COUNT(*) FROM price_catalog")
+    if cursor.fetchone()[0] == 0 and seed_csv and os.path.exists(seed_csv):
+        load_prices_from_csv(seed_csv, conn)
+    conn.commit()
+
+
+def load_prices_from_csv(csv_path: str, conn: sqlite3.Connection) -> int:
+    """Upserts every row of a price CSV into price_catalog. Returns rows loaded."""
+    rows = []
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        for row in csv.DictReader(f):
+            rows.append((
+                _normalize(row["item"]),
+                row.get("aliases", ""),
+                row.get("category", ""),
+                (row.get("unit") or "each").strip().lower(),
+                float(row["unit_price"]),
+                float(row.get("protein_per_unit") or 0),
+                row.get("allergens", ""),
+                row.get("substitute_group") or _normalize(row["item"]),
+                int(row.get("essential") or 0),
+            ))
+    conn.executemany("""
+        INSERT INTO price_catalog
+            (item, aliases, category, unit, unit_price, protein_per_unit, allergens, substitute_group, essential)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT(item) DO UPDATE SET
+            aliases = excluded.aliases, category = excluded.category, unit = excluded.unit,
+            unit_price = excluded.unit_price, protein_per_unit = excluded.protein_per_unit,
+            allergens = excluded.allergens, substitute_group = excluded.substitute_group,
+            essential = excluded.essential
+    """, rows)
+    conn.execute("UPDATE price_catalog_meta SET version = version + 1 WHERE id = 1")
+    conn.commit()
+    PriceCatalog.invalidate()
+    return len(rows)
+
+
+def parse_quantity(quantity) -> tuple:
+    """'2 lbs' -> (2.0, 'lbs'). Unparseable quantities count as one unit."""
+    text = str(quantity or "").lower().strip()
+    match = re.match(r"^\s*(\d+(?:\.\d+)?)(?:\s*/\s*(\d+))?\s*([a-z]*)", text)
+    if not match:
+        return 1.0, ""
+    amount = float(match.group(1))
+    if match.group(2):
+        amount = amount / float(match.group(2))
+    return amount, match.group(3)
+
+
+def _convert(amount: float, from_unit: str, to_unit: str):
+    """Converts between units of the same dimension, or returns None."""
+    for table in (MASS_UNITS, VOLUME_UNITS, COUNT_UNITS):
+        if from_unit in table and to_unit in table:
+            return amount * table[from_unit] / table[to_unit]
+    return None
+
+
+class PriceCatalog:
+    """In-memory view of price_catalog, reloaded when the stored version changes."""
+
+    _instance = None
+
+    def __init__(self, rows, version: int = 0):
+        self.version = version
+        self.entries = {}
+        self.by_alias = {}
+        self.groups = {}
+        category_prices = {}
+        for row in rows:
+            entry = {
+                "item": row[0],
+                "category": row[2] or "",
+                "unit": row[3] or "each",
+                "unit_price": row[4] or 0.0,
+                "protein_per_unit": row[5] or 0.0,
+                "allergens": set(_split_list(row[6])),
+                "group": row[7] or row[0],
+                "essential": bool(row[8]),
+            }
+            self.entries[entry["item"]] = entry
+            for name in [entry["item"]] + _split_list(row[1]):
+                self.by_alias[_normalize(name)] = entry
+                self.by_alias[_singular(_normalize(name))] = entry
+            self.groups.setdefault(entry["group"], []).append(entry)
+            category_prices.setdefault(entry["category"], []).append(entry["unit_price"])
+        self.category_price = {c: sorted(p)[len(p) // 2] for c, p in category_prices.items()}
+        # Longest aliases first so "peanut butter" wins over "butter"
+        self._aliases_by_length = sorted(self.by_alias, key=len, reverse=True)
+
+    @classmethod
+    def load(cls, conn: sqlite3.Connection):
+        # One-row lookup per call so a `pricing.py load` in another process is seen
+        row = conn.execute("SELECT version FROM price_catalog_meta WHERE id = 1").fetchone()
+        version = row[0] if row else 0
+        if cls._instance is None or cls._instance.version != version:
+            rows = conn.execute("""
+                SELECT item, aliases, category, unit, unit_price, protein_per_unit,
+                       allergens, substitute_group, essential
+                FROM price_catalog
+            """).fetchall()
+            cls._instance = cls(rows, version)
+        return cls._instance
+
+    @classmethod
+    def invalidate(cls):
+        cls._instance = None
+
+    def match(self, item_name: str):
+        """Finds the catalog entry for a free-text shopping list item."""
+        name = _normalize(item_name)
+        if name in self.by_alias:
+            return self.by_alias[name]
+        if _singular(name) in self.by_alias:
+            return self.by_alias[_singular(name)]
+        padded = f" {name} "
+        for alias in self._aliases_by_length:
+            if f" {alias} " in padded:
+                return self.by_alias[alias]
+        return None
+
+    def price_for(self, entry, amount: float, unit: str) -> tuple:
+        """(price, catalog units) for `amount` `unit` of a catalog entry (falls back to package count)."""
+        converted = _convert(amount, unit or "each", entry["unit"])
+        if converted is not None:
+            units = converted
+        elif not unit or _singular(unit) == _singular(entry["unit"]):
+            units = amount  # "3 cans", or a bare count of a per-lb item
+        else:
+            units = 1.0  # incompatible units (e.g. cups of rice) -> one package
+        return units * entry["unit_price"], units
+
+
+def _is_unsafe(name: str, allergens: set, allergies: set) -> bool:
+    if allergens & allergies:
+        return True
+    return any(a and a in name for a in allergies)
+
+
+def _normalize_allergies(allergies) -> set:
+    if isinstance(allergies, str):
+        allergies = allergies.split(",")
+    normalized = set()
+    for allergy in allergies or []:
+        allergy = _normalize(allergy)
+        if not allergy or allergy in ("none", "no"):
+            continue
+        normalized.add(allergy)
+        normalized.add(_singular(allergy))
+        # Common spellings used in the plan form vs catalog allergen tags
+        normalized.update({
+            "dairy": {"milk"}, "lactose": {"milk"}, "nuts": {"tree_nut", "peanut"},
+            "tree nuts": {"tree_nut"}, "gluten": {"wheat"}, "seafood": {"fish", "shellfish"},
+            "eggs": {"egg"}, "peanuts": {"peanut"},
+        }.get(allergy, set()))
+    return normalized
+
+
+def _build_options(item, catalog, allergies):
+    """All candidate choices for one shopping list item."""
+    name = item.get("item", "")
+    quantity = item.get("quantity", "1")
+    amount, unit = parse_quantity(quantity)
+    entry = catalog.match(name)
+
+    options = []
+    if entry is None:
+        # Unknown item: keep at a category estimate, or drop it
+        price = catalog.category_price.get(item.get("category", ""), DEFAULT_ITEM_PRICE)
+        if not _is_unsafe(_normalize(name), set(), allergies):
+            options.append({"kind": "keep", "item": name, "quantity": quantity, "price": price,
+                            "protein": 0.0, "utility": KEEP_UTILITY})
+        options.append({"kind": "remove", "item": name, "quantity": quantity, "price": 0.0,
+                        "protein": 0.0, "utility": NON_ESSENTIAL_REMOVE_UTILITY})
+        return options, price, 0.0
+
+    price, units = catalog.price_for(entry, amount, unit)
+    protein = units * entry["protein_per_unit"]
+    unsafe = _is_unsafe(_normalize(name), entry["allergens"], allergies)
+
+    if not unsafe:
+        options.append({"kind": "keep", "item": name, "quantity": quantity, "price": price,
+                        "protein": protein, "utility": KEEP_UTILITY})
+        if not entry["essential"] and amount > 0:
+            options.append({"kind": "reduce", "item": name,
+                            "quantity": f"{round(amount / 2, 2):g} {unit}".strip(),
+                            "price": price / 2, "protein": protein / 2, "utility": REDUCE_UTILITY})
+
+    for sub in catalog.groups.get(entry["group"], []):
+        if sub is entry or _is_unsafe(sub["item"], sub["allergens"], allergies):
+            continue
+        # Buy the substitute in its own unit when the dimension differs
+        sub_units = _convert(units, entry["unit"], sub["unit"])
+        if sub_units is None:
+            sub_units = units
+        sub_quantity = f"{round(sub_units, 2):g} {sub['unit']}"
+        options.append({"kind": "substitute", "item": sub["item"], "quantity": sub_quantity,
+                        "price": sub_units * sub["unit_price"],
+                        "protein": sub_units * sub["protein_per_unit"],
+                        "utility": SUBSTITUTE_UTILITY, "original": name, "unsafe_original": unsafe})
+
+    remove_utility = REMOVE_UTILITY if entry["essential"] else NON_ESSENTIAL_REMOVE_UTILITY
+    options.append({"kind": "remove", "item": name, "quantity": quantity, "price": 0.0,
+                    "protein": 0.0, "utility": remove_utility})
+    # An unsafe original has to go, so its protein doesn't count toward the floor
+    return options, price, 0.0 if unsafe else protein
+
+
+def _cost_buckets(price: float, step: float) -> int:
+    # Round up so a pick that fits in buckets also fits in dollars
+    return int(math.ceil(price / step - 1e-9))
+
+
+def _solve(option_sets, budget: float, protein_weight: float):
+    """Multiple-choice knapsack DP over discretized cost buckets."""
+    # Keep the table small: at most ~1000 cost buckets regardless of budget
+    step = max(0.05, budget / 1000.0)
+    capacity = int(budget / step)
+    best = np.zeros(capacity + 1)
+    choices = []
+
+    # One vector op per option instead of a Python loop over every bucket
+    for options in option_sets:
+        new_best = np.full(capacity + 1, -np.inf)
+        choice = np.full(capacity + 1, -1, dtype=np.int32)
+        for idx, o in enumerate(options):
+            cost = _cost_buckets(o["price"], step)
+            if cost > capacity:
+                continue
+            candidate = best[:capacity + 1 - cost] + (o["utility"] + protein_weight * o["protein"])
+            better = candidate > new_best[cost:]
+            new_best[cost:][better] = candidate[better]
+            choice[cost:][better] = idx
+        best = new_best
+        choices.append(choice)
+
+    end = int(np.argmax(best))
+    if best[end] == -np.inf:
+        return None
+
+    picked = []
+    c = end
+    for options, choice in zip(reversed(option_sets), reversed(choices)):
+        idx = int(choice[c])
+        picked.append(options[idx])
+        c -= _cost_buckets(options[idx]["price"], step)
+    picked.reverse()
+    return picked
+
+
+def _cheapest(option_sets):
+    return [min(options, key=lambda o: (o["price"], -o["utility"])) for options in option_sets]
+
+
+def optimize_shopping_list(shopping_list: dict, health_analysis: dict, budget: float,
+                           allergies=None, catalog: PriceCatalog = None) -> dict:
+    """Deterministically fits a shopping list to a budget. Same shape as the old LLM agent."""
+    started = time.perf_counter()
+    items = (shopping_list or {}).get("grocery_list", []) or []
+    allergy_set = _normalize_allergies(allergies)
+    budget = float(budget or 0)
+
+    option_sets = []
+    original_cost = 0.0
+    original_protein = 0.0
+    for item in items:
+        options, price, protein = _build_options(item, catalog, allergy_set)
+        option_sets.append(options)
+        original_cost += price
+        original_protein += protein
+
+    adequacy = ((health_analysis or {}).get("nutritional_analysis", {}) or {}).get("protein_adequacy", "adequate")
+    protein_floor = original_protein * PROTEIN_FLOOR.get(str(adequacy).lower(), 0.9)
+
+    picked = None
+    method = "keep_all"
+    if all(o[0]["kind"] == "keep" for o in option_sets) and original_cost <= budget:
+        picked = [o[0] for o in option_sets]
+    elif budget > 0:
+        method = "mckp_dp"
+        # Raise the protein weight until the floor is met (or give up after a few rounds)
+        for protein_weight in (0.0, 0.02, 0.05, 0.1, 0.25, 0.5):
+            picked = _solve(option_sets, budget, protein_weight)
+            if picked is None or sum(o["protein"] for o in picked) >= protein_floor:
+                break
+    if picked is None:
+        method = "cheapest"
+        picked = _cheapest(option_sets)
+
+    optimized_list, substitutions, removed = [], [], []
+    for option in picked:
+        if option["kind"] == "remove":
+            removed.append(option["item"])
+            continue
+        optimized_list.append({
+            "item": option["item"],
+            "quantity": option["quantity"],
+            "price": round(option["price"], 2),
+            "substituted_from": option.get("original"),
+        })
+        if option["kind"] == "substitute":
+            reason = "allergy safety" if option["unsafe_original"] else "lower cost, same food group"
+            substitutions.append({"original": option["original"], "replacement": option["item"],
+                                  "reason": reason})
+        elif option["kind"] == "reduce":
+            substitutions.append({"original": option["item"], "replacement": f"{option['item']} ({option['quantity']})",
+                                  "reason": "reduced quantity to fit budget"})
+
+    total_cost = round(sum(o["price"] for o in picked), 2)
+    protein_grams = sum(o["protein"] for o in picked)
+    protein_floor_met = protein_grams >= protein_floor - 1e-6
+    if abs(total_cost - budget) < 0.01:
+        budget_status = "exact"
+    elif total_cost < budget:
+        budget_status = "under"
+    else:
+        budget_status = "over"
+
+    return {
+        "optimized_list": optimized_list,
+        "total_cost": total_cost,
+        "savings": round(max(original_cost - total_cost, 0.0), 2),
+        "substitutions_made": substitutions,
+        "removed_items": removed,
+        "budget_status": budget_status,
+        "protein_grams": round(protein_grams, 1),
+        "protein_floor_grams": round(protein_floor, 1),
+        "protein_floor_met": protein_floor_met,
+        "solver": {"method": method, "solve_ms": round((time.perf_counter() - started) * 1000, 2)},
+    }
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) != 3 or sys.argv[1] != "load":
+        print("Usage: python pricing.py load <prices.csv>")
+        sys.exit(1)
+    conn = get_db()
+    init_price_catalog(conn, seed_csv=None)
+    print(f"Loaded {load_prices_from_csv(sys.argv[2], conn)} prices")
+    conn.close()
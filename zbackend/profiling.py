@@ -0,0 +1,300 @@
+# profiling.py - Opt-in per-request profiles: sampled stacks, SQL and LLM calls
+#
+# A request is profiled when it sends X-Profile: <PROFILE_ADMIN_TOKEN>, or when
+# it's picked at PROFILE_SAMPLE_RATE. While it runs, a sampler thread records
+# the Python stack of every thread working for it each PROFILE_INTERVAL_MS. That
+# covers the event loop thread, plus each worker thread (asyncio.to_thread) from
+# its first query or model call for the request. The hooks in db.py, llm.py and
+# metrics.span() add every SQL statement, LLM call and pipeline stage, each
+# with its offset from the request start and its duration. Statement text is
+# kept but parameters are not.
+#
+# Finished reports go into request_profiles. That table is shared by every
+# worker and keeps the newest PROFILE_KEEP reports. They're served by
+# /admin/profiles, and a profiled response carries X-Profile-Id to look its
+# report up.
+#
+# The event loop and the to_thread pool are shared, so samples from them can
+# include other requests that were running at the same time. Samples of idle
+# pool threads are skipped.
+#
+#   PROFILE_ADMIN_TOKEN   [unset]  enables the X-Profile header and /admin/profiles (X-Admin-Token)
+#   PROFILE_SAMPLE_RATE   [0]      fraction of all requests profiled without the header
+#   PROFILE_INTERVAL_MS   [5]      stack sampling interval
+#   PROFILE_KEEP          [200]    reports kept
+#   PROFILE_MAX_QUERIES   [1000]   SQL statements recorded per request (the rest are only counted)
+import contextvars
+import hmac
+import json
+import os
+import random
+import sqlite3
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import Optional
+
+ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN", "")
+SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+INTERVAL_SECONDS = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+MAX_QUERIES = int(os.getenv("PROFILE_MAX_QUERIES", "1000"))
+MAX_DEPTH = 64
+IDLE_POOL_THREAD = "thread.py:_worker"  # leaf frame of an executor thread waiting for work
+TOP_STACKS = 50
+TOP_FUNCTIONS = 30
+
+_current = contextvars.ContextVar("request_profile", default=None)
+
+
+class Profile:
+    def __init__(self, request_id: str, method: str, path: str, trigger: str):
+        self.request_id = request_id
+        self.method = method
+        self.path = path
+        self.trigger = trigger
+        self.created_at = datetime.now().isoformat()
+        self.started = time.perf_counter()
+        self.threads = {threading.get_ident()}  # the event loop thread
+        self.stacks = Counter()
+        self.samples = 0
+        self.queries = []
+        self.dropped_queries = 0
+        self.llm_calls = []
+        self.spans = []
+        self.done = False
+
+    def offset_ms(self, started: float) -> float:
+        return round((started - self.started) * 1000, 2)
+
+
+def is_admin(token: Optional[str]) -> bool:
+    return bool(ADMIN_TOKEN) and bool(token) and hmac.compare_digest(token, ADMIN_TOKEN)
+
+
+def trigger_for(profile_header: Optional[str]) -> Optional[str]:
+    """'header' / 'sampled' when this request should be profiled, else None."""
+    if profile_header and is_admin(profile_header):
+        return "header"
+    if SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE:
+        return "sampled"
+    return None
+
+
+# =============================================================================
+# Stack sampler
+# =============================================================================
+
+def _collapse(frame) -> str:
+    """root;...;leaf as file:function (the collapsed format flame graph tools read)."""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+
+class _Sampler:
+    """One thread per process, running only while some profile is active."""
+
+    def __init__(self):
+        self._active = set()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def add(self, profile: Profile):
+        with self._lock:
+            self._active.add(profile)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+                self._thread.start()
+
+    def remove(self, profile: Profile):
+        with self._lock:
+            self._active.discard(profile)
+
+    def _run(self):
+        own = threading.get_ident()
+        while True:
+            time.sleep(INTERVAL_SECONDS)
+            with self._lock:
+                if not self._active:
+                    self._thread = None
+                    return
+                active = list(self._active)
+            frames = sys._current_frames()
+            for profile in active:
+                for ident in list(profile.threads):
+                    frame = frames.get(ident)
+                    if frame is not None and ident != own:
+                        stack = _collapse(frame)
+                        if not stack.endswith(IDLE_POOL_THREAD):
+                            profile.stacks[stack] += 1
+                profile.samples += 1
+            del frames  # don't keep other threads' frames alive
+
+
+_sampler = _Sampler()
+
+
+# =============================================================================
+# Request lifecycle + hooks
+# =============================================================================
+
+def start(request_id: str, method: str, path: str, trigger: str):
+    """Begins profiling the current request. Returns (profile, token for detach())."""
+    profile = Profile(request_id, method, path, trigger)
+    token = _current.set(profile)
+    _sampler.add(profile)
+    return profile, token
+
+
+def detach(token):
+    _current.reset(token)
+
+
+def _active() -> Optional[Profile]:
+    profile = _current.get()
+    if profile is None or profile.done:
+        return None
+    profile.threads.add(threading.get_ident())  # worker threads join the sampled set on first use
+    return profile
+
+
+def record_query(sql: str, started: float, elapsed: float, many: bool = False):
+    profile = _active()
+    if profile is None:
+        return
+    if len(profile.queries) >= MAX_QUERIES:
+        profile.dropped_queries += 1
+        return
+    profile.queries.append({
+        "sql": " ".join(sql.split())[:500],
+        "offset_ms": profile.offset_ms(started),
+        "ms": round(elapsed * 1000, 3),
+        "many": many,
+    })
+
+
+def record_llm(call: str, model: str, started: float, elapsed: float, ok: bool, streamed: bool = False):
+    profile = _active()
+    if profile is not None:
+        profile.llm_calls.append({
+            "call": call, "model": model, "offset_ms": profile.offset_ms(started),
+            "ms": round(elapsed * 1000, 1), "ok": ok, "streamed": streamed,
+        })
+
+
+def record_span(name: str, started: float, elapsed: float, ok: bool):
+    profile = _active()
+    if profile is not None:
+        profile.spans.append({"span": name, "offset_ms": profile.offset_ms(started),
+                              "ms": round(elapsed * 1000, 1), "ok": ok})
+
+
+def finish(profile: Profile, status: int, route: str) -> dict:
+    """Stops sampling and builds the report."""
+    profile.done = True
+    _sampler.remove(profile)
+    duration = time.perf_counter() - profile.started
+
+    self_samples, total_samples = Counter(), Counter()
+    for stack, count in profile.stacks.items():
+        names = stack.split(";")
+        self_samples[names[-1]] += count
+        for name in set(names):
+            total_samples[name] += count
+
+    return {
+        "request_id": profile.request_id,
+        "created_at": profile.created_at,
+        "method": profile.method,
+        "path": profile.path,
+        "route": route,
+        "status": status,
+        "trigger": profile.trigger,
+        "duration_ms": round(duration * 1000, 1),
+        "interval_ms": INTERVAL_SECONDS * 1000,
+        "samples": profile.samples,
+        "threads": len(profile.threads),
+        "sql": {
+            "count": len(profile.queries) + profile.dropped_queries,
+            "total_ms": round(sum(q["ms"] for q in profile.queries), 1),
+            "dropped": profile.dropped_queries,
+            "queries": profile.queries,
+        },
+        "llm": {
+            "count": len(profile.llm_calls),
+            "total_ms": round(sum(c["ms"] for c in profile.llm_calls), 1),
+            "calls": profile.llm_calls,
+        },
+        "spans": profile.spans,
+        "top_functions": [{"function": name, "self_samples": count, "total_samples": total_samples[name]}
+                          for name, count in self_samples.most_common(TOP_FUNCTIONS)],
+        "stacks": [{"stack": stack, "samples": count} for stack, count in profile.stacks.most_common(TOP_STACKS)],
+    }
+
+
+# =============================================================================
+# Storage
+# =============================================================================
+
+def init_profiling(conn: sqlite3.Connection):
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS request_profiles (
+            request_id TEXT PRIMARY KEY,
+            created_at TEXT NOT NULL,
+            method TEXT,
+            route TEXT,
+            status INTEGER,
+            duration_ms REAL,
+            trigger TEXT,
+            report TEXT NOT NULL    -- finish() as JSON
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_request_profiles_created ON request_profiles (created_at)")
+    conn.commit()
+
+
+def save_profile(conn: sqlite3.Connection, report: dict):
+    conn.execute("""
+        INSERT OR REPLACE INTO request_profiles
+            (request_id, created_at, method, route, status, duration_ms, trigger, report)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    """, (report["request_id"], report["created_at"], report["method"], report["route"], report["status"],
+          report["duration_ms"], report["trigger"], json.dumps(report)))
+    conn.execute("""
+        DELETE FROM request_profiles WHERE request_id NOT IN (
+            SELECT request_id FROM request_profiles ORDER BY created_at DESC LIMIT ?
+        )
+    """, (KEEP,))
+    conn.commit()
+
+
+def list_profiles(conn: sqlite3.Connection, route: Optional[str] = None, limit: int = 50) -> list:
+    """Newest first, without the stacks / query lists."""
+    query = ("SELECT request_id, created_at, method, route, status, duration_ms, trigger, "
+             "json_extract(report, '$.path'), json_extract(report, '$.sql.count'), "
+             "json_extract(report, '$.sql.total_ms'), json_extract(report, '$.llm.count'), "
+             "json_extract(report, '$.llm.total_ms') FROM request_profiles")
+    params = []
+    if route:
+        query += " WHERE route = ?"
+        params.append(route)
+    query += " ORDER BY created_at DESC LIMIT ?"
+    params.append(max(1, min(limit, KEEP)))
+    return [{
+        "request_id": row[0], "created_at": row[1], "method": row[2], "route": row[3], "status": row[4],
+        "duration_ms": row[5], "trigger": row[6], "path": row[7], "sql_count": row[8], "sql_ms": row[9],
+        "llm_count": row[10], "llm_ms": row[11],
+    } for row in conn.execute(query, params)]
+
+
+def load_profile(conn: sqlite3.Connection, request_id: str) -> Optional[str]:
+    """The stored report as JSON text, or None."""
+    row = conn.execute("SELECT report FROM request_profiles WHERE request_id = ?", (request_id,)).fetchone()
+    return row[0] if row else None
@@ -0,0 +1,125 @@
+# prompt_compact.py - Dense prompt serialization + token budgets for the meal plan pipeline
+#
+# The agents used to paste json.dumps() of the whole meal plan / shopping list
+# into each prompt, so every stage paid for quotes, braces, indentation and
+# fields it never reads. These helpers render only what a stage needs as
+# pipe-separated tables (one header row, one row per item), count tokens, and
+# trim table rows to fit a per-stage budget before the call goes out.
+#
+# Token counts use tiktoken when it's installed, otherwise ~4 chars/token.
+#
+# Env: PROMPT_BUDGET_<STAGE> overrides a stage's input token budget,
+#      e.g. PROMPT_BUDGET_HEALTH_VALIDATION=3000
+import os
+
+try:
+    import tiktoken
+except ImportError:  # optional - the estimate is close enough for budgeting
+    tiktoken = None
+
+STAGE_TOKEN_BUDGETS = {
+    "meal_plan": 1200,
+    "shopping_list": 1200,
+    "health_validation": 1800,
+}
+
+_encodings = {}
+
+
+class PromptBudgetExceeded(ValueError):
+    """The fixed part of a prompt is already over its stage budget."""
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    if tiktoken is None:
+        return (len(text) + 3) // 4
+    encoding = _encodings.get(model)
+    if encoding is None:
+        try:
+            encoding = tiktoken.encoding_for_model(model)
+        except KeyError:
+            encoding = tiktoken.get_encoding("o200k_base")
+        _encodings[model] = encoding
+    return len(encoding.encode(text))
+
+
+def stage_budget(stage: str) -> int:
+    return int(os.getenv(f"PROMPT_BUDGET_{stage.upper()}", STAGE_TOKEN_BUDGETS.get(stage, 2000)))
+
+
+def _cell(value) -> str:
+    return str(value if value is not None else "").replace("|", "/").replace("\n", " ").strip()
+
+
+def table(header: tuple, rows: list) -> list:
+    """Header + rows as 'a|b|c' lines."""
+    return ["|".join(header)] + ["|".join(_cell(v) for v in row) for row in rows]
+
+
+def meal_plan_rows(week_plan: dict, with_calories: bool = True) -> list:
+    """week_plan -> day|meal|recipe[|kcal] lines (prep times and other fields dropped)."""
+    rows = []
+    for day, meals in (week_plan or {}).items():
+        if not isinstance(meals, dict):
+            continue
+        day_label = day.replace("day_", "d")
+        for meal, details in meals.items():
+            details = details if isinstance(details, dict) else {"recipe": details}
+            row = (day_label, meal, details.get("recipe", ""))
+            rows.append(row + (details.get("calories", ""),) if with_calories else row)
+    header = ("day", "meal", "recipe", "kcal") if with_calories else ("day", "meal", "recipe")
+    return table(header, rows)
+
+
+def shopping_list_rows(shopping_list: dict) -> list:
+    """grocery_list -> item|qty|cat lines."""
+    items = (shopping_list or {}).get("grocery_list", [])
+    return table(("item", "qty", "cat"), [
+        (i.get("item", ""), i.get("quantity", ""), i.get("category", "")) for i in items if isinstance(i, dict)
+    ])
+
+
+def fit_prompt(stage: str, template: str, model: str, **fields) -> tuple:
+    """
+    Fill `template` ({name} placeholders). Fields given as lists of table()
+    lines can be trimmed; anything else is inserted as-is. If the prompt is
+    over the stage budget, drop rows from the end of the largest table (noting
+    how many) until it fits. Returns (prompt, estimated_input_tokens).
+    """
+    budget = stage_budget(stage)
+    lines = {name: list(value) for name, value in fields.items() if isinstance(value, list)}
+    omitted = {name: 0 for name in lines}
+
+    def render():
+        filled = {name: str(value) for name, value in fields.items() if name not in lines}
+        for name, rows in lines.items():
+            text = "\n".join(rows)
+            if omitted[name]:
+                text += f"\n(+{omitted[name]} more rows omitted)"
+            filled[name] = text
+        return template.format(**filled)
+
+    prompt = render()
+    tokens = count_tokens(prompt, model)
+    while tokens > budget:
+        name = max(lines, key=lambda n: len(lines[n]), default=None)
+        if name is None or len(lines[name]) <= 2:  # header + one row left everywhere
+            raise PromptBudgetExceeded(f"{stage} prompt needs {tokens} tokens, budget is {budget}")
+        # Estimate how many rows to drop in one go instead of re-counting per row
+        per_row = max(1, count_tokens("\n".join(lines[name][1:]), model) // (len(lines[name]) - 1))
+        drop = min(len(lines[name]) - 2, max(1, (tokens - budget) // per_row + 1))
+        del lines[name][-drop:]
+        omitted[name] += drop
+        prompt = render()
+        tokens = count_tokens(prompt, model)
+    return prompt, tokens
+
+
+def token_usage(response, estimate: int) -> dict:
+    """Input/output tokens as billed (falls back to our estimate if usage is missing)."""
+    usage = getattr(response, "usage", None)
+    return {
+        "input": getattr(usage, "prompt_tokens", None) or estimate,
+        "output": getattr(usage, "completion_tokens", None) or 0,
+        "prompt_estimate": estimate,
+    }
@@ -0,0 +1,154 @@
+# sync.py - Change sequence numbers + tombstones for delta sync (/sync)
+#
+# Every insert/update on user_logs, exercise_logs and meal_plans stamps the row
+# with the next value of one global, monotonically increasing counter
+# (sync_state.seq), and every delete leaves a tombstone carrying its own
+# sequence number. All of it is done by triggers, so no write path has to
+# remember anything. A client keeps the highest sequence it has seen (the
+# cursor) and asks for everything after it.
+#
+# Tombstones older than SYNC_TOMBSTONE_DAYS are pruned; a client whose cursor
+# is older than the oldest retained tombstone is told to reset (full resync).
+# Archiving old log rows (archive.py) is not a delete: no tombstones, and
+# changes_since() still finds them in the archive.
+import json
+import os
+import sqlite3
+from datetime import datetime, timedelta
+
+from archive import ARCHIVED_TABLES, log_source
+
+SYNCED_TABLES = {
+    "user_logs": "id, timestamp, type, description, calories, protein, carbs, fats",
+    "exercise_logs": "id, exercise_type, start_time, end_time, duration_seconds, calories_burned",
+    "meal_plans": "id, created_at, plan_data, is_active",
+}
+TOMBSTONE_DAYS = int(os.getenv("SYNC_TOMBSTONE_DAYS", "90"))
+
+
+def _columns(cursor, table: str) -> set:
+    return {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+
+
+def init_sync(conn: sqlite3.Connection):
+    """Adds change_seq columns, the counter, tombstones and the stamping triggers."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            seq INTEGER NOT NULL,
+            min_valid_seq INTEGER NOT NULL DEFAULT 0  -- cursors below this missed pruned tombstones
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO sync_state (id, seq) VALUES (1, 0)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS sync_tombstones (
+            change_seq INTEGER PRIMARY KEY,
+            table_name TEXT NOT NULL,
+            row_id INTEGER NOT NULL,
+            user_id INTEGER,
+            deleted_at TEXT
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_sync_tombstones_user ON sync_tombstones (user_id, change_seq)")
+
+    for table in SYNCED_TABLES:
+        if "change_seq" not in _columns(cursor, table):
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN change_seq INTEGER NOT NULL DEFAULT 0")
+            # Existing rows: give each a unique sequence so paging by cursor works
+            seq = cursor.execute("SELECT seq FROM sync_state").fetchone()[0]
+            cursor.execute(f"UPDATE {table} SET change_seq = id + ?", (seq,))
+            top = cursor.execute(f"SELECT MAX(change_seq) FROM {table}").fetchone()[0]
+            if top:
+                cursor.execute("UPDATE sync_state SET seq = ?", (top,))
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_{table}_user_seq ON {table} (user_id, change_seq)")
+
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_seq_insert AFTER INSERT ON {table} BEGIN
+                UPDATE sync_state SET seq = seq + 1;
+                UPDATE {table} SET change_seq = (SELECT seq FROM sync_state) WHERE id = new.id;
+            END
+        """)
+        # WHEN guard: the stamping UPDATE itself mustn't count as another change
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_seq_update AFTER UPDATE ON {table}
+            WHEN new.change_seq = old.change_seq BEGIN
+                UPDATE sync_state SET seq = seq + 1;
+                UPDATE {table} SET change_seq = (SELECT seq FROM sync_state) WHERE id = new.id;
+            END
+        """)
+        # Rows moved to the archive (archive.py) aren't deletions as far as clients are concerned
+        cursor.execute(f"DROP TRIGGER IF EXISTS {table}_seq_delete")
+        cursor.execute(f"""
+            CREATE TRIGGER {table}_seq_delete AFTER DELETE ON {table}
+            WHEN NOT EXISTS (SELECT 1 FROM archive_state WHERE archiving = 1) BEGIN
+                UPDATE sync_state SET seq = seq + 1;
+                INSERT INTO sync_tombstones (change_seq, table_name, row_id, user_id, deleted_at)
+                VALUES ((SELECT seq FROM sync_state), '{table}', old.id, old.user_id, datetime('now'));
+            END
+        """)
+    conn.commit()
+
+
+def prune_tombstones(conn: sqlite3.Connection, days: int = TOMBSTONE_DAYS) -> int:
+    """Drops old tombstones; cursors older than the newest dropped one must resync."""
+    cursor = conn.cursor()
+    cutoff = (datetime.utcnow() - timedelta(days=days)).strftime("%Y-%m-%d %H:%M:%S")
+    newest = cursor.execute("SELECT MAX(change_seq) FROM sync_tombstones WHERE deleted_at < ?", (cutoff,)).fetchone()[0]
+    if newest is None:
+        return 0
+    pruned = cursor.execute("DELETE FROM sync_tombstones WHERE change_seq <= ?", (newest,)).rowcount
+    cursor.execute("UPDATE sync_state SET min_valid_seq = MAX(min_valid_seq, ?)", (newest,))
+    conn.commit()
+    return pruned
+
+
+def changes_since(conn: sqlite3.Connection, user_id: int, since: int, limit: int = 500) -> dict:
+    """
+    Rows changed and rows deleted after `since`, oldest change first, at most
+    `limit` entries. Pass the returned cursor as `since` next time; keep going
+    while has_more is true.
+    """
+    cursor = conn.cursor()
+    current_seq, min_valid_seq = cursor.execute("SELECT seq, min_valid_seq FROM sync_state").fetchone()
+    if 0 < since < min_valid_seq:
+        return {"reset": True, "cursor": 0, "has_more": True, "changes": {}, "deleted": []}
+
+    # Fetch up to `limit` per source, then keep the globally oldest `limit`
+    entries = []
+    for table, columns in SYNCED_TABLES.items():
+        # Old log rows may have moved to the archive; a client catching up from far back still needs them
+        source = log_source(conn, table, min_change_seq=since) if table in ARCHIVED_TABLES else table
+        cursor.execute(
+            f"SELECT change_seq, {columns} FROM {source} WHERE user_id = ? AND change_seq > ? "
+            f"ORDER BY change_seq LIMIT ?",
+            (user_id, since, limit + 1)
+        )
+        names = [d[0] for d in cursor.description]
+        for row in cursor.fetchall():
+            entries.append((row[0], table, dict(zip(names[1:], row[1:]))))
+    cursor.execute(
+        "SELECT change_seq, table_name, row_id FROM sync_tombstones WHERE user_id = ? AND change_seq > ? "
+        "ORDER BY change_seq LIMIT ?",
+        (user_id, since, limit + 1)
+    )
+    for seq, table, row_id in cursor.fetchall():
+        entries.append((seq, None, {"table": table, "id": row_id}))
+
+    entries.sort(key=lambda e: e[0])
+    has_more = len(entries) > limit
+    entries = entries[:limit]
+
+    changes = {table: [] for table in SYNCED_TABLES}
+    deleted = []
+    for seq, table, row in entries:
+        if table is None:
+            deleted.append(row)
+            continue
+        if table == "meal_plans" and row.get("plan_data"):
+            row["plan_data"] = json.loads(row["plan_data"])
+        changes[table].append(row)
+
+    # Nothing (more) for this user: jump the cursor to the present so the next call is cheap
+    next_cursor = entries[-1][0] if has_more else max(since, current_seq)
+    return {"reset": False, "cursor": next_cursor, "has_more": has_more, "changes": changes, "deleted": deleted}
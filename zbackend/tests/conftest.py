@@ -0,0 +1,44 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import archive  # noqa: E402
+import db  # noqa: E402
+
+INSERT_FOOD = ("INSERT INTO user_logs (user_id, timestamp, type, description, calories, protein, carbs, fats) "
+               "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+INSERT_EXERCISE = ("INSERT INTO exercise_logs (user_id, exercise_type, start_time, end_time, duration_seconds, "
+                   "calories_burned) VALUES (?, ?, ?, ?, ?, ?)")
+
+
+@pytest.fixture
+def db_path(tmp_path, monkeypatch):
+    """A fresh app database (full schema + triggers) in a temp dir; get_db() points at it."""
+    path = str(tmp_path / "fitness.db")
+    monkeypatch.setattr(db, "DB_PATH", path)
+    monkeypatch.setattr(archive, "ARCHIVE_DB_PATH", str(tmp_path / "fitness-archive.db"))
+    from app import init_db  # late: app pulls in everything else
+    init_db()
+    return path
+
+
+@pytest.fixture
+def conn(db_path):
+    connection = db.get_db()
+    yield connection
+    connection.close()
+
+
+def log_food(conn, user_id: int, timestamp: str, calories: int, description: str = "banana") -> int:
+    row_id = conn.execute(INSERT_FOOD, (user_id, timestamp, "Snack", description, calories, 1, 20, 0)).lastrowid
+    conn.commit()
+    return row_id
+
+
+def log_exercise(conn, user_id: int, start: str, end: str, seconds: int, calories: int) -> int:
+    row_id = conn.execute(INSERT_EXERCISE, (user_id, "running", start, end, seconds, calories)).lastrowid
+    conn.commit()
+    return row_id
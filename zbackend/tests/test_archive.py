@@ -0,0 +1,136 @@
+import sqlite3
+
+import pytest
+
+import db
+from archive import archive_table, log_source
+
+from conftest import log_food
+
+
+class CrashBeforeDelete(db.TimedConnection):
+    """Dies in archive_table's second transaction, after the copy committed."""
+
+    def execute(self, sql, parameters=()):
+        if sql.lstrip().startswith("DELETE FROM main."):
+            raise sqlite3.OperationalError("simulated crash")
+        return super().execute(sql, parameters)
+
+
+def _explicit(connection):
+    connection.isolation_level = None  # archive_table runs its own transactions
+    return connection
+
+
+def _visible(conn, user_id: int = 1) -> list:
+    """Row ids as every history reader sees them (hot + live archive rows)."""
+    return sorted(row[0] for row in conn.execute(
+        f"SELECT id FROM {log_source(conn, 'user_logs', since='2000-01-01')} WHERE user_id = ?", (user_id,)))
+
+
+def _watermark(conn) -> str:
+    return conn.execute("SELECT archived_before FROM archive_state WHERE table_name = 'user_logs'").fetchone()[0]
+
+
+def test_old_rows_move_to_monthly_partitions(conn):
+    _explicit(conn)
+    old = [log_food(conn, 1, "2024-01-05T08:00:00", 100), log_food(conn, 1, "2024-02-03T08:00:00", 200)]
+    recent = log_food(conn, 1, "2024-06-01T08:00:00", 300)
+
+    assert archive_table(conn, "user_logs", "2024-03-01") == 2
+    assert [r[0] for r in conn.execute("SELECT id FROM main.user_logs")] == [recent]
+    assert _watermark(conn) == "2024-03-01"
+    assert [r[:3] for r in conn.execute(
+        "SELECT table_name, partition, row_count FROM archive_partitions ORDER BY partition")] == [
+        ("user_logs", "2024_01", 1), ("user_logs", "2024_02", 1)]
+    assert _visible(conn) == sorted(old + [recent])
+
+    # Moving isn't deleting: no tombstones for /sync
+    assert conn.execute("SELECT COUNT(*) FROM sync_tombstones").fetchone()[0] == 0
+
+
+def test_rerun_without_new_rows_moves_nothing(conn):
+    _explicit(conn)
+    log_food(conn, 1, "2024-01-05T08:00:00", 100)
+    log_food(conn, 1, "2024-06-01T08:00:00", 300)
+    assert archive_table(conn, "user_logs", "2024-03-01") == 1
+    assert archive_table(conn, "user_logs", "2024-03-01") == 0
+    assert len(_visible(conn)) == 2
+
+
+def test_newest_row_stays_hot_so_ids_are_not_reused(conn):
+    _explicit(conn)
+    first = log_food(conn, 1, "2024-01-05T08:00:00", 100)
+    newest = log_food(conn, 1, "2024-01-06T08:00:00", 200)
+
+    assert archive_table(conn, "user_logs", "2024-03-01") == 1
+    assert [r[0] for r in conn.execute("SELECT id FROM main.user_logs")] == [newest]
+
+    added = log_food(conn, 1, "2024-01-07T08:00:00", 300)
+    assert added > newest
+    archive_table(conn, "user_logs", "2024-03-01")
+    calories = dict(conn.execute(
+        f"SELECT id, calories FROM {log_source(conn, 'user_logs', since='2000-01-01')}").fetchall())
+    assert calories == {first: 100, newest: 200, added: 300}
+
+
+def test_crash_between_copy_and_delete_does_not_double_count(conn, db_path):
+    _explicit(conn)
+    early = log_food(conn, 1, "2024-01-05T08:00:00", 100)
+    recent = log_food(conn, 1, "2024-06-01T08:00:00", 300)
+    archive_table(conn, "user_logs", "2024-01-10")
+    late = log_food(conn, 1, "2024-01-20T08:00:00", 200)  # same month, after the watermark
+    newest = log_food(conn, 1, "2024-06-02T08:00:00", 400)
+
+    crashing = _explicit(sqlite3.connect(db_path, factory=CrashBeforeDelete))
+    try:
+        with pytest.raises(sqlite3.OperationalError):
+            archive_table(crashing, "user_logs", "2024-01-25")
+    finally:
+        crashing.close()
+
+    # The copy landed in the already-listed 2024_01 partition, but the watermark didn't move
+    archived = [r[0] for r in conn.execute("SELECT id FROM archive.user_logs_2024_01 ORDER BY id")]
+    assert archived == [early, late]
+    assert _watermark(conn) == "2024-01-10"
+    assert conn.execute("SELECT archiving FROM archive_state WHERE table_name = 'user_logs'").fetchone()[0] == 0
+    assert _visible(conn) == [early, recent, late, newest]
+
+    # The retry finishes the move
+    assert archive_table(conn, "user_logs", "2024-01-25") == 1
+    assert _watermark(conn) == "2024-01-25"
+    assert [r[0] for r in conn.execute("SELECT id FROM main.user_logs ORDER BY id")] == [recent, newest]
+    assert _visible(conn) == [early, recent, late, newest]
+
+
+def test_rows_updated_after_the_copy_stay_hot(conn, db_path):
+    _explicit(conn)
+    row_id = log_food(conn, 1, "2024-01-05T08:00:00", 100)
+    transactions = []
+
+    class UpdateBeforeDelete(db.TimedConnection):
+        """Edits the row from another connection between the copy and the delete transactions."""
+
+        def execute(self, sql, parameters=()):
+            if sql.startswith("BEGIN"):
+                transactions.append(sql)
+                if len(transactions) == 2:
+                    other = db.get_db()
+                    other.execute("UPDATE user_logs SET calories = 150 WHERE id = ?", (row_id,))
+                    other.commit()
+                    other.close()
+            return super().execute(sql, parameters)
+
+    log_food(conn, 1, "2024-06-01T08:00:00", 300)  # the newest row never moves
+    racing = _explicit(sqlite3.connect(db_path, factory=UpdateBeforeDelete))
+    try:
+        assert archive_table(racing, "user_logs", "2024-03-01") == 0
+    finally:
+        racing.close()
+
+    # The edited row stays hot and the next run archives the new version
+    assert conn.execute("SELECT calories FROM main.user_logs WHERE id = ?", (row_id,)).fetchone()[0] == 150
+    assert archive_table(conn, "user_logs", "2024-03-01") == 1
+    calories = [r[0] for r in conn.execute(
+        f"SELECT calories FROM {log_source(conn, 'user_logs', since='2000-01-01')} WHERE id = ?", (row_id,))]
+    assert calories == [150]
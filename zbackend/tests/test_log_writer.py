@@ -0,0 +1,70 @@
+import sqlite3
+
+import pytest
+
+import db
+from log_writer import LogWriter
+
+from conftest import INSERT_FOOD
+
+
+def _food(user_id: int, description: str) -> tuple:
+    return (user_id, "2024-05-01T12:00:00", "Snack", description, 100, 1, 2, 3)
+
+
+def test_failed_batch_retries_rows_one_by_one(conn):
+    writer = LogWriter(max_wait=0.2, max_batch=16)
+    try:
+        good = writer.submit(INSERT_FOOD, _food(1, "apple"))
+        bad = writer.submit("INSERT INTO no_such_table (x) VALUES (?)", (1,))
+        also_good = writer.submit(INSERT_FOOD, _food(1, "pear"))
+
+        first, second = good.result(timeout=5), also_good.result(timeout=5)
+        with pytest.raises(sqlite3.OperationalError):
+            bad.result(timeout=5)
+    finally:
+        writer.close()
+
+    rows = conn.execute("SELECT id, description FROM user_logs ORDER BY id").fetchall()
+    assert rows == [(first, "apple"), (second, "pear")]
+
+
+def test_acknowledged_rows_are_committed(conn):
+    writer = LogWriter(max_wait=0.01)
+    try:
+        row_ids = [writer.insert(INSERT_FOOD, _food(1, f"item {i}")) for i in range(5)]
+    finally:
+        writer.close()
+
+    # A separate connection only sees committed data
+    other = db.get_db()
+    try:
+        stored = [row[0] for row in other.execute("SELECT id FROM user_logs ORDER BY id")]
+    finally:
+        other.close()
+    assert stored == row_ids
+
+
+@pytest.mark.parametrize("durability, synchronous, journal_mode", [
+    ("full", 2, "delete"),
+    ("normal", 1, "wal"),
+    ("off", 0, "wal"),
+])
+def test_durability_modes(db_path, durability, synchronous, journal_mode):
+    writer = LogWriter(durability=durability)
+    connection = writer._connect()
+    try:
+        assert connection.execute("PRAGMA synchronous").fetchone()[0] == synchronous
+        assert connection.execute("PRAGMA journal_mode").fetchone()[0] == journal_mode
+    finally:
+        connection.close()
+
+    try:
+        assert writer.insert(INSERT_FOOD, _food(1, durability)) > 0
+    finally:
+        writer.close()
+
+
+def test_unknown_durability_is_rejected():
+    with pytest.raises(ValueError):
+        LogWriter(durability="sometimes")
@@ -0,0 +1,75 @@
+from sync import changes_since, prune_tombstones
+
+from conftest import log_food
+
+
+def _seq(conn, table: str, row_id: int) -> int:
+    return conn.execute(f"SELECT change_seq FROM {table} WHERE id = ?", (row_id,)).fetchone()[0]
+
+
+def test_inserts_and_updates_get_increasing_sequence_numbers(conn):
+    first = log_food(conn, 1, "2024-05-01T08:00:00", 100)
+    second = log_food(conn, 1, "2024-05-01T09:00:00", 200)
+    assert _seq(conn, "user_logs", second) > _seq(conn, "user_logs", first)
+
+    conn.execute("UPDATE user_logs SET calories = 150 WHERE id = ?", (first,))
+    conn.commit()
+    assert _seq(conn, "user_logs", first) > _seq(conn, "user_logs", second)
+    assert conn.execute("SELECT seq FROM sync_state").fetchone()[0] == _seq(conn, "user_logs", first)
+
+
+def test_changes_since_pages_by_cursor(conn):
+    ids = [log_food(conn, 1, f"2024-05-01T0{i}:00:00", 100 + i) for i in range(5)]
+    log_food(conn, 2, "2024-05-01T10:00:00", 999)  # someone else's
+
+    page = changes_since(conn, 1, 0, limit=3)
+    assert [r["id"] for r in page["changes"]["user_logs"]] == ids[:3]
+    assert page["has_more"]
+
+    page = changes_since(conn, 1, page["cursor"], limit=3)
+    assert [r["id"] for r in page["changes"]["user_logs"]] == ids[3:]
+    assert not page["has_more"]
+
+    assert changes_since(conn, 1, page["cursor"])["changes"]["user_logs"] == []
+
+
+def test_delete_leaves_a_tombstone(conn):
+    row_id = log_food(conn, 1, "2024-05-01T08:00:00", 100)
+    cursor = changes_since(conn, 1, 0)["cursor"]
+
+    conn.execute("DELETE FROM user_logs WHERE id = ?", (row_id,))
+    conn.commit()
+
+    result = changes_since(conn, 1, cursor)
+    assert result["deleted"] == [{"table": "user_logs", "id": row_id}]
+    assert result["cursor"] > cursor
+
+
+def test_archiving_delete_leaves_no_tombstone(conn):
+    row_id = log_food(conn, 1, "2024-05-01T08:00:00", 100)
+    conn.execute("UPDATE archive_state SET archiving = 1")
+    conn.execute("DELETE FROM user_logs WHERE id = ?", (row_id,))
+    conn.execute("UPDATE archive_state SET archiving = 0")
+    conn.commit()
+
+    assert conn.execute("SELECT COUNT(*) FROM sync_tombstones").fetchone()[0] == 0
+
+
+def test_pruning_old_tombstones_forces_a_reset_for_stale_cursors(conn):
+    old = log_food(conn, 1, "2024-01-01T08:00:00", 100)
+    recent = log_food(conn, 1, "2024-05-01T08:00:00", 200)
+    stale_cursor = changes_since(conn, 1, 0)["cursor"]
+    conn.execute("DELETE FROM user_logs WHERE id IN (?, ?)", (old, recent))
+    old_seq = conn.execute("SELECT change_seq FROM sync_tombstones WHERE row_id = ?", (old,)).fetchone()[0]
+    conn.execute("UPDATE sync_tombstones SET deleted_at = datetime('now', '-200 days') WHERE row_id = ?", (old,))
+    conn.commit()
+
+    assert prune_tombstones(conn, days=90) == 1
+    assert conn.execute("SELECT min_valid_seq FROM sync_state").fetchone()[0] == old_seq
+    assert [r[0] for r in conn.execute("SELECT row_id FROM sync_tombstones")] == [recent]
+
+    # A cursor from before the pruned tombstone missed a delete: full resync
+    assert changes_since(conn, 1, stale_cursor)["reset"]
+    # A fresh client and an up-to-date cursor are fine
+    assert not changes_since(conn, 1, 0)["reset"]
+    assert not changes_since(conn, 1, old_seq)["reset"]
@@ -0,0 +1,92 @@
+from datetime import date, timedelta
+
+from trends import compute_trends, refresh_rollups
+
+from conftest import log_exercise, log_food
+
+TODAY = date(2024, 5, 10)
+
+
+def _day(days_ago: int) -> str:
+    return (TODAY - timedelta(days=days_ago)).isoformat()
+
+
+def _rolled_through(conn, user_id: int) -> str:
+    return conn.execute("SELECT rolled_through FROM rollup_state WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+
+def _rollup(conn, user_id: int, day: str):
+    return conn.execute("SELECT calories_in, food_logs, calories_out FROM daily_rollups WHERE user_id = ? AND day = ?",
+                        (user_id, day)).fetchone()
+
+
+def test_refresh_rolls_up_finished_days_only(conn):
+    log_food(conn, 1, f"{_day(3)}T08:00:00", 300)
+    log_food(conn, 1, f"{_day(3)}T12:00:00", 500)
+    log_exercise(conn, 1, f"{_day(2)}T07:00:00", f"{_day(2)}T07:30:00", 1800, 250)
+    log_food(conn, 1, f"{_day(0)}T08:00:00", 400)
+
+    assert refresh_rollups(conn, 1, TODAY) == _day(1)
+    assert _rollup(conn, 1, _day(3)) == (800, 2, 0)
+    assert _rollup(conn, 1, _day(2)) == (0, 0, 250)
+    assert _rollup(conn, 1, _day(0)) is None  # today stays raw
+
+
+def test_late_insert_invalidates_the_rolled_up_day(conn):
+    log_food(conn, 1, f"{_day(3)}T08:00:00", 300)
+    refresh_rollups(conn, 1, TODAY)
+
+    log_food(conn, 1, f"{_day(3)}T20:00:00", 200)
+    assert _rolled_through(conn, 1) == _day(4)
+
+    refresh_rollups(conn, 1, TODAY)
+    assert _rollup(conn, 1, _day(3)) == (500, 2, 0)
+
+
+def test_update_invalidates_both_the_old_and_new_day(conn):
+    row_id = log_food(conn, 1, f"{_day(2)}T08:00:00", 300)
+    refresh_rollups(conn, 1, TODAY)
+
+    conn.execute("UPDATE user_logs SET timestamp = ? WHERE id = ?", (f"{_day(5)}T08:00:00", row_id))
+    conn.commit()
+    assert _rolled_through(conn, 1) == _day(6)
+
+    refresh_rollups(conn, 1, TODAY)
+    assert _rollup(conn, 1, _day(5)) == (300, 1, 0)
+    assert _rollup(conn, 1, _day(2)) is None
+
+
+def test_delete_invalidates_and_archiving_does_not(conn):
+    kept = log_food(conn, 1, f"{_day(3)}T08:00:00", 300)
+    dropped = log_food(conn, 1, f"{_day(3)}T09:00:00", 100)
+    refresh_rollups(conn, 1, TODAY)
+
+    conn.execute("UPDATE archive_state SET archiving = 1")
+    conn.execute("DELETE FROM user_logs WHERE id = ?", (kept,))
+    conn.execute("UPDATE archive_state SET archiving = 0")
+    conn.commit()
+    assert _rolled_through(conn, 1) == _day(1)
+
+    conn.execute("DELETE FROM user_logs WHERE id = ?", (dropped,))
+    conn.commit()
+    assert _rolled_through(conn, 1) == _day(4)
+
+
+def test_other_users_rollups_are_untouched(conn):
+    log_food(conn, 1, f"{_day(3)}T08:00:00", 300)
+    log_food(conn, 2, f"{_day(3)}T08:00:00", 300)
+    refresh_rollups(conn, 1, TODAY)
+    refresh_rollups(conn, 2, TODAY)
+
+    log_food(conn, 1, f"{_day(3)}T10:00:00", 50)
+    assert _rolled_through(conn, 1) == _day(4)
+    assert _rolled_through(conn, 2) == _day(1)
+
+
+def test_trends_match_after_invalidation(conn):
+    log_food(conn, 1, f"{_day(1)}T08:00:00", 1000)
+    compute_trends(conn, 1, 2000, 7, TODAY)
+    log_food(conn, 1, f"{_day(1)}T19:00:00", 1000)
+
+    daily = {d["date"]: d for d in compute_trends(conn, 1, 2000, 7, TODAY)["daily"]}
+    assert daily[_day(1)]["calories_in"] == 2000
@@ -0,0 +1,220 @@
+# trends.py - Daily / weekly / monthly progress series for /trends
+#
+# Per-day totals (food calories + macros, exercise calories + minutes) are
+# pulled in one grouped query and everything else is numpy over a dense day
+# axis: weekly (ISO, Monday-start) and monthly buckets via reduceat, rolling
+# averages via cumulative sums, adherence against the user's target.
+#
+# Finished days are kept in daily_rollups so a long history is read as one
+# small row per day instead of every log. rollup_state.rolled_through marks
+# how far a user's rollups are complete; triggers on user_logs/exercise_logs
+# move it back when a log for an already rolled-up day changes, and the next
+# /trends call recomputes from there. Today is never rolled up. Raw reads go
+# through archive.log_source(), so days whose logs were archived still add up.
+import os
+import sqlite3
+from datetime import date, timedelta
+
+import numpy as np
+
+from archive import log_source
+
+ADHERENCE_TOLERANCE = float(os.getenv("TRENDS_ADHERENCE_TOLERANCE", "0.1"))  # within +-10% of target
+MAX_DAYS = int(os.getenv("TRENDS_MAX_DAYS", str(5 * 366)))
+
+FIELDS = ("calories_in", "protein", "carbs", "fats", "food_logs", "calories_out", "exercise_seconds", "sessions")
+
+
+def init_trends(conn: sqlite3.Connection):
+    """daily_rollups + coverage per user + the triggers that invalidate it."""
+    cursor = conn.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS daily_rollups (
+            user_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            calories_in INTEGER NOT NULL DEFAULT 0,
+            protein INTEGER NOT NULL DEFAULT 0,
+            carbs INTEGER NOT NULL DEFAULT 0,
+            fats INTEGER NOT NULL DEFAULT 0,
+            food_logs INTEGER NOT NULL DEFAULT 0,
+            calories_out INTEGER NOT NULL DEFAULT 0,
+            exercise_seconds INTEGER NOT NULL DEFAULT 0,
+            sessions INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS rollup_state (
+            user_id INTEGER PRIMARY KEY,
+            rolled_through TEXT NOT NULL   -- every day <= this has its rollup (or had no activity)
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_exercise_logs_user_start ON exercise_logs (user_id, start_time)")
+
+    # A change to a rolled-up day pulls coverage back to the day before it
+    for table, day_column in (("user_logs", "timestamp"), ("exercise_logs", "start_time")):
+        for event, rows in (("INSERT", ("new",)), ("UPDATE", ("old", "new")), ("DELETE", ("old",))):
+            body = "".join(f"""
+                UPDATE rollup_state SET rolled_through = date({row}.{day_column}, '-1 day')
+                WHERE user_id = {row}.user_id AND rolled_through >= date({row}.{day_column});"""
+                           for row in rows)
+            # Archiving deletes rows whose days are already rolled up (see archive.py)
+            guard = " WHEN NOT EXISTS (SELECT 1 FROM archive_state WHERE archiving = 1)" if event == "DELETE" else ""
+            cursor.execute(f"DROP TRIGGER IF EXISTS {table}_rollup_{event.lower()}")
+            cursor.execute(f"""
+                CREATE TRIGGER {table}_rollup_{event.lower()} AFTER {event} ON {table}{guard} BEGIN
+                    {body}
+                END
+            """)
+    conn.commit()
+
+
+def _aggregate_raw(conn: sqlite3.Connection, user_id: int, start: str, end: str) -> list:
+    """(day, *FIELDS) straight from the logs, one row per active day in [start, end]."""
+    # Upper bound is exclusive on the next day so full ISO timestamps on `end` are included
+    stop = (date.fromisoformat(end) + timedelta(days=1)).isoformat()
+    return conn.execute(f"""
+        SELECT day, SUM(calories_in), SUM(protein), SUM(carbs), SUM(fats), SUM(food_logs),
+               SUM(calories_out), SUM(exercise_seconds), SUM(sessions)
+        FROM (
+            SELECT DATE(timestamp) AS day, COALESCE(calories, 0) AS calories_in, COALESCE(protein, 0) AS protein,
+                   COALESCE(carbs, 0) AS carbs, COALESCE(fats, 0) AS fats, 1 AS food_logs,
+                   0 AS calories_out, 0 AS exercise_seconds, 0 AS sessions
+            FROM {log_source(conn, "user_logs", since=start)} WHERE user_id = ? AND timestamp >= ? AND timestamp < ?
+            UNION ALL
+            SELECT DATE(start_time), 0, 0, 0, 0, 0,
+                   COALESCE(calories_burned, 0), COALESCE(duration_seconds, 0), 1
+            FROM {log_source(conn, "exercise_logs", since=start)}
+            WHERE user_id = ? AND start_time >= ? AND start_time < ? AND end_time IS NOT NULL
+        )
+        GROUP BY day
+    """, (user_id, start, stop, user_id, start, stop)).fetchall()
+
+
+def refresh_rollups(conn: sqlite3.Connection, user_id: int, today: date) -> str:
+    """Rolls up every finished day not covered yet. Returns the new rolled_through day."""
+    yesterday = (today - timedelta(days=1)).isoformat()
+    row = conn.execute("SELECT rolled_through FROM rollup_state WHERE user_id = ?", (user_id,)).fetchone()
+    if row is not None and row[0] >= yesterday:
+        return row[0]
+    if row is None:
+        first = conn.execute(f"""
+            SELECT MIN(day) FROM (
+                SELECT MIN(DATE(timestamp)) AS day FROM {log_source(conn, "user_logs")} WHERE user_id = ?
+                UNION ALL SELECT MIN(DATE(start_time)) FROM {log_source(conn, "exercise_logs")} WHERE user_id = ?
+            )
+        """, (user_id, user_id)).fetchone()[0]
+        start = first or today.isoformat()
+    else:
+        start = (date.fromisoformat(row[0]) + timedelta(days=1)).isoformat()
+
+    if start <= yesterday:
+        rows = _aggregate_raw(conn, user_id, start, yesterday)
+        conn.execute("DELETE FROM daily_rollups WHERE user_id = ? AND day >= ? AND day <= ?", (user_id, start, yesterday))
+        conn.executemany(
+            f"INSERT INTO daily_rollups (user_id, day, {', '.join(FIELDS)}) VALUES (?, ?, {', '.join('?' * len(FIELDS))})",
+            [(user_id, *r) for r in rows if r[0] is not None]
+        )
+    conn.execute("INSERT OR REPLACE INTO rollup_state (user_id, rolled_through) VALUES (?, ?)", (user_id, yesterday))
+    conn.commit()
+    return yesterday
+
+
+def _rolling_mean(values: np.ndarray, weights: np.ndarray, window: int) -> np.ndarray:
+    """Trailing mean over the last `window` days, counting only days with weight (NaN when none)."""
+    sums = np.cumsum(np.insert(values * weights, 0, 0.0))
+    counts = np.cumsum(np.insert(weights, 0, 0.0))
+    lo = np.maximum(np.arange(1, len(values) + 1) - window, 0)
+    hi = np.arange(1, len(values) + 1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (sums[hi] - sums[lo]) / (counts[hi] - counts[lo])
+
+
+def _buckets(days: np.ndarray, key: np.ndarray, columns: dict, target: int) -> list:
+    """Sums per bucket of consecutive equal `key` values, plus per-bucket averages and adherence."""
+    starts = np.flatnonzero(np.concatenate(([True], key[1:] != key[:-1])))
+    sums = {name: np.add.reduceat(values, starts) for name, values in columns.items()}
+    span_days = np.diff(np.append(starts, len(days)))
+    logged = sums["logged"]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_in = np.where(logged > 0, sums["calories_in"] / logged, np.nan)
+        adherence = np.where(logged > 0, sums["adherent"] / logged, np.nan)
+    return [{
+        "start": str(days[s]),
+        "days": int(span_days[i]),
+        "logged_days": int(logged[i]),
+        "calories_in": int(sums["calories_in"][i]),
+        "protein": int(sums["protein"][i]),
+        "carbs": int(sums["carbs"][i]),
+        "fats": int(sums["fats"][i]),
+        "calories_out": int(sums["calories_out"][i]),
+        "exercise_minutes": int(sums["exercise_seconds"][i] // 60),
+        "sessions": int(sums["sessions"][i]),
+        "avg_calories_in": None if np.isnan(avg_in[i]) else round(float(avg_in[i])),
+        "avg_vs_target": None if np.isnan(avg_in[i]) else round(float(avg_in[i]) - target),
+        "adherence": None if np.isnan(adherence[i]) else round(float(adherence[i]), 3),
+    } for i, s in enumerate(starts)]
+
+
+def compute_trends(conn: sqlite3.Connection, user_id: int, target: int, days: int, today: date) -> dict:
+    """Daily series (with 7/28-day rolling averages) plus weekly and monthly buckets for the last `days` days."""
+    days = max(1, min(days, MAX_DAYS))
+    start = today - timedelta(days=days - 1)
+    rolled_through = refresh_rollups(conn, user_id, today)
+
+    # Rolled-up range from daily_rollups, the rest (at least today) from the raw logs
+    rows = conn.execute(
+        f"SELECT day, {', '.join(FIELDS)} FROM daily_rollups WHERE user_id = ? AND day >= ? AND day <= ?",
+        (user_id, start.isoformat(), rolled_through)
+    ).fetchall()
+    raw_from = max(start, date.fromisoformat(rolled_through) + timedelta(days=1))
+    rows += _aggregate_raw(conn, user_id, raw_from.isoformat(), today.isoformat())
+
+    axis = np.arange(np.datetime64(start), np.datetime64(today) + 1, dtype="datetime64[D]")
+    matrix = np.zeros((len(axis), len(FIELDS)))
+    if rows:
+        index = (np.array([r[0] for r in rows], dtype="datetime64[D]") - axis[0]).astype(np.int64)
+        keep = (index >= 0) & (index < len(axis))
+        np.add.at(matrix, index[keep], np.array([r[1:] for r in rows], dtype=np.float64)[keep])
+    columns = {name: matrix[:, i] for i, name in enumerate(FIELDS)}
+
+    logged = (columns["food_logs"] > 0).astype(np.float64)
+    adherent = logged * (np.abs(columns["calories_in"] - target) <= ADHERENCE_TOLERANCE * target)
+    columns.update(logged=logged, adherent=adherent)
+    rolling_7 = _rolling_mean(columns["calories_in"], logged, 7)
+    rolling_28 = _rolling_mean(columns["calories_in"], logged, 28)
+
+    day_numbers = axis.astype(np.int64)
+    weeks = day_numbers - (day_numbers + 3) % 7  # 1970-01-01 was a Thursday -> Monday-start weeks
+    months = axis.astype("datetime64[M]")
+    bucketed = {k: v for k, v in columns.items() if k != "food_logs"}
+
+    def _maybe(value):
+        return None if np.isnan(value) else round(float(value))
+
+    daily = [{
+        "date": str(axis[i]),
+        "calories_in": int(columns["calories_in"][i]),
+        "protein": int(columns["protein"][i]),
+        "carbs": int(columns["carbs"][i]),
+        "fats": int(columns["fats"][i]),
+        "calories_out": int(columns["calories_out"][i]),
+        "net_calories": int(columns["calories_in"][i] - columns["calories_out"][i]),
+        "exercise_minutes": int(columns["exercise_seconds"][i] // 60),
+        "logged": bool(logged[i]),
+        "on_target": bool(adherent[i]),
+        "avg_7d": _maybe(rolling_7[i]),
+        "avg_28d": _maybe(rolling_28[i]),
+    } for i in range(len(axis))]
+
+    total_logged = int(logged.sum())
+    return {
+        "target_calories": target,
+        "start": str(axis[0]),
+        "end": str(axis[-1]),
+        "logged_days": total_logged,
+        "adherence": round(float(adherent.sum()) / total_logged, 3) if total_logged else None,
+        "daily": daily,
+        "weekly": _buckets(axis, weeks, bucketed, target),
+        "monthly": _buckets(axis, months, bucketed, target),
+    }